@@ -0,0 +1,196 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""Benchmark exports against a local stand-in for the Zotero web API.
+
+For each library size, serves a synthetic library with :mod:`mockapi`
+(each response delayed by ``--latency``) and times:
+
+- exporting the reference of single items (`export_item`),
+- exporting the bibliography of the largest collection
+  (`export_group`),
+- the citations and references of ``--keys`` items at once
+  (`items_bibliography`, as for a works-cited list).
+
+Each is timed with a style only the web API formats (`rtf-scan`), then
+again (from the reference cache or answered by `304 Not Modified`),
+and with a style ZotQuery formats locally (`chicago-author-date`).
+The requests and bytes each phase costs are counted by the server.
+
+Each size runs in a separate process with its own workflow data and
+cache directories under ``<workdir>``. Generated libraries are kept
+and reused.
+
+Usage:
+    exportbench.py [<size>...] [--seed=<n>] [--latency=<ms>]
+                   [--items=<n>] [--keys=<n>] [--workdir=<dir>]
+                   [--json=<path>]
+
+Options:
+    <size>          1k, 10k, 100k, 500k or a number of items [default: 1k]
+    --seed=<n>      Seed for library [default: 1]
+    --latency=<ms>  Delay of each API response [default: 50]
+    --items=<n>     Number of single items exported [default: 20]
+    --keys=<n>      Number of items in the bibliography [default: 300]
+    --workdir=<dir> Where to put libraries and data [default: /tmp/zqexport]
+    --json=<path>   Also write results as JSON to <path>
+
+"""
+
+from __future__ import print_function, unicode_literals
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+import mockapi
+import searchbench
+import synthlib
+
+# Styles formatted by the web API and by ZotQuery itself
+WEB_STYLE = 'rtf-scan'
+LOCAL_STYLE = 'chicago-author-date'
+
+
+def run_child(size, seed, latency, nitems, nkeys, workdir):
+    """Run benchmark for one library ``size``. Return results ``dict``."""
+    root = os.path.join(workdir, '{}-{}'.format(size, seed))
+    library_dir = os.path.join(root, 'zotero')
+    library = os.path.join(library_dir, 'zotero.sqlite')
+    results = {'size': size, 'seed': seed, 'latency': latency,
+               'phases': []}
+
+    if not os.path.exists(library):
+        synthlib.generate(library_dir, size, seed)
+    searchbench.prepare(root, library, os.path.join(library_dir, 'storage'))
+    server = mockapi.serve(library, latency=latency)
+    api = server.api
+
+    from zotquery import config, export, webclient, zq
+    # Credentials come from the cache, not the Keychain
+    config._credentials['web_zotero'] = (time.time(), json.dumps(
+        {'user_id': '1', 'api_key': 'secret', 'user_type': 'users'}))
+    zq.web.base = server.url
+    backend = zq.backend
+    backend.update_clone()
+    backend.update_cache()
+    backend.fts_sqlite
+    wf = config.WF
+
+    collection = max(api.collections.values(), key=lambda c: len(c['items']))
+    group = 'c_' + collection['key']
+    items = ['1_' + key for key in list(api.items)[:nitems]]
+    keys = list(api.items)[:nkeys]
+    results.update(items=len(api.items), group=len(collection['items']))
+
+    def phase(name, style, func):
+        backend.properties['csl_style'] = style
+        before = dict(api.stats)
+        start = time.time()
+        func()
+        stats = dict((k, api.stats.get(k, 0) - before.get(k, 0))
+                     for k in ('requests', 304, 'bytes'))
+        results['phases'].append({
+            'name': name, 'seconds': time.time() - start,
+            'requests': stats['requests'], 'not_modified': stats[304],
+            'bytes': stats['bytes']})
+
+    def export_items():
+        for uid in items:
+            export.get_export_html('bib', uid, wf)
+
+    def export_group():
+        export.get_export_html('group', group, wf)
+
+    def bibliography():
+        export.items_bibliography(keys)
+
+    # Local formatting is opt-in
+    config.LOCAL_CSL = True
+    phase('items', WEB_STYLE, export_items)
+    phase('items (cached)', WEB_STYLE, export_items)
+    phase('items (local)', LOCAL_STYLE, export_items)
+    phase('group', WEB_STYLE, export_group)
+    phase('group (cached)', WEB_STYLE, export_group)
+    phase('group (local)', LOCAL_STYLE, export_group)
+    phase('bibliography', WEB_STYLE, bibliography)
+    phase('bibliography (304)', WEB_STYLE, bibliography)
+    phase('bibliography (local)', LOCAL_STYLE, bibliography)
+
+    # Without the reference cache, unchanged items are `304`s
+    config.CACHE_REFERENCES = False
+    phase('items (304)', WEB_STYLE, export_items)
+    phase('group (304)', WEB_STYLE, export_group)
+
+    webclient.pool.close()
+    server.shutdown()
+    server.server_close()
+    return results
+
+
+def print_results(results):
+    """Print ``results`` of one size as a table."""
+    print('\n== {size} ({items} items, seed {seed}, {latency:g} ms latency,'
+          ' collection of {group}) =='.format(**results))
+    print('{:<22} {:>10} {:>9} {:>6} {:>10}'.format(
+          'export', 'ms', 'requests', '304s', 'KB'))
+    for p in results['phases']:
+        print('{:<22} {:>10.1f} {:>9} {:>6} {:>10.1f}'.format(
+              p['name'], p['seconds'] * 1000, p['requests'],
+              p['not_modified'], p['bytes'] / 1024.0))
+
+
+def parse_args(argv):
+    opts = {'sizes': [], 'seed': 1, 'latency': 50.0, 'items': 20,
+            'keys': 300, 'workdir': '/tmp/zqexport', 'json': None,
+            'child': False}
+    for arg in argv:
+        if arg.startswith('--'):
+            name, _, value = arg[2:].partition('=')
+            if name in ('seed', 'items', 'keys'):
+                value = int(value)
+            elif name == 'latency':
+                value = float(value)
+            opts[name] = value if value != '' else True
+        else:
+            opts['sizes'].append(arg)
+    opts['sizes'] = opts['sizes'] or ['1k']
+    return opts
+
+
+def main(argv):
+    opts = parse_args(argv)
+    if opts['child']:
+        results = run_child(opts['sizes'][0], opts['seed'], opts['latency'],
+                            opts['items'], opts['keys'], opts['workdir'])
+        print(json.dumps(results))
+        return 0
+
+    all_results = []
+    for size in opts['sizes']:
+        root = os.path.join(opts['workdir'], '{}-{}'.format(size,
+                                                             opts['seed']))
+        # Each size needs its own workflow data directories, which are
+        # read when `zotquery` is imported
+        cmd = [sys.executable, os.path.abspath(__file__), size, '--child']
+        cmd += ['--{}={}'.format(name, opts[name])
+                for name in ('seed', 'latency', 'items', 'keys', 'workdir')]
+        output = subprocess.check_output(cmd,
+                                         env=searchbench.make_env(root))
+        results = json.loads(output.strip().splitlines()[-1])
+        print_results(results)
+        all_results.append(results)
+
+    if opts['json']:
+        with open(opts['json'], 'wb') as fp:
+            json.dump(all_results, fp, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
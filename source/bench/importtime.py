@@ -0,0 +1,153 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""Report how long each module takes to import when ZotQuery starts.
+
+Runs ``zotquery.py`` with the given arguments (in this process, with
+`__import__` wrapped) and prints the modules it imported, slowest
+first. ``cumulative`` includes the modules a module imports itself;
+``self`` does not. Run it twice to see a warm start (with `.pyc`
+files written).
+
+Usage:
+    importtime.py [--top=<n>] [--json] <action> <flag> [<argument>]
+
+Options:
+    --top=<n>   Number of modules to list [default: 25]
+    --json      Print ``{"total": ms, "modules": [...]}`` instead
+
+"""
+
+from __future__ import print_function, unicode_literals
+
+import __builtin__
+import json
+import os
+import runpy
+import sys
+from time import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.dirname(HERE)
+
+
+class ImportProfiler(object):
+    """Wraps `__import__` to time the loading of new modules."""
+
+    def __init__(self):
+        self._import = None
+        # Time spent in imports nested in the one being timed
+        self._nested = [0.0]
+        # module name -> [cumulative, self] seconds
+        self.modules = {}
+
+    def __enter__(self):
+        self._import = __builtin__.__import__
+        __builtin__.__import__ = self.timed_import
+        return self
+
+    def __exit__(self, *exc_info):
+        __builtin__.__import__ = self._import
+
+    def timed_import(self, name, *args, **kwargs):
+        before = len(sys.modules)
+        label = None
+        if name in sys.modules and len(args) > 2 and args[2]:
+            # `from package import module` loads ``module``, not
+            # ``package``
+            label = ', '.join('{}.{}'.format(name, sub) for sub in args[2])
+        self._nested.append(0.0)
+        start = time()
+        try:
+            return self._import(name, *args, **kwargs)
+        finally:
+            elapsed = time() - start
+            nested = self._nested.pop()
+            self._nested[-1] += elapsed
+            if len(sys.modules) != before:
+                # Already-loaded modules take no time worth reporting
+                label = label or self.resolve(name,
+                                              args[0] if args else None)
+                total = self.modules.setdefault(label, [0.0, 0.0])
+                total[0] += elapsed
+                total[1] += elapsed - nested
+
+    @staticmethod
+    def resolve(name, globals_):
+        """Return full name of module ``name`` imported from ``globals_``.
+
+        Python 2 tries implicit relative imports first, so ``config``
+        imported from a `zotquery` module is ``zotquery.config``.
+
+        """
+        package = (globals_ or {}).get('__package__') or ''
+        if not package and '__path__' in (globals_ or {}):
+            package = globals_['__name__']
+        elif not package:
+            package = (globals_ or {}).get('__name__', '').rpartition('.')[0]
+        if package and sys.modules.get('{}.{}'.format(package, name)):
+            return '{}.{}'.format(package, name)
+        return name
+
+    def report(self, top=None):
+        """Return ``[name, cumulative ms, self ms]``, slowest first."""
+        rows = [[name, round(v[0] * 1000, 2), round(v[1] * 1000, 2)]
+                for name, v in self.modules.items()]
+        rows.sort(key=lambda r: r[1], reverse=True)
+        return rows[:top]
+
+
+def profile(argv):
+    """Run ``zotquery.py`` with ``argv``. Return ``(seconds, profiler)``.
+
+    The workflow's output goes to `stderr`, so it doesn't get mixed up
+    with the report.
+
+    """
+    script = os.path.join(SOURCE, 'zotquery.py')
+    stdout, sys.stdout = sys.stdout, sys.stderr
+    sys.argv = [script] + argv
+    start = time()
+    try:
+        with ImportProfiler() as profiler:
+            try:
+                runpy.run_path(script, run_name='__main__')
+            except SystemExit:
+                pass
+    finally:
+        sys.stdout = stdout
+    return time() - start, profiler
+
+
+def main(argv):
+    top, as_json = 25, False
+    while argv and argv[0].startswith('--'):
+        name, _, value = argv.pop(0)[2:].partition('=')
+        if name == 'top':
+            top = int(value)
+        elif name == 'json':
+            as_json = True
+    if not argv:
+        print(__doc__.strip(), file=sys.stderr)
+        return 1
+
+    seconds, profiler = profile(argv)
+    rows = profiler.report(top)
+    if as_json:
+        print(json.dumps({'total': round(seconds * 1000, 2),
+                          'modules': rows}))
+        return 0
+
+    print('{:>10} {:>10}  {}'.format('cumulative', 'self', 'module'))
+    for name, cumulative, own in rows:
+        print('{:>10.1f} {:>10.1f}  {}'.format(cumulative, own, name))
+    print('\nrun: {:.1f} ms'.format(seconds * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, SOURCE)
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,409 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""Local stand-in for the Zotero web API, serving a synthetic library.
+
+Serves the endpoints :class:`WebZotero` uses, for the (one) library in
+a `zotero.sqlite` made by :mod:`synthlib`:
+
+- ``include`` of ``data``, ``bib`` and ``citation`` (formatted by
+  :mod:`zotquery.csl`, in the requested ``style`` if it knows it),
+- ``itemKey`` (at most 50 keys), ``tag`` and ``itemType`` filters,
+- ``start``/``limit`` pages, with `Total-Results` and `Link` headers,
+- `Last-Modified-Version` (the library's or the object's version) and
+  `304 Not Modified` for ``If-Modified-Since-Version``.
+
+Each request waits ``latency`` milliseconds (plus up to ``jitter``)
+before it is answered, like a request to a distant server. Requests,
+statuses and bytes sent are counted in :attr:`MockAPI.stats`.
+
+Usage:
+    mockapi.py <zotero.sqlite> [--port=<n>] [--latency=<ms>]
+               [--jitter=<ms>]
+
+Options:
+    --port=<n>      Port to listen on [default: 8085]
+    --latency=<ms>  Delay of each response [default: 0]
+    --jitter=<ms>   Random extra delay of each response [default: 0]
+
+"""
+
+from __future__ import print_function, unicode_literals
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from collections import OrderedDict
+from contextlib import closing
+import json
+import os
+import random
+import re
+from SocketServer import ThreadingMixIn
+import sqlite3
+import sys
+import threading
+import time
+import urllib
+import urlparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.dirname(HERE)
+sys.path.insert(0, SOURCE)
+
+from zotquery import csl  # noqa: E402
+
+# Style of `bib` and `citation` if the requested one isn't known
+DEFAULT_STYLE = 'chicago-author-date'
+
+# Most results per page, and keys per `itemKey`
+PAGE_LIMIT = 100
+KEY_LIMIT = 50
+
+ROUTES = [
+    (r'items', 'items'),
+    (r'items/top', 'items'),
+    (r'items/trash', 'trash'),
+    (r'items/(?P<key>\w+)', 'item'),
+    (r'items/(?P<key>\w+)/children', 'trash'),
+    (r'items/(?P<key>\w+)/tags', 'item_tags'),
+    (r'tags', 'tags'),
+    (r'tags/(?P<tag>[^/]+)', 'tag'),
+    (r'collections', 'collections'),
+    (r'collections/top', 'top_collections'),
+    (r'collections/(?P<key>\w+)', 'collection'),
+    (r'collections/(?P<key>\w+)/collections', 'subcollections'),
+    (r'collections/(?P<key>\w+)/items', 'collection_items'),
+]
+ROUTES = [(re.compile(r'^/(users|groups)/\w+/{}$'.format(pattern)), name)
+          for pattern, name in ROUTES]
+
+
+# 1.  -------------------------------------------------------------------------
+def load_library(path):
+    """Read items and collections of `zotero.sqlite` at ``path``.
+
+    Items have the form of ZotQuery's entries cache (so :mod:`csl` can
+    format them), plus their `version`, `collections` and `tags`.
+
+    :returns: ``(items, collections)``, both ``OrderedDict`` by key
+    :rtype: :class:`tuple`
+
+    """
+    items, by_id = OrderedDict(), {}
+    with closing(sqlite3.connect(path)) as con:
+        for row in con.execute("""
+                SELECT items.itemID, items.key, items.version, typeName
+                FROM items
+                    JOIN itemTypes ON itemTypes.itemTypeID = items.itemTypeID
+                WHERE typeName NOT IN ('attachment', 'note')
+                ORDER BY items.dateAdded DESC, items.itemID"""):
+            id_, key, version, type_ = row
+            item = {'key': key, 'version': version, 'type': type_,
+                    'creators': [], 'data': OrderedDict(),
+                    'collections': [], 'tags': []}
+            items[key] = by_id[id_] = item
+
+        for id_, name, value in con.execute("""
+                SELECT itemID, fieldName, value
+                FROM itemData
+                    JOIN fields ON fields.fieldID = itemData.fieldID
+                    JOIN itemDataValues
+                        ON itemDataValues.valueID = itemData.valueID"""):
+            if id_ in by_id:
+                by_id[id_]['data'][name] = value
+        for item in items.values():
+            # The entries cache only keeps the year
+            if 'date' in item['data']:
+                item['data']['date'] = item['data']['date'][:4]
+
+        for row in con.execute("""
+                SELECT itemID, firstName, lastName, creatorType, orderIndex
+                FROM itemCreators
+                    JOIN creators
+                        ON creators.creatorID = itemCreators.creatorID
+                    JOIN creatorTypes
+                        ON creatorTypes.creatorTypeID =
+                           itemCreators.creatorTypeID"""):
+            if row[0] in by_id:
+                by_id[row[0]]['creators'].append(
+                    {'given': row[1], 'family': row[2], 'type': row[3],
+                     'index': row[4]})
+
+        collections, coll_keys = OrderedDict(), {}
+        for id_, key, name, parent, version in con.execute("""
+                SELECT collectionID, key, collectionName,
+                       parentCollectionID, version
+                FROM collections ORDER BY collectionName"""):
+            collections[key] = {'key': key, 'name': name, 'parent': parent,
+                                'version': version, 'items': []}
+            coll_keys[id_] = key
+        for coll in collections.values():
+            coll['parent'] = coll_keys.get(coll['parent'])
+        for coll_id, id_ in con.execute(
+                'SELECT collectionID, itemID FROM collectionItems'):
+            if id_ in by_id and coll_id in coll_keys:
+                by_id[id_]['collections'].append(coll_keys[coll_id])
+                collections[coll_keys[coll_id]]['items'].append(
+                    by_id[id_]['key'])
+
+        for id_, name in con.execute("""
+                SELECT itemID, name
+                FROM itemTags JOIN tags ON tags.tagID = itemTags.tagID"""):
+            if id_ in by_id:
+                by_id[id_]['tags'].append(name)
+    return items, collections
+
+
+# 2.  -------------------------------------------------------------------------
+class MockAPI(object):
+    """The library and the responses to requests for it.
+
+    :ivar stats: counts of ``requests``, ``bytes`` and each status
+
+    """
+
+    def __init__(self, path, latency=0, jitter=0):
+        self.items, self.collections = load_library(path)
+        self.version = max([i['version'] for i in self.items.values()] +
+                           [0])
+        self.latency = latency
+        self.jitter = jitter
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.stats[name] = self.stats.get(name, 0) + n
+
+    def respond(self, path, params, since=None):
+        """Return ``(status, headers, body)`` for a GET request."""
+        delay = self.latency + random.uniform(0, self.jitter)
+        time.sleep(delay / 1000.0)
+        for regex, name in ROUTES:
+            match = regex.match(path)
+            if match:
+                break
+        else:
+            return 404, {}, b'Not found'
+        try:
+            result, version = getattr(self, 'get_' + name)(
+                params, **match.groupdict())
+        except KeyError:
+            return 404, {}, b'Not found'
+        except ValueError as err:
+            return 400, {}, unicode(err).encode('utf-8')
+
+        headers = {'Last-Modified-Version': str(version)}
+        if since is not None and int(since) >= version:
+            return 304, headers, b''
+        if isinstance(result, list):
+            headers['Total-Results'] = str(len(result))
+            result = self.page(result, path, params, headers)
+        body = json.dumps(result).encode('utf-8')
+        return 200, headers, body
+
+    def page(self, results, path, params, headers):
+        """Return page of ``results`` and add `Link` to ``headers``."""
+        start = int(params.get('start', 0))
+        limit = min(int(params.get('limit', 25)), PAGE_LIMIT)
+        links = []
+        query = dict((k, v) for k, v in params.items() if k != 'start')
+        if start + limit < len(results):
+            links.append(('next', start + limit))
+            last = (len(results) - 1) // limit * limit
+            links.append(('last', last))
+        if links:
+            headers['Link'] = ', '.join(
+                '<{}?{}>; rel="{}"'.format(
+                    path, urllib.urlencode(dict(query, start=n)), rel)
+                for rel, n in links)
+        return results[start:start + limit]
+
+    ## 2.1  -------------------------------------------------------------------
+    def api_item(self, item, params):
+        """Return API object of ``item`` with parts in ``include``."""
+        include = params.get('include', 'data').split(',')
+        style = params.get('style', DEFAULT_STYLE)
+        if not csl.supports(style):
+            style = DEFAULT_STYLE
+        obj = OrderedDict([('key', item['key']),
+                           ('version', item['version']),
+                           ('library', {'type': 'user', 'id': 1})])
+        if 'data' in include:
+            data = OrderedDict([('key', item['key']),
+                                ('version', item['version']),
+                                ('itemType', item['type'])])
+            data['creators'] = [
+                {'creatorType': c['type'], 'firstName': c['given'],
+                 'lastName': c['family']}
+                for c in sorted(item['creators'], key=lambda c: c['index'])]
+            data.update(item['data'])
+            data['collections'] = item['collections']
+            data['tags'] = [{'tag': t} for t in item['tags']]
+            obj['data'] = data
+        if 'bib' in include:
+            obj['bib'] = csl.reference(item, style)
+        if 'citation' in include:
+            obj['citation'] = csl.citation(item, style)
+        return obj
+
+    def api_collection(self, coll):
+        return {'key': coll['key'], 'version': coll['version'],
+                'data': {'key': coll['key'], 'name': coll['name'],
+                         'parentCollection': coll['parent'] or False},
+                'meta': {'numItems': len(coll['items'])}}
+
+    def filter_items(self, items, params):
+        """Apply ``itemKey``, ``tag`` and ``itemType`` filters."""
+        if 'itemKey' in params:
+            keys = params['itemKey'].split(',')
+            if len(keys) > KEY_LIMIT:
+                raise ValueError('Too many keys')
+            keys = set(keys)
+            items = [i for i in items if i['key'] in keys]
+        if 'tag' in params:
+            items = [i for i in items if params['tag'] in i['tags']]
+        if 'itemType' in params:
+            # e.g. `-attachment || note`: there are only regular items
+            types = params['itemType'].lstrip('-').split('||')
+            types = [t.strip() for t in types]
+            if params['itemType'].startswith('-'):
+                items = [i for i in items if i['type'] not in types]
+            else:
+                items = [i for i in items if i['type'] in types]
+        return [self.api_item(i, params) for i in items]
+
+    ## 2.2  -------------------------------------------------------------------
+    def get_items(self, params):
+        return (self.filter_items(self.items.values(), params),
+                self.version)
+
+    def get_trash(self, params, key=None):
+        return [], self.version
+
+    def get_item(self, params, key):
+        item = self.items[key]
+        return self.api_item(item, params), item['version']
+
+    def get_item_tags(self, params, key):
+        return ([{'tag': t} for t in self.items[key]['tags']],
+                self.items[key]['version'])
+
+    def get_tags(self, params):
+        names = sorted(set(t for i in self.items.values()
+                           for t in i['tags']))
+        return [{'tag': t} for t in names], self.version
+
+    def get_tag(self, params, tag):
+        tag = urllib.unquote(tag).decode('utf-8')
+        if not any(tag in i['tags'] for i in self.items.values()):
+            raise KeyError(tag)
+        return [{'tag': tag}], self.version
+
+    def get_collections(self, params):
+        return ([self.api_collection(c) for c in self.collections.values()],
+                self.version)
+
+    def get_top_collections(self, params):
+        return ([self.api_collection(c) for c in self.collections.values()
+                 if not c['parent']], self.version)
+
+    def get_collection(self, params, key):
+        coll = self.collections[key]
+        return self.api_collection(coll), coll['version']
+
+    def get_subcollections(self, params, key):
+        self.collections[key]
+        return ([self.api_collection(c) for c in self.collections.values()
+                 if c['parent'] == key], self.version)
+
+    def get_collection_items(self, params, key):
+        items = [self.items[k] for k in self.collections[key]['items']]
+        return self.filter_items(items, params), self.version
+
+
+# 3.  -------------------------------------------------------------------------
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, api):
+        HTTPServer.__init__(self, address, Handler)
+        self.api = api
+
+    def handle_error(self, request, client_address):
+        # e.g. a client closing its connection (the default handler
+        # prints the traceback to `stdout`)
+        pass
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one go, not a packet per header (which,
+    # with delayed ACKs, adds ~40 ms to every request)
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        api = self.server.api
+        url = urlparse.urlsplit(self.path)
+        params = dict((k.decode('utf-8'), v.decode('utf-8')) for k, v in
+                      urlparse.parse_qsl(url.query))
+        status, headers, body = api.respond(
+            url.path, params, self.headers.get('If-Modified-Since-Version'))
+        # `Link` URLs are relative to this server
+        if 'Link' in headers:
+            headers['Link'] = headers['Link'].replace(
+                '<', '<http://{}:{}'.format(*self.server.server_address))
+        api.count('requests')
+        api.count(status)
+        api.count('bytes', len(body))
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(path, port=0, latency=0, jitter=0):
+    """Serve library at ``path`` in a background thread.
+
+    :returns: running :class:`Server`; its URL is ``server.url``
+    :rtype: :class:`Server`
+
+    """
+    server = Server(('127.0.0.1', port), MockAPI(path, latency, jitter))
+    server.url = 'http://{}:{}'.format(*server.server_address)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main(argv):
+    args = [a for a in argv if not a.startswith('--')]
+    opts = dict(a[2:].partition('=')[::2] for a in argv
+                if a.startswith('--'))
+    if not args:
+        print(__doc__.strip(), file=sys.stderr)
+        return 1
+    server = Server(('127.0.0.1', int(opts.get('port', 8085))),
+                    MockAPI(args[0], float(opts.get('latency', 0)),
+                            float(opts.get('jitter', 0))))
+    print('Serving {} items at http://{}:{}'.format(
+        len(server.api.items), *server.server_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,285 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""Benchmark ZotQuery against synthetic Zotero libraries.
+
+For each library size, times building the clone, the item cache and
+the search databases, then the latency of searches in each scope.
+Queries are prefixes and words of the library's own titles, typed one
+keystroke at a time, so results are comparable between runs with the
+same seed.
+
+Each size runs in a separate process with its own workflow data and
+cache directories under ``<workdir>``, so no Alfred, Zotero or Keychain
+is needed. Generated libraries are kept and reused.
+
+Usage:
+    searchbench.py [<size>...] [--seed=<n>] [--queries=<n>]
+                   [--workdir=<dir>] [--json=<path>] [--e2e]
+
+Options:
+    <size>          1k, 10k, 100k, 500k or a number of items [default: 1k]
+    --seed=<n>      Seed for library and queries [default: 1]
+    --queries=<n>   Number of queries per scope [default: 40]
+    --workdir=<dir> Where to put libraries and data [default: /tmp/zqbench]
+    --json=<path>   Also write results as JSON to <path>
+    --e2e           Also time `zotquery.py search` in a new process
+
+"""
+
+from __future__ import print_function, unicode_literals
+
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import time
+
+import synthlib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.dirname(HERE)
+
+SEARCH_SCOPES = ['general', 'titles', 'creators', 'attachments', 'notes',
+                 'in-collection', 'in-tag', 'fulltext']
+
+# Number of `zotquery.py search` runs with --e2e
+E2E_RUNS = 10
+
+
+def percentile(values, pct):
+    """Return the ``pct`` percentile of ``values`` (nearest rank)."""
+    values = sorted(values)
+    if not values:
+        return None
+    index = int(round(pct / 100.0 * len(values) + 0.5)) - 1
+    return values[max(0, min(index, len(values) - 1))]
+
+
+def summarize(timings):
+    """Return ``dict`` of latency statistics (in milliseconds)."""
+    ms = [t * 1000 for t in timings]
+    return {
+        'n': len(ms),
+        'p50': percentile(ms, 50),
+        'p90': percentile(ms, 90),
+        'p99': percentile(ms, 99),
+        'max': max(ms) if ms else None,
+    }
+
+
+def make_env(root):
+    """Return environment for a workflow with data and cache in ``root``.
+    """
+    env = dict(os.environ)
+    env['alfred_workflow_data'] = os.path.join(root, 'data')
+    env['alfred_workflow_cache'] = os.path.join(root, 'cache')
+    return env
+
+
+def prepare(root, library, storage):
+    """Create fresh workflow data for the library at ``library``.
+
+    Writes the settings ZotQuery would otherwise ask for, or find with
+    Spotlight.
+
+    """
+    from workflow import Workflow
+    for dirname in ('data', 'cache'):
+        path = os.path.join(root, dirname)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+
+    wf = Workflow()
+    # Keep backend from deleting the settings as data of old versions
+    with open(wf.datafile('_upgrade_1'), 'wb') as fp:
+        fp.write(b'')
+    wf.store_data('local_zotero', {
+        'original_sqlite': library,
+        'internal_storage': storage,
+        'external_storage': storage,
+    }, serializer='json')
+    wf.store_data('zotquery_backend', {
+        'zotero_app': 'Standalone',
+        'csl_style': 'chicago-author-date',
+        'output_format': 'Markdown',
+    }, serializer='json')
+    wf.settings['__workflow_autoupdate'] = False
+
+
+def timed(func, *args):
+    """Call ``func`` and return ``(result, seconds)``."""
+    start = time.time()
+    result = func(*args)
+    return result, time.time() - start
+
+
+def make_queries(cache, count, seed):
+    """Generate search queries from the titles of items in ``cache``.
+
+    Each word is "typed" in steps, e.g. ``e``, ``ep``, ``epic``,
+    ``epicurus``, giving the queries Alfred runs while a user types.
+
+    """
+    rand = random.Random(seed)
+    titles = [item['data'].get('title', '') for item in cache.values()]
+    titles = [t for t in titles if t]
+    queries = []
+    while len(queries) < count and titles:
+        words = re.findall(r'\w+', rand.choice(titles), re.UNICODE)
+        if not words:
+            continue
+        word = rand.choice(words)
+        for n in sorted(set([1, 2, 4, len(word)])):
+            if n <= len(word):
+                queries.append(word[:n])
+    return queries[:count]
+
+
+def run_child(size, seed, nqueries, workdir, e2e):
+    """Run benchmark for one library ``size``. Return results ``dict``."""
+    root = os.path.join(workdir, '{}-{}'.format(size, seed))
+    library_dir = os.path.join(root, 'zotero')
+    library = os.path.join(library_dir, 'zotero.sqlite')
+    results = {'size': size, 'seed': seed}
+
+    if not os.path.exists(library):
+        _, results['generate'] = timed(synthlib.generate, library_dir, size,
+                                       seed, True)
+
+    prepare(root, library, os.path.join(library_dir, 'storage'))
+
+    _, results['import'] = timed(__import__, 'zotquery')
+    from zotquery import zq, search, store
+    backend = zq.backend
+
+    _, results['clone'] = timed(backend.update_clone)
+    _, results['cache'] = timed(backend.update_cache)
+
+    def build_fts():
+        return backend.fts_sqlite, backend.folded_sqlite
+
+    _, results['fts'] = timed(build_fts)
+    _, results['fulltext'] = timed(lambda: backend.fulltext_sqlite)
+
+    cache = backend.cache
+    results['items'] = len(list(cache.keys()))
+    queries = make_queries(cache, nqueries, seed)
+
+    # Search within the collection and tag with most items
+    collections, tags = {}, {}
+    for item in cache.values():
+        for c in item['zot-collections']:
+            collections[c['key']] = collections.get(c['key'], 0) + 1
+        for t in item['zot-tags']:
+            tags[t['id']] = tags.get(t['id'], 0) + 1
+    wf = search.config.WF
+    if collections:
+        store.store('collection', 'c_' + max(collections,
+                                             key=collections.get), wf)
+    if tags:
+        store.store('tag', 't_{}'.format(max(tags, key=tags.get)), wf)
+
+    results['search'] = {}
+    for scope in SEARCH_SCOPES:
+        if scope in search.config.SCOPE_TYPES['items']:
+            func = search.search_for_items
+        elif scope in search.config.SCOPE_TYPES['in-groups']:
+            func = search.search_within_group
+        else:
+            func = lambda scope, query: search.search_fulltext(query)
+        timings, hits = [], 0
+        for query in queries:
+            found, seconds = timed(func, scope, query)
+            timings.append(seconds)
+            hits += len(found)
+        stats = summarize(timings)
+        stats['hits'] = hits
+        results['search'][scope] = stats
+
+    if e2e:
+        cmd = [sys.executable, os.path.join(SOURCE, 'zotquery.py'),
+               'search', 'general']
+        timings = []
+        with open(os.devnull, 'wb') as devnull:
+            for query in queries[:E2E_RUNS]:
+                _, seconds = timed(lambda: subprocess.check_call(
+                    cmd + [query], stdout=devnull, stderr=devnull))
+                timings.append(seconds)
+        results['e2e'] = summarize(timings)
+
+    return results
+
+
+def print_results(results):
+    """Print ``results`` of one size as a table."""
+    print('\n== {size} ({items} items, seed {seed}) =='.format(**results))
+    for phase in ('generate', 'import', 'clone', 'cache', 'fts', 'fulltext'):
+        if phase in results:
+            print('{:<20} {:>10.1f} ms'.format(phase, results[phase] * 1000))
+    print('\n{:<20} {:>8} {:>8} {:>8} {:>8} {:>8}'.format(
+          'search (ms)', 'p50', 'p90', 'p99', 'max', 'hits'))
+    rows = sorted(results['search'].items())
+    if 'e2e' in results:
+        rows.append(('e2e general', dict(results['e2e'], hits='')))
+    for scope, s in rows:
+        print('{:<20} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>8}'.format(
+              scope, s['p50'], s['p90'], s['p99'], s['max'], s['hits']))
+
+
+def parse_args(argv):
+    opts = {'sizes': [], 'seed': 1, 'queries': 40, 'workdir': '/tmp/zqbench',
+            'json': None, 'e2e': False, 'child': False}
+    for arg in argv:
+        if arg.startswith('--'):
+            name, _, value = arg[2:].partition('=')
+            if name in ('seed', 'queries'):
+                value = int(value)
+            opts[name] = value or True
+        else:
+            opts['sizes'].append(arg)
+    opts['sizes'] = opts['sizes'] or ['1k']
+    return opts
+
+
+def main(argv):
+    opts = parse_args(argv)
+    if opts['child']:
+        results = run_child(opts['sizes'][0], opts['seed'], opts['queries'],
+                            opts['workdir'], opts['e2e'])
+        print(json.dumps(results))
+        return 0
+
+    all_results = []
+    for size in opts['sizes']:
+        root = os.path.join(opts['workdir'], '{}-{}'.format(size,
+                                                             opts['seed']))
+        # Each size needs its own workflow data directories, which are
+        # read when `zotquery` is imported
+        cmd = [sys.executable, os.path.abspath(__file__), size, '--child',
+               '--seed={}'.format(opts['seed']),
+               '--queries={}'.format(opts['queries']),
+               '--workdir={}'.format(opts['workdir'])]
+        if opts['e2e']:
+            cmd.append('--e2e')
+        output = subprocess.check_output(cmd, env=make_env(root))
+        results = json.loads(output.strip().splitlines()[-1])
+        print_results(results)
+        all_results.append(results)
+
+    if opts['json']:
+        with open(opts['json'], 'wb') as fp:
+            json.dump(all_results, fp, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, SOURCE)
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,558 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""Generate synthetic Zotero libraries for testing and benchmarking.
+
+Writes a `zotero.sqlite` following Zotero 5's schema (only the tables
+ZotQuery reads), plus an optional `storage` directory holding
+`.zotero-ft-cache` files for attachments.
+
+Libraries are deterministic for a given ``seed``, so timings from
+different runs (or machines) can be compared.
+
+Usage:
+    synthlib.py <outdir> [<size>] [--seed=<n>] [--storage]
+
+"""
+
+from __future__ import print_function, unicode_literals
+
+import bisect
+from contextlib import closing
+import os
+import random
+import sqlite3
+import sys
+import time
+
+#: Named library sizes used by the benchmark suites.
+SIZES = {
+    '1k': 1000,
+    '10k': 10000,
+    '100k': 100000,
+    '500k': 500000,
+}
+
+SCHEMA = """
+CREATE TABLE version (schema TEXT PRIMARY KEY, version INT NOT NULL);
+CREATE TABLE libraries (
+    libraryID INTEGER PRIMARY KEY,
+    type TEXT NOT NULL,
+    editable INT NOT NULL,
+    filesEditable INT NOT NULL,
+    version INT NOT NULL DEFAULT 0,
+    storageVersion INT NOT NULL DEFAULT 0,
+    lastSync INT NOT NULL DEFAULT 0
+);
+CREATE TABLE itemTypes (
+    itemTypeID INTEGER PRIMARY KEY,
+    typeName TEXT,
+    templateItemTypeID INT,
+    display INT DEFAULT 1
+);
+CREATE TABLE fields (
+    fieldID INTEGER PRIMARY KEY,
+    fieldName TEXT,
+    fieldFormatID INT
+);
+CREATE TABLE creatorTypes (
+    creatorTypeID INTEGER PRIMARY KEY,
+    creatorType TEXT
+);
+CREATE TABLE items (
+    itemID INTEGER PRIMARY KEY,
+    itemTypeID INT NOT NULL,
+    dateAdded TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    dateModified TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    clientDateModified TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    libraryID INT NOT NULL,
+    key TEXT NOT NULL,
+    version INT NOT NULL DEFAULT 0,
+    synced INT NOT NULL DEFAULT 0,
+    UNIQUE (libraryID, key)
+);
+CREATE TABLE itemDataValues (
+    valueID INTEGER PRIMARY KEY,
+    value UNIQUE
+);
+CREATE TABLE itemData (
+    itemID INT,
+    fieldID INT,
+    valueID,
+    PRIMARY KEY (itemID, fieldID)
+);
+CREATE TABLE itemNotes (
+    itemID INTEGER PRIMARY KEY,
+    parentItemID INT,
+    note TEXT,
+    title TEXT
+);
+CREATE INDEX itemNotes_parentItemID ON itemNotes(parentItemID);
+CREATE TABLE itemAttachments (
+    itemID INTEGER PRIMARY KEY,
+    parentItemID INT,
+    linkMode INT,
+    contentType TEXT,
+    charsetID INT,
+    path TEXT,
+    syncState INT DEFAULT 0,
+    storageModTime INT,
+    storageHash TEXT,
+    lastProcessedModificationTime INT
+);
+CREATE INDEX itemAttachments_parentItemID ON itemAttachments(parentItemID);
+CREATE TABLE creators (
+    creatorID INTEGER PRIMARY KEY,
+    firstName TEXT,
+    lastName TEXT,
+    fieldMode INT,
+    UNIQUE (lastName, firstName, fieldMode)
+);
+CREATE TABLE itemCreators (
+    itemID INT NOT NULL,
+    creatorID INT NOT NULL,
+    creatorTypeID INT NOT NULL DEFAULT 1,
+    orderIndex INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (itemID, orderIndex)
+);
+CREATE TABLE collections (
+    collectionID INTEGER PRIMARY KEY,
+    collectionName TEXT NOT NULL,
+    parentCollectionID INT DEFAULT NULL,
+    clientDateModified TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    libraryID INT NOT NULL,
+    key TEXT NOT NULL,
+    version INT NOT NULL DEFAULT 0,
+    synced INT NOT NULL DEFAULT 0,
+    UNIQUE (libraryID, key)
+);
+CREATE TABLE collectionItems (
+    collectionID INT NOT NULL,
+    itemID INT NOT NULL,
+    orderIndex INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (collectionID, itemID)
+);
+CREATE INDEX collectionItems_itemID ON collectionItems(itemID);
+CREATE TABLE tags (
+    tagID INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE itemTags (
+    itemID INT NOT NULL,
+    tagID INT NOT NULL,
+    type INT NOT NULL,
+    PRIMARY KEY (itemID, tagID)
+);
+CREATE INDEX itemTags_tagID ON itemTags(tagID);
+CREATE TABLE fulltextItems (
+    itemID INTEGER PRIMARY KEY,
+    indexedPages INT,
+    totalPages INT,
+    indexedChars INT,
+    totalChars INT,
+    version INT NOT NULL DEFAULT 0,
+    synced INT NOT NULL DEFAULT 0
+);
+CREATE TABLE fulltextWords (
+    wordID INTEGER PRIMARY KEY,
+    word TEXT UNIQUE
+);
+CREATE TABLE fulltextItemWords (
+    wordID INT,
+    itemID INT,
+    PRIMARY KEY (wordID, itemID)
+);
+CREATE INDEX fulltextItemWords_itemID ON fulltextItemWords(itemID);
+CREATE TABLE deletedItems (
+    itemID INTEGER PRIMARY KEY,
+    dateDeleted DEFAULT CURRENT_TIMESTAMP NOT NULL
+);
+"""
+
+# IDs match Zotero 5's `itemTypes` table
+ITEM_TYPES = [
+    (1, 'note'), (2, 'book'), (3, 'bookSection'), (4, 'journalArticle'),
+    (5, 'magazineArticle'), (6, 'newspaperArticle'), (7, 'thesis'),
+    (8, 'letter'), (9, 'manuscript'), (10, 'interview'), (11, 'film'),
+    (12, 'artwork'), (13, 'webpage'), (14, 'attachment'), (15, 'report'),
+    (16, 'bill'), (17, 'case'), (18, 'hearing'), (19, 'patent'),
+    (20, 'statute'), (21, 'email'), (22, 'map'), (23, 'blogPost'),
+    (24, 'instantMessage'), (25, 'forumPost'), (26, 'audioRecording'),
+    (27, 'presentation'), (28, 'videoRecording'), (29, 'tvBroadcast'),
+    (30, 'radioBroadcast'), (31, 'podcast'), (32, 'computerProgram'),
+    (33, 'conferencePaper'), (34, 'document'), (35, 'encyclopediaArticle'),
+    (36, 'dictionaryEntry'),
+]
+
+# (type ID, relative frequency) of regular items
+TYPE_WEIGHTS = [(4, 50), (2, 20), (3, 15), (33, 8), (7, 3), (15, 2),
+                (9, 2)]
+
+FIELDS = [
+    (1, 'url'), (2, 'rights'), (3, 'series'), (4, 'volume'), (5, 'issue'),
+    (6, 'edition'), (7, 'place'), (8, 'publisher'), (10, 'pages'),
+    (11, 'ISBN'), (12, 'publicationTitle'), (13, 'ISSN'), (14, 'date'),
+    (15, 'section'), (22, 'extra'), (26, 'DOI'), (27, 'accessDate'),
+    (28, 'libraryCatalog'), (90, 'abstractNote'), (110, 'title'),
+    (115, 'bookTitle'), (118, 'numPages'), (119, 'proceedingsTitle'),
+]
+
+CREATOR_TYPES = [(1, 'author'), (2, 'contributor'), (3, 'editor'),
+                 (4, 'translator'), (5, 'seriesEditor')]
+
+GIVEN_NAMES = [
+    'Anna', 'Bruno', 'Chiara', 'Daniel', 'Elena', 'Felix', 'Grace',
+    'Hugo', 'Ingrid', 'Jonas', 'Katrin', 'Lucas', 'Marie', 'Noël',
+    'Olga', 'Pierre', 'Quentin', 'Rosa', 'Stephen', 'Teresa', 'Ulrich',
+    'Vera', 'William', 'Xavier', 'Yara', 'Zoë', 'J. G.', 'M. Carmen',
+]
+
+FAMILY_NAMES = [
+    'Allen', 'Barnes', 'Dihle', 'Fehling', 'Fowler', 'Gentzler', 'Graham',
+    'Grimaldi', 'Jouanna', 'Lateiner', 'Lear', 'Lloyd', 'Margheim',
+    'Morrison', 'Nestle', 'Noël', 'Reguero', 'Thomas', 'Van der Eijk',
+    'Vlastos', 'Ward', 'Müller', 'Smith', 'García', 'Øster', 'Dupont',
+    'Jackson', 'Kowalski', 'Nakamura', 'Okafor', 'Rossi', 'Schmidt',
+]
+
+SYLLABLES = [
+    'ana', 'bel', 'cor', 'dia', 'epi', 'for', 'gen', 'her', 'ist', 'jun',
+    'kin', 'log', 'mat', 'nom', 'ont', 'phi', 'que', 'rhe', 'sem', 'tek',
+    'ura', 'ver', 'xen', 'yst', 'zet', 'ion', 'ism', 'ter', 'sis', 'dox',
+]
+
+JOURNALS = [
+    'Journal of Hellenic Studies', 'Classical Review', 'Apeiron',
+    'Philologus', 'Rhetorica', 'Phronesis', 'Mind', 'Nature',
+    'Journal of Logic, Language and Information', 'Antichthon',
+]
+
+PUBLISHERS = [
+    'Oxford University Press', 'Cambridge University Press', 'Brill',
+    'Penguin', 'Princeton University Press', 'Les Belles lettres',
+]
+
+TAG_NAMES = [
+    'read', 'to-read', 'epistemology', 'rhetoric', 'history', 'method',
+    'math', 'logic', 'ethics', 'important', 'review', 'draft', 'Ω-theory',
+    'C++', 'in "quotes"', "it's", 'AND', 'NOT',
+]
+
+KEY_CHARS = '23456789ABCDEFGHIJKLMNPQRSTUVWXYZ'
+
+
+class Vocabulary(object):
+    """Zipf-distributed pseudo-words for titles, abstracts and notes."""
+
+    def __init__(self, rand, size=5000):
+        self.rand = rand
+        words = set()
+        while len(words) < size:
+            n = rand.randint(2, 4)
+            words.add(''.join(rand.choice(SYLLABLES) for _ in range(n)))
+        self.words = sorted(words)
+        rand.shuffle(self.words)
+        # cumulative weights ~ 1/rank
+        self._cum = []
+        total = 0.0
+        for i in range(len(self.words)):
+            total += 1.0 / (i + 1)
+            self._cum.append(total)
+        self._total = total
+
+    def word(self):
+        x = self.rand.random() * self._total
+        return self.words[bisect.bisect_left(self._cum, x)]
+
+    def text(self, n):
+        return ' '.join(self.word() for _ in range(n))
+
+
+class LibraryGenerator(object):
+    """Write a synthetic Zotero library to ``dirpath``.
+
+    :param dirpath: directory to create `zotero.sqlite` (and `storage`) in
+    :type dirpath: ``unicode``
+    :param items: number of regular (non-note, non-attachment) items
+    :type items: ``int``
+    :param seed: seed for the random number generator
+    :type seed: ``int``
+    :param storage: also write `.zotero-ft-cache` files
+    :type storage: ``Boolean``
+
+    """
+
+    def __init__(self, dirpath, items=1000, seed=1, storage=False):
+        self.dirpath = dirpath
+        self.count = items
+        self.seed = seed
+        self.storage = storage
+        self.rand = random.Random(seed)
+        self.vocab = Vocabulary(self.rand)
+        self._keys = set()
+        self._values = {}
+        self._next_item_id = 1
+
+    @property
+    def sqlite_path(self):
+        return os.path.join(self.dirpath, 'zotero.sqlite')
+
+    @property
+    def storage_dir(self):
+        return os.path.join(self.dirpath, 'storage')
+
+    def generate(self):
+        """Create the library. Return path to `zotero.sqlite`."""
+        if not os.path.exists(self.dirpath):
+            os.makedirs(self.dirpath)
+        if os.path.exists(self.sqlite_path):
+            os.unlink(self.sqlite_path)
+
+        with closing(sqlite3.connect(self.sqlite_path)) as con:
+            con.execute('PRAGMA journal_mode = OFF')
+            con.execute('PRAGMA synchronous = OFF')
+            con.executescript(SCHEMA)
+            with con:
+                self._static_tables(con)
+                collections = self._collections(con)
+                tags = self._tags(con)
+                self._items(con, collections, tags)
+        return self.sqlite_path
+
+    # Helpers -----------------------------------------------------------------
+
+    def _key(self):
+        while True:
+            key = ''.join(self.rand.choice(KEY_CHARS) for _ in range(8))
+            if key not in self._keys:
+                self._keys.add(key)
+                return key
+
+    def _item_id(self):
+        id_ = self._next_item_id
+        self._next_item_id += 1
+        return id_
+
+    def _value_id(self, con, value):
+        try:
+            return self._values[value]
+        except KeyError:
+            cur = con.execute('INSERT INTO itemDataValues (value) VALUES (?)',
+                              (value,))
+            self._values[value] = cur.lastrowid
+            return cur.lastrowid
+
+    def _title(self):
+        title = self.vocab.text(self.rand.randint(3, 9)).capitalize()
+        if self.rand.random() < 0.2:
+            title += ': ' + self.vocab.text(self.rand.randint(2, 5))
+        return title
+
+    # Tables ------------------------------------------------------------------
+
+    def _static_tables(self, con):
+        con.execute("INSERT INTO version VALUES ('userdata', 103)")
+        con.execute("INSERT INTO libraries VALUES (1, 'user', 1, 1, 0, 0, 0)")
+        con.execute("INSERT INTO libraries VALUES (2, 'group', 1, 1, 0, 0, 0)")
+        con.executemany('INSERT INTO itemTypes (itemTypeID, typeName) '
+                        'VALUES (?, ?)', ITEM_TYPES)
+        con.executemany('INSERT INTO fields (fieldID, fieldName) '
+                        'VALUES (?, ?)', FIELDS)
+        con.executemany('INSERT INTO creatorTypes VALUES (?, ?)',
+                        CREATOR_TYPES)
+        creators = []
+        for family in FAMILY_NAMES:
+            for given in GIVEN_NAMES:
+                creators.append((given, family, 0))
+        con.executemany('INSERT INTO creators (firstName, lastName, '
+                        'fieldMode) VALUES (?, ?, ?)', creators)
+
+    def _collections(self, con):
+        """Create a nested collection tree. Return list of IDs."""
+        n = max(5, self.count // 100)
+        ids = []
+        for i in range(n):
+            parent = None
+            if ids and self.rand.random() < 0.6:
+                parent = self.rand.choice(ids)
+            name = self.vocab.text(self.rand.randint(1, 3)).title()
+            if i % 17 == 0 and ids:
+                # colliding names in different branches
+                name = 'Sources'
+            cur = con.execute(
+                'INSERT INTO collections (collectionName, parentCollectionID,'
+                ' libraryID, key, version) VALUES (?, ?, 1, ?, ?)',
+                (name, parent, self._key(), self.rand.randint(1, 500)))
+            ids.append(cur.lastrowid)
+        return ids
+
+    def _tags(self, con):
+        names = list(TAG_NAMES)
+        names.extend(self.vocab.words[:max(10, self.count // 200)])
+        ids = []
+        for name in sorted(set(names)):
+            cur = con.execute('INSERT INTO tags (name) VALUES (?)', (name,))
+            ids.append(cur.lastrowid)
+        return ids
+
+    def _items(self, con, collections, tags):
+        fields = dict((name, id_) for id_, name in FIELDS)
+        types = [t for t, w in TYPE_WEIGHTS for _ in range(w)]
+        ncreators = len(GIVEN_NAMES) * len(FAMILY_NAMES)
+        start = time.time()
+        for i in range(self.count):
+            item_id = self._item_id()
+            type_id = self.rand.choice(types)
+            library_id = 2 if self.rand.random() < 0.05 else 1
+            version = self.rand.randint(1, 5000)
+            added = '20{:02d}-{:02d}-{:02d} 12:00:00'.format(
+                self.rand.randint(5, 17), self.rand.randint(1, 12),
+                self.rand.randint(1, 28))
+            con.execute(
+                'INSERT INTO items (itemID, itemTypeID, dateAdded, '
+                'libraryID, key, version) VALUES (?, ?, ?, ?, ?, ?)',
+                (item_id, type_id, added, library_id, self._key(), version))
+
+            year = self.rand.randint(1900, 2017)
+            data = {
+                'title': self._title(),
+                'date': '{0}-00-00 {0}'.format(year),
+            }
+            if self.rand.random() < 0.6:
+                data['abstractNote'] = self.vocab.text(
+                    self.rand.randint(30, 150))
+            if type_id == 4:
+                data['publicationTitle'] = self.rand.choice(JOURNALS)
+                data['volume'] = str(self.rand.randint(1, 120))
+                data['pages'] = '{}-{}'.format(self.rand.randint(1, 300),
+                                               self.rand.randint(301, 600))
+                if self.rand.random() < 0.5:
+                    data['DOI'] = '10.{}/{}'.format(
+                        self.rand.randint(1000, 9999), self._key().lower())
+            elif type_id == 2:
+                data['publisher'] = self.rand.choice(PUBLISHERS)
+                data['place'] = self.rand.choice(['Oxford', 'Cambridge',
+                                                  'Leiden', 'Paris'])
+            elif type_id == 3:
+                data['bookTitle'] = self._title()
+                data['publisher'] = self.rand.choice(PUBLISHERS)
+            elif type_id == 33:
+                data['proceedingsTitle'] = 'Proceedings of ' + self._title()
+            con.executemany(
+                'INSERT INTO itemData VALUES (?, ?, ?)',
+                [(item_id, fields[k], self._value_id(con, v))
+                 for k, v in data.items()])
+
+            # creators
+            n = self.rand.choice([0, 1, 1, 1, 2, 2, 3, 4])
+            rows = []
+            for idx in range(n):
+                ctype = 1 if self.rand.random() < 0.85 else \
+                    self.rand.choice([3, 4])
+                rows.append((item_id, self.rand.randint(1, ncreators),
+                             ctype, idx))
+            con.executemany('INSERT INTO itemCreators VALUES (?, ?, ?, ?)',
+                            rows)
+
+            # collections and tags
+            for coll in set(self.rand.sample(
+                    collections, self.rand.choice([0, 1, 1, 2, 3]))):
+                con.execute('INSERT INTO collectionItems VALUES (?, ?, 0)',
+                            (coll, item_id))
+            for tag in set(self.rand.sample(
+                    tags, min(len(tags), self.rand.choice([0, 0, 1, 2, 4])))):
+                con.execute('INSERT INTO itemTags VALUES (?, ?, 0)',
+                            (item_id, tag))
+
+            # notes
+            if self.rand.random() < 0.25:
+                for _ in range(self.rand.randint(1, 2)):
+                    note = '<div class="zotero-note znv1"><p>{}</p></div>'
+                    con.execute(
+                        'INSERT INTO items (itemID, itemTypeID, libraryID, '
+                        'key, version) VALUES (?, 1, ?, ?, ?)',
+                        (self._item_id(), library_id, self._key(), version))
+                    con.execute(
+                        'INSERT INTO itemNotes VALUES (?, ?, ?, ?)',
+                        (self._next_item_id - 1, item_id,
+                         note.format(self.vocab.text(
+                             self.rand.randint(20, 400))), ''))
+
+            # attachments
+            if self.rand.random() < 0.4:
+                self._attachment(con, item_id, library_id, data['title'])
+
+            if i and i % 50000 == 0:
+                print('{:7d} items in {:0.1f}s'.format(i, time.time() - start),
+                      file=sys.stderr)
+
+    def _attachment(self, con, parent_id, library_id, title):
+        att_id = self._item_id()
+        key = self._key()
+        filename = '{}.pdf'.format(
+            '_'.join(title.lower().split()[:4]).replace(':', ''))
+        con.execute('INSERT INTO items (itemID, itemTypeID, libraryID, key, '
+                    'version) VALUES (?, 14, ?, ?, ?)',
+                    (att_id, library_id, key, self.rand.randint(1, 5000)))
+        con.execute(
+            'INSERT INTO itemAttachments (itemID, parentItemID, linkMode, '
+            'contentType, path) VALUES (?, ?, 1, ?, ?)',
+            (att_id, parent_id, 'application/pdf', 'storage:' + filename))
+
+        words = self.vocab.text(self.rand.randint(20, 120)).split()
+        if self.rand.random() < 0.8:
+            word_ids = []
+            for word in set(words):
+                row = con.execute(
+                    'SELECT wordID FROM fulltextWords WHERE word = ?',
+                    (word,)).fetchone()
+                if row is None:
+                    row = (con.execute(
+                        'INSERT INTO fulltextWords (word) VALUES (?)',
+                        (word,)).lastrowid,)
+                word_ids.append((row[0], att_id))
+            con.executemany('INSERT INTO fulltextItemWords VALUES (?, ?)',
+                            word_ids)
+            chars = sum(len(w) + 1 for w in words)
+            con.execute('INSERT INTO fulltextItems VALUES (?, 1, 1, ?, ?, '
+                        '?, 1)', (att_id, chars, chars,
+                                  self.rand.randint(1, 100)))
+
+        if self.storage:
+            dirpath = os.path.join(self.storage_dir, key)
+            os.makedirs(dirpath)
+            with open(os.path.join(dirpath, '.zotero-ft-cache'), 'wb') as fp:
+                fp.write(' '.join(words).encode('utf-8'))
+
+
+def generate(dirpath, size='1k', seed=1, storage=False):
+    """Generate a library of ``size`` (a key of :data:`SIZES` or ``int``)
+    in ``dirpath``. Return path to `zotero.sqlite`.
+
+    """
+    count = SIZES.get(size, size)
+    return LibraryGenerator(dirpath, int(count), seed, storage).generate()
+
+
+def main(argv):
+    args = [a for a in argv if not a.startswith('--')]
+    opts = [a for a in argv if a.startswith('--')]
+    if not args:
+        print(__doc__.strip(), file=sys.stderr)
+        return 1
+    seed = 1
+    for opt in opts:
+        if opt.startswith('--seed='):
+            seed = int(opt.split('=', 1)[1])
+    size = args[1] if len(args) > 1 else '1k'
+    start = time.time()
+    path = generate(args[0], size, seed, '--storage' in opts)
+    print('Generated {} in {:0.2f}s'.format(path, time.time() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -9,21 +9,28 @@ from __future__ import unicode_literals
 
 # Standard Library
 import sys
+from time import time
+START = time()
 
 # Internal Dependencies
-from zotquery import config
-from zotquery.lib.docopt import docopt
+# (action modules are imported by the code-path that runs them)
+from zotquery import config, timing, updates
 
 # Alfred-Workflow
 from workflow import Workflow
-from zotquery import search, export, append, store, open, configure, scan
+
+timing.start(START)
+timing.record('import', START, time())
 
 # create global methods from `Workflow()`
-WF = Workflow(update_settings={
-    'github_slug': 'lutefiasco/alfred_zotquery',
-    'version': config.__version__,
-    'frequency': 7
-})
+# (updates are checked by :mod:`zotquery.updates`, not by `Workflow`)
+WF = Workflow()
+
+
+# Actions and whether their `<argument>` is required (see `__usage__`)
+ACTIONS = (('configure', False), ('search', False), ('store', True),
+           ('export', True), ('append', True), ('open', True),
+           ('scan', False))
 
 
 class ZotWorkflow(object):
@@ -53,10 +60,7 @@ class ZotWorkflow(object):
         """
         self.flag = args['<flag>']
         self.arg = args['<argument>']
-        # list of all possible actions
-        actions = ('search', 'export', 'append', 'store',
-                   'open', 'configure', 'scan')
-        for action in actions:
+        for action, _ in ACTIONS:
             if args.get(action):
                 method_name = '{}_codepath'.format(action)
                 method = getattr(self, method_name, None)
@@ -66,31 +70,62 @@ class ZotWorkflow(object):
                     raise ValueError('Unknown action: {}'.format(action))
 
     def search_codepath(self):
+        from zotquery import search
         return search.search(self.flag, self.arg, self.wf)
 
     def export_codepath(self):
+        from zotquery import export
         return export.export(self.flag, self.arg, self.wf)
 
     def append_codepath(self):
+        from zotquery import append
         return append.append(self.flag, self.arg, self.wf)
 
     def store_codepath(self):
+        from zotquery import store
         return store.store(self.flag, self.arg, self.wf)
 
     def open_codepath(self):
+        from zotquery import open
         return open.open(self.flag, self.arg, self.wf)
 
     def configure_codepath(self):
+        from zotquery import configure
         return configure.configure(self.flag, self.arg, self.wf)
 
     def scan_codepath(self):
+        from zotquery import scan
         return scan.scan(self.flag, self.arg, self.wf)
 
 
+def parse_args(args):
+    """Parse ``args`` according to `config.__usage__`.
+
+    Takes the place of `docopt`, which is slower to import than the
+    usage is to parse. Unlike `docopt`, arguments may start with `-`
+    (e.g. negated search terms).
+
+    :param args: command line arguments passed to workflow
+    :type args: :class:`list`
+    :returns: `docopt`-style dictionary of arguments
+    :rtype: :class:`dict`
+    :raises: :class:`SystemExit` with usage if ``args`` are invalid
+
+    """
+    required = dict(ACTIONS)
+    if (len(args) not in (2, 3) or args[0] not in required or
+            (len(args) == 2 and required[args[0]])):
+        raise SystemExit(config.__usage__.strip())
+    argv = dict((action, action == args[0]) for action, _ in ACTIONS)
+    argv['<flag>'] = args[1]
+    argv['<argument>'] = args[2] if len(args) == 3 else None
+    return argv
+
+
 def main(wf):
     """Accept Alfred's args and pipe to workflow class"""
-    if wf.update_available:
-        wf.start_update()
+    if updates.available(wf):
+        updates.install(wf)
 
     config.log.info('- - - NEW RUN - - -')
     args = wf.args
@@ -100,14 +135,17 @@ def main(wf):
     #args = ['store', 'tag', 't_XK9QHQ6G']
     #args = ['open', 'item', '0_3KFT2HQ9']
     #args = ['configure', 'freshen']
-    argv = docopt(config.__usage__,
-                  argv=args,
-                  version=config.__version__)
+    argv = parse_args(args)
     config.log.info('Input arguments : {}'.format(args))
     pd = ZotWorkflow(wf)
-    res = pd.run(argv)
-    if res:
-        print(res)
+    try:
+        res = pd.run(argv)
+        if res:
+            print(res)
+    finally:
+        updates.schedule(wf)
+        if config.LOG_TIMINGS:
+            timing.write(wf.cachefile('timings.jsonl'), args=args)
 
 if __name__ == '__main__':
     sys.exit(WF.run(main))
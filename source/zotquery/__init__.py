@@ -3,26 +3,36 @@
 from workflow import Workflow
 WF = Workflow()
 
-from zotero import api
 from backend import data
+import timing
 
 
 class ZotQuery(object):
+    # Components are created on first use, so each action only pays
+    # for (and only reads the settings of) the ones it needs
     def __init__(self):
-        self._backend = data(WF)
-        self._web = api(WF)
-        self._local = self._backend.zotero
+        self._backend = None
+        self._web = None
 
     @property
     def backend(self):
+        if self._backend is None:
+            with timing.span('backend'):
+                self._backend = data(WF)
         return self._backend
 
     @property
     def web(self):
+        # Reading the API credentials needs the Keychain,
+        # which searching doesn't
+        if self._web is None:
+            from zotero import api
+            self._web = api(WF)
         return self._web
 
     @property
     def local(self):
-        return self._local
+        return self.backend.zotero
 
-zq = ZotQuery()
+with timing.span('ZotQuery()'):
+    zq = ZotQuery()
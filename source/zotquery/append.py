@@ -18,6 +18,8 @@ def append(flag, arg, wf):
     """
     # Retrieve HTML of item
     cites = export.get_export_html(flag, arg, wf)
+    if flag in ('bib', 'citation'):
+        zq.backend.record_usage(arg)
     # Append text of temp biblio
     append_item(cites, wf)
     return zq.backend.output_format
@@ -14,18 +14,20 @@ import re
 from shutil import copyfile
 import sqlite3
 import struct
+import sys
 from time import time
 
 
 # Internal Dependencies
-from lib import pashua, utils
+from lib import utils
 from zotero import zot
-from zotquery import config
+from zotquery import config, connections, refcache, usage
 from zotquery.cache import Cache
 from zotquery.config import PropertyBase, stored_property
 
 # Alfred-Workflow
 from workflow import Workflow
+from workflow.background import run_in_background
 
 # create global methods from `Workflow()`
 WF = Workflow()
@@ -33,6 +35,11 @@ log = WF.logger
 decode = WF.decode
 fold = WF.fold_to_ascii
 
+# Bump when the layout of the search databases changes to force a rebuild
+INDEX_VERSION = 3
+# Likewise for the full-text word index
+FULLTEXT_VERSION = 1
+
 
 #------------------------------------------------------------------------------
 # :class:`ZotqueryBackend` ----------------------------------------------------
@@ -41,12 +48,16 @@ fold = WF.fold_to_ascii
 class ZotqueryBackend(PropertyBase):
     """Contains all relevant information about this workflow.
 
-    |       Key       |                 Description                  |
-    |-----------------|----------------------------------------------|
-    | `cloned_sqlite` | ZotQuery's clone of Zotero's sqlite database |
-    | `json_data`     | ZotQuery's JSON clone of Zotero's sqlite     |
-    | `fts_sqlite`    | ZotQuery's Full Text Search database         |
-    | `folded_sqlite` | ZotQuery's ASCII-only FTS database           |
+    |        Key        |                 Description                  |
+    |-------------------|----------------------------------------------|
+    | `cloned_sqlite`   | ZotQuery's clone of Zotero's sqlite database |
+    | `json_data`       | ZotQuery's JSON clone of Zotero's sqlite     |
+    | `fts_sqlite`      | ZotQuery's Full Text Search database         |
+    | `folded_sqlite`   | ZotQuery's ASCII-only FTS database           |
+    | `fulltext_sqlite` | ZotQuery's index of words in attachments     |
+    | `ftcache_sqlite`  | ZotQuery's index of `.zotero-ft-cache` files |
+    | `usage_sqlite`    | ZotQuery's record of which items are used    |
+    | `refcache_sqlite` | ZotQuery's cache of formatted references     |
 
     Expects information to be stored in :file:`zotquery_data.json`.
     If file does not exist, it creates and stores dictionary.
@@ -71,10 +82,13 @@ class ZotqueryBackend(PropertyBase):
         # self._json_path = wf.datafile('zotquery.json')
         self._fts_path = wf.datafile('search.sqlite3')
         self._fts_ascii_path = wf.datafile('search-ascii.sqlite3')
+        self._fulltext_path = wf.datafile('fulltext.sqlite3')
+        self._ftcache_path = wf.datafile('ftcache.sqlite3')
+        self._usage_path = wf.datafile('usage.sqlite3')
+        self._refcache_path = wf.datafile('references.sqlite3')
 
         self._cache = None
-        # initialize :class:`LocalZotero`
-        self.zotero = zot(self.wf)
+        self._zotero = None
         # initialize base class, for access to `properties` dict
         PropertyBase.__init__(self, self.wf, secured=False)
         self._con = None
@@ -82,6 +96,19 @@ class ZotqueryBackend(PropertyBase):
 
     # Properties --------------------------------------------------------------
 
+    @property
+    def zotero(self):
+        """:class:`LocalZotero` of user's Zotero installation.
+
+        Only needed to read Zotero's own files, so it is created (and
+        its paths found) when first used rather than on every run.
+
+        """
+        if self._zotero is None:
+            self._zotero = zot(self.wf)
+
+        return self._zotero
+
     @property
     def con(self):
         """Connection to clone database."""
@@ -126,7 +153,7 @@ class ZotqueryBackend(PropertyBase):
         :rtype: :class:`unicode`
 
         """
-        if not os.path.exists(self._fts_path):
+        if not self.index_is_current(self._fts_path):
             self.create_index_db(self._fts_path)
             self.update_index_db(self._fts_path)
         return self._fts_path
@@ -140,11 +167,74 @@ class ZotqueryBackend(PropertyBase):
         :rtype: :class:`unicode`
 
         """
-        if not os.path.exists(self._fts_ascii_path):
+        if not self.index_is_current(self._fts_ascii_path):
             self.create_index_db(self._fts_ascii_path)
             self.update_index_db(self._fts_ascii_path, folded=True)
         return self._fts_ascii_path
 
+    @property
+    def fulltext_sqlite(self):
+        """Return path to ZotQuery's index of the words Zotero has
+        extracted from attachments.
+
+        The index is only built the first time the `fulltext` scope is
+        searched. After that, :meth:`update_cache` keeps it current.
+
+        :returns: full path to file
+        :rtype: :class:`unicode`
+
+        """
+        if not self.index_is_current(self._fulltext_path, FULLTEXT_VERSION):
+            self.create_fulltext_db(self._fulltext_path)
+            self.update_fulltext_db()
+        return self._fulltext_path
+
+    @property
+    def ftcache_sqlite(self):
+        """Return path to ZotQuery's index of the `.zotero-ft-cache`
+        files in Zotero's storage directory.
+
+        The index is filled by a background job, which is started the
+        first time this property is accessed. After that,
+        :meth:`update_cache` starts it again to keep the index current.
+
+        :returns: full path to file or ``None`` if indexing is turned off
+        :rtype: :class:`unicode`
+
+        """
+        if not config.FTCACHE_WORKERS:
+            return None
+        # imported here, as only the `fulltext` scope needs it
+        from zotquery import ftcache
+        if not self.index_is_current(self._ftcache_path, ftcache.VERSION):
+            ftcache.create_db(self._ftcache_path)
+            self.update_ftcache_in_background()
+        return self._ftcache_path
+
+    @property
+    def usage_sqlite(self):
+        """Return path to ZotQuery's record of which items are used.
+
+        :returns: full path to file
+        :rtype: :class:`unicode`
+
+        """
+        if not self.index_is_current(self._usage_path, usage.VERSION):
+            usage.create_db(self._usage_path)
+        return self._usage_path
+
+    @property
+    def refcache_sqlite(self):
+        """Return path to ZotQuery's cache of formatted references.
+
+        :returns: full path to file
+        :rtype: :class:`unicode`
+
+        """
+        if not os.path.exists(self._refcache_path):
+            refcache.create_db(self._refcache_path)
+        return self._refcache_path
+
     # ZotQuery Formatting Properties ------------------------------------------
 
     @stored_property
@@ -198,6 +288,8 @@ class ZotqueryBackend(PropertyBase):
         """.format(**defaults)
 
         # Run `pashua` dialog and save results to storage file
+        # (imported here, as only settings dialogs need it)
+        from lib import pashua
         res_dict = pashua.run(conf, encoding='utf8', pashua_path=config.PASHUA)
         if res_dict['cb'] != 1:
             del res_dict['cb']
@@ -238,6 +330,7 @@ class ZotqueryBackend(PropertyBase):
         """Update `cloned_sqlite` so that it's current with `original_sqlite`.
 
         """
+        connections.close(self._clone_path)
         copyfile(self.zotero.original_sqlite, self._clone_path)
         log.info('Updated clone SQLite file')
 
@@ -251,12 +344,63 @@ class ZotqueryBackend(PropertyBase):
         self.cache
         log.info('Updated item cache')
 
+        # Search databases are rebuilt from the new cache on next access
+        for path in (self._fts_path, self._fts_ascii_path):
+            connections.close(path)
+            if os.path.exists(path):
+                os.unlink(path)
+
+        # The full-text indices are only updated if the user searches them
+        if self.index_is_current(self._fulltext_path, FULLTEXT_VERSION):
+            self.update_fulltext_db()
+        if config.FTCACHE_WORKERS:
+            from zotquery import ftcache
+            if self.index_is_current(self._ftcache_path, ftcache.VERSION):
+                self.update_ftcache_in_background()
+
     ## JSON to FTS sub-methods ------------------------------------------------
 
+    @staticmethod
+    def index_is_current(db, current=INDEX_VERSION):
+        """Does search database ``db`` exist and have the current layout?
+
+        Out-of-date databases are deleted.
+
+        :param db: path to `.db` file
+        :type db: :class:`unicode`
+        :param current: version of the current layout
+        :type current: :class:`int`
+        :returns: ``True`` if ``db`` can be used as is
+        :rtype: :class:`boolean`
+
+        """
+        if not os.path.exists(db):
+            return False
+        with closing(sqlite3.connect(db)) as con:
+            version = con.execute('PRAGMA user_version').fetchone()[0]
+        if version == current:
+            return True
+        log.info('Search database %s is out of date', db)
+        connections.close(db)
+        os.unlink(db)
+        return False
+
     @staticmethod
     def create_index_db(db):
         """Create FTS virtual table with data from ``json_data``
 
+        Also creates the `group_members` table, which maps each group
+        (``c_<collection key>`` or ``t_<tag ID>``) to the `docid` of
+        its items. The primary key keeps each group's `docid` values
+        in a sorted run, so membership checks are index lookups.
+
+        The `collection_tree` table is the closure of the collection
+        hierarchy: one (ancestor, descendant) row for every collection
+        and each collection nested anywhere below it (and itself).
+
+        The `metadata` table holds each item's key and the indexed
+        fields that search queries can filter on (type, year, library).
+
         :param db: path to `.db` file
         :type db: :class:`unicode`
 
@@ -271,12 +415,35 @@ class ZotqueryBackend(PropertyBase):
                     sql = """CREATE VIRTUAL TABLE zotquery
                              USING fts3({cols})""".format(cols=columns)
                     cur.execute(sql)
+                    cur.execute("""CREATE TABLE group_members (
+                                       group_id TEXT NOT NULL,
+                                       docid INTEGER NOT NULL,
+                                       PRIMARY KEY (group_id, docid)
+                                   ) WITHOUT ROWID""")
+                    cur.execute("""CREATE TABLE collection_tree (
+                                       ancestor TEXT NOT NULL,
+                                       descendant TEXT NOT NULL,
+                                       PRIMARY KEY (ancestor, descendant)
+                                   ) WITHOUT ROWID""")
+                    cur.execute("""CREATE TABLE metadata (
+                                       docid INTEGER PRIMARY KEY,
+                                       key TEXT NOT NULL,
+                                       type TEXT COLLATE NOCASE,
+                                       year INTEGER,
+                                       library TEXT
+                                   )""")
+                    for col in ('type', 'year', 'library'):
+                        cur.execute("""CREATE INDEX metadata_{0}
+                                       ON metadata ({0})""".format(col))
+                    cur.execute('PRAGMA user_version = {:d}'.format(
+                                INDEX_VERSION))
                     log.debug('Created FTS database: {}'.format(db))
 
     def update_index_db(self, fts_path, folded=False):
         """Update ``fts_sqlite`` with JSON data from ``json_data``.
 
-        Reads in data from ``json_data`` and adds it to the FTS database.
+        Reads in data from ``json_data`` and adds it to the FTS database,
+        along with each item's collection and tag memberships.
 
         :param fts_path: path to `.db` file
         :type fts_path: :class:`unicode`
@@ -290,7 +457,8 @@ class ZotqueryBackend(PropertyBase):
         with closing(sqlite3.connect(fts_path)) as con:
             with con as cur:
                 # iterate over every item in library
-                for d in self.generate_data():
+                for item in self.cache.values():
+                    d = self.item_columns(item)
                     # names of all keys for item (cf. `FILTERS['general']`)
                     columns = ', '.join(d.keys())
                     values = d.values()
@@ -302,11 +470,157 @@ class ZotqueryBackend(PropertyBase):
                              ({columns}) VALUES ({data})
                             """.format(columns=columns,
                                        data=','.join(['?'] * len(values)))
-                    cur.execute(sql, values)
+                    docid = cur.execute(sql, values).lastrowid
+                    cur.execute("""INSERT INTO metadata
+                                   (docid, key, type, year, library)
+                                   VALUES (?, ?, ?, ?, ?)""",
+                                (docid, item['key'], item['type'],
+                                 self.item_year(item),
+                                 unicode(item['library'])))
+                    cur.executemany("""INSERT OR IGNORE INTO group_members
+                                       (group_id, docid) VALUES (?, ?)""",
+                                    [(g, docid) for g in self.item_groups(item)])
                     count += 1
+                cur.executemany("""INSERT OR IGNORE INTO collection_tree
+                                   (ancestor, descendant) VALUES (?, ?)""",
+                                self.collection_closure())
 
         log.debug('Added/Updated %d items in %0.3fs', count, time() - start)
 
+    ## Full-text sub-methods -------------------------------------------------
+
+    @staticmethod
+    def create_fulltext_db(db):
+        """Create the tables of the full-text word index.
+
+        `words` holds each distinct word. `attachments` maps Zotero's
+        ID of each indexed attachment to its parent item's key, and
+        stores a signature of the attachment's `fulltextItems` row.
+        `attachment_words` maps each word to the attachments that
+        contain it. Its primary key keeps the attachments for each
+        word in a sorted run.
+
+        :param db: path to `.db` file
+        :type db: :class:`unicode`
+
+        """
+        with closing(sqlite3.connect(db)) as con:
+            with con as cur:
+                cur.execute("""CREATE TABLE words (
+                                   wordID INTEGER PRIMARY KEY,
+                                   word TEXT NOT NULL UNIQUE
+                               )""")
+                cur.execute("""CREATE TABLE attachments (
+                                   itemID INTEGER PRIMARY KEY,
+                                   parent TEXT NOT NULL,
+                                   signature TEXT NOT NULL
+                               )""")
+                cur.execute("""CREATE TABLE attachment_words (
+                                   wordID INTEGER NOT NULL,
+                                   itemID INTEGER NOT NULL,
+                                   PRIMARY KEY (wordID, itemID)
+                               ) WITHOUT ROWID""")
+                cur.execute("""CREATE INDEX attachment_words_itemID
+                               ON attachment_words (itemID)""")
+                cur.execute('PRAGMA user_version = {:d}'.format(
+                            FULLTEXT_VERSION))
+                log.debug('Created full-text database: {}'.format(db))
+
+    def update_fulltext_db(self):
+        """Import new and changed attachments from Zotero's word index.
+
+        Zotero stores the words it extracts from attachments in its
+        `fulltextWords` and `fulltextItemWords` tables. An attachment is
+        re-imported only if its `fulltextItems` row has changed since
+        the last update. Attachments that have been removed from Zotero,
+        or that have no parent item, are dropped from the index.
+
+        """
+        start = time()
+        sql = """
+            SELECT fulltextItems.itemID, parents.key,
+                   fulltextItems.version || ':' || fulltextItems.synced
+                   || ':' || IFNULL(fulltextItems.indexedPages, '')
+                   || ':' || IFNULL(fulltextItems.indexedChars, '')
+                   || ':' || IFNULL(fulltextItems.totalChars, '')
+            FROM zotero.fulltextItems
+                JOIN zotero.itemAttachments
+                    ON itemAttachments.itemID = fulltextItems.itemID
+                JOIN zotero.items AS parents
+                    ON parents.itemID = itemAttachments.parentItemID
+        """
+        with closing(sqlite3.connect(self._fulltext_path)) as con:
+            con.execute('ATTACH DATABASE ? AS zotero', (self.cloned_sqlite,))
+            con.execute('CREATE TEMP TABLE changed '
+                        '(itemID INTEGER PRIMARY KEY)')
+            current = dict((r[0], r[1:]) for r in con.execute(sql))
+            stored = dict((r[0], r[1:]) for r in con.execute(
+                'SELECT itemID, parent, signature FROM attachments'))
+            removed = [(id_,) for id_, v in stored.items()
+                       if current.get(id_) != v]
+            added = [(id_,) + v for id_, v in current.items()
+                     if stored.get(id_) != v]
+
+            with con as cur:
+                cur.executemany('INSERT INTO temp.changed VALUES (?)', removed)
+                cur.execute("""DELETE FROM attachment_words WHERE itemID IN
+                               (SELECT itemID FROM temp.changed)""")
+                cur.execute("""DELETE FROM attachments WHERE itemID IN
+                               (SELECT itemID FROM temp.changed)""")
+                cur.execute('DELETE FROM temp.changed')
+
+                cur.executemany('INSERT INTO temp.changed VALUES (?)',
+                                [r[:1] for r in added])
+                cur.executemany("""INSERT INTO attachments
+                                   (itemID, parent, signature)
+                                   VALUES (?, ?, ?)""", added)
+                # Words are matched by their text, not Zotero's IDs
+                cur.execute("""INSERT OR IGNORE INTO words (word)
+                               SELECT DISTINCT fulltextWords.word
+                               FROM temp.changed
+                                   JOIN zotero.fulltextItemWords
+                                       USING (itemID)
+                                   JOIN zotero.fulltextWords
+                                       USING (wordID)
+                               WHERE fulltextWords.word IS NOT NULL""")
+                cur.execute("""INSERT OR IGNORE INTO attachment_words
+                               (wordID, itemID)
+                               SELECT words.wordID, temp.changed.itemID
+                               FROM temp.changed
+                                   JOIN zotero.fulltextItemWords
+                                       USING (itemID)
+                                   JOIN zotero.fulltextWords
+                                       USING (wordID)
+                                   JOIN words
+                                       ON words.word = fulltextWords.word""")
+                if removed:
+                    cur.execute("""DELETE FROM words WHERE wordID NOT IN
+                                   (SELECT wordID FROM attachment_words)""")
+
+        log.debug('Full-text index: removed %d, added %d attachments '
+                  'in %0.3fs', len(removed), len(added), time() - start)
+
+    def record_usage(self, uid):
+        """Record that the item with ``uid`` has been used.
+
+        :param uid: ``<library>_<key>`` argument of item result
+        :type uid: :class:`unicode`
+
+        """
+        usage.record(self.usage_sqlite, uid.split('_')[-1])
+
+    def update_ftcache_in_background(self):
+        """Run :meth:`update_ftcache_db` in a background process."""
+        cmd = [sys.executable, self.wf.workflowfile('zotquery.py'),
+               'configure', 'ftcache']
+        run_in_background('ftcache', cmd)
+
+    def update_ftcache_db(self):
+        """Index new and changed `.zotero-ft-cache` files."""
+        from zotquery import ftcache
+        ftcache.update(self._ftcache_path, self.cloned_sqlite,
+                       self.zotero.internal_storage, config.FTCACHE_WORKERS)
+
     def generate_data(self):
         """Create a genererator with dictionaries for each item
         in ``json_data``.
@@ -315,24 +629,76 @@ class ZotqueryBackend(PropertyBase):
         :rtype: :class:`genererator`
 
         """
-        # json_data = utils.read_json(self.json_data)
-        # for item in json_data.itervalues():
-
         # for each `item`, get its data in dict format
         for item in self.cache.values():
-            array = []
-            # get search columns from scope
-            columns = config.FILTERS.get('general', None)
-            if columns:
-                data = OrderedDict()
-                for column in columns:
-                    # get search map from column
-                    json_map = config.FILTERS_MAP.get(column, None)
-                    if json_map:
-                        # get data from `item` using search map
-                        data[column] = self.get_datum(item, json_map)
-
-                yield data
+            yield self.item_columns(item)
+
+    def item_columns(self, item):
+        """Return search column data for ``item``.
+
+        :param item: item ``dict`` from the cache
+        :type item: :class:`dict`
+        :returns: ``dict`` with all item's data as ``strings``
+        :rtype: :class:`OrderedDict`
+
+        """
+        data = OrderedDict()
+        # get search columns from scope
+        for column in config.FILTERS.get('general', []):
+            # get search map from column
+            json_map = config.FILTERS_MAP.get(column, None)
+            if json_map:
+                # get data from `item` using search map
+                data[column] = self.get_datum(item, json_map)
+        return data
+
+    @staticmethod
+    def item_year(item):
+        """Return year of ``item`` as ``int`` or ``None``."""
+        year = item['data'].get('date', '')[:4]
+        return int(year) if year.isdigit() else None
+
+    @staticmethod
+    def item_groups(item):
+        """Return IDs of all collections and tags ``item`` belongs to.
+
+        IDs have the same form as the arguments of group results, i.e.
+        ``c_<collection key>`` and ``t_<tag ID>``.
+
+        :param item: item ``dict`` from the cache
+        :type item: :class:`dict`
+        :returns: group IDs
+        :rtype: :class:`list`
+
+        """
+        groups = ['c_{}'.format(c['key']) for c in item['zot-collections']]
+        groups.extend('t_{}'.format(t['id']) for t in item['zot-tags'])
+        return groups
+
+    def collection_closure(self):
+        """Generate (ancestor, descendant) pairs of the collection hierarchy.
+
+        Each collection is paired with itself and with every collection
+        above it. Collections are identified as ``c_<collection key>``.
+
+        :yields: ``tuple`` of ancestor and descendant IDs
+        :rtype: :class:`genererator`
+
+        """
+        sql = "SELECT collectionID, parentCollectionID, key FROM collections"
+        with closing(sqlite3.connect(self.cloned_sqlite)) as con:
+            rows = con.execute(sql).fetchall()
+        parents = dict((id_, parent) for id_, parent, _ in rows)
+        keys = dict((id_, 'c_{}'.format(key)) for id_, _, key in rows)
+
+        for id_ in parents:
+            seen = set()
+            ancestor = id_
+            # guard against cycles in a corrupt hierarchy
+            while ancestor in keys and ancestor not in seen:
+                seen.add(ancestor)
+                yield keys[ancestor], keys[id_]
+                ancestor = parents[ancestor]
 
     @staticmethod
     def get_datum(item, val_map):
@@ -14,6 +14,7 @@ import re
 import json
 import os.path
 import functools
+import time
 
 # Internal Dependencies
 from lib import utils
@@ -112,11 +113,59 @@ LARGE_TEXT = large_text
 PERSONAL_ONLY = False
 
 # Cache formatted references for faster re-retrieval?
+# (until the item changes in Zotero)
 CACHE_REFERENCES = True
 
+# Locale of formatted references
+CSL_LOCALE = 'en-US'
+
+# Format references from the entries cache, without the Zotero web
+# API, in the styles ZotQuery can format itself (see `csl.STYLES`)?
+# Faster, but only the common item types and fields are formatted
+# exactly as Zotero would. Either way, they are formatted locally when
+# the API can't be reached.
+LOCAL_CSL = False
+
+# Number of top search results whose references are fetched from the
+# web API in the background, before one is chosen. Off (0) by default,
+# as each search may then start a background process.
+PREFETCH_RESULTS = 0
+
+# Number of top results whose subtitles show where they matched
+# (if not in the title or creators) and that have large text
+SNIPPET_RESULTS = 20
+
+# Text before and after matches, and around snippets
+SNIPPET_MARKS = ('[', ']', '…')
+
+# Number of words in snippets
+SNIPPET_TOKENS = 10
+
+# How much are items that you open, export or append moved up in
+# search results? Each use adds this much to an item's rank, and
+# counts half as much after every FRECENCY_HALF_LIFE days.
+FRECENCY_WEIGHT = 0.5
+FRECENCY_HALF_LIFE = 30
+
+# Log how long each phase of a run takes to `timings.jsonl`
+# in the workflow's cache directory?
+LOG_TIMINGS = True
+
+# How long (in seconds) credentials read from the Keychain are reused
+# by a ZotQuery process before they are read again
+CREDENTIAL_TTL = 300
+
+# How often (in days) to check for a new version of ZotQuery
+UPDATE_FREQUENCY = 7
+
 # Allow ZotQuery to learn which items are used more frequently?
 ALFRED_LEARN = False
 
+# Number of processes that index the text Zotero has extracted
+# from attachments (`.zotero-ft-cache` files) for `fulltext`
+# searches. Set to 0 to turn this off.
+FTCACHE_WORKERS = 2
+
 # Accepted extensions for ZotQuery attachments
 ATTACH_EXTS = [
     'pdf',
@@ -173,14 +222,77 @@ FILTERS = {
     ]
 }
 
+# Map of query fields (`key`) to search columns (`value`),
+# e.g. `creator:smith`
+QUERY_COLUMNS = {
+    'key': 'key',
+    'title': 'title',
+    'creator': 'creators',
+    'author': 'creators',
+    'in': 'collection_title',
+    'publication': 'collection_title',
+    'date': 'date',
+    'tag': 'tags',
+    'collection': 'collections',
+    'attachment': 'attachments',
+    'note': 'notes'
+}
+
+# Map of query fields (`key`) to indexed item metadata (`value`),
+# e.g. `year:2010..2015`, `type:book`, `library:1`
+QUERY_FILTERS = {
+    'year': 'year',
+    'type': 'type',
+    'library': 'library'
+}
+
+# Short names for Zotero item types in `type:` filters
+TYPE_ALIASES = {
+    'article': 'journalArticle',
+    'chapter': 'bookSection',
+    'section': 'bookSection',
+    'conference': 'conferencePaper',
+    'paper': 'conferencePaper'
+}
+
+# Search columns that snippets are made from, in order of preference.
+# The others are shown in every result anyway.
+SNIPPET_COLUMNS = [
+    'notes', 'collection_title', 'tags', 'collections', 'attachments'
+]
+
 # Map of search types (`key`) to search filters (`value`)
 SCOPE_TYPES = {
     'items': ['general', 'titles', 'creators', 'attachments', 'notes'],
     'groups': ['collections', 'tags'],
     'in-groups': ['in-collection', 'in-tag'],
+    'fulltext': ['fulltext'],
     'meta': ['debug', 'new']
 }
 
+# Results per page of Zotero web API requests (the API's maximum)
+API_PAGE_SIZE = 100
+
+# Item keys per Zotero web API request (the API's maximum)
+API_KEYS_PER_REQUEST = 50
+
+# Number of Zotero web API requests made at the same time
+API_WORKERS = 4
+
+# Most Zotero web API requests per second (in bursts of up to as many;
+# requests answered `304 Not Modified` don't count), and how many times
+# a request is retried when the API is overloaded
+API_RATE = 10
+API_RETRIES = 3
+
+# Keep Zotero web API responses (in the workflow's cache directory),
+# so unchanged resources needn't be downloaded again? Set to `None`
+# to turn off.
+API_RESPONSES = 'api-responses.sqlite3'
+
+# GitHub repository whose releases are ZotQuery's updates
+GITHUB_SLUG = 'lutefiasco/alfred_zotquery'
+
 # Path to `pashua` housed in bundler directory
 PASHUA = os.path.join(WF.workflowfile('zotquery/lib/Pashua.app'),
                       'Contents/MacOS/Pashua')
@@ -190,6 +302,10 @@ PASHUA = os.path.join(WF.workflowfile('zotquery/lib/Pashua.app'),
 # WORKFLOW Classes and Functions
 # -----------------------------------------------------------------------------
 
+# Passwords read from (or saved to) the Keychain by this process,
+# ``{account: (time, password)}``
+_credentials = {}
+
 
 class PropertyBase(object):
 
@@ -239,7 +355,7 @@ class PropertyBase(object):
                 return pw
 
         def setter(properties):
-            self.wf.save_password(self.filename, json.dumps(properties))
+            self.save_password(self.filename, json.dumps(properties))
 
         return self.get_properties(getter, setter)
 
@@ -285,9 +401,17 @@ class PropertyBase(object):
         """Try to retrieve the password saved at ``account``.
         Return empty string if no password found.
 
+        Passwords are cached for `CREDENTIAL_TTL` seconds, so the
+        Keychain (i.e. `security`) isn't asked for them again and again.
+
         """
+        cached = _credentials.get(account)
+        if cached and time.time() - cached[0] < CREDENTIAL_TTL:
+            return cached[1]
         try:
-            return self.wf.get_password(account)
+            password = self.wf.get_password(account)
+            _credentials[account] = (time.time(), password)
+            return password
         except PasswordNotFound:
             if setter:
                 setter()
@@ -295,6 +419,11 @@ class PropertyBase(object):
             else:
                 return ''
 
+    def save_password(self, account, password):
+        """Save ``password`` at ``account`` in the Keychain and cache."""
+        self.wf.save_password(account, password)
+        _credentials[account] = (time.time(), password)
+
     def check_storage(self, name, setter=False):
         settings = self.wf.cached_data('output_settings', max_age=0)
         try:
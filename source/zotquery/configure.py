@@ -3,6 +3,9 @@
 from __future__ import unicode_literals
 # Internal Dependencies
 from . import zq
+import prefetch
+import timing
+import updates
 
 
 # 1.  ------------------------------
@@ -16,6 +19,12 @@ def configure(flag, arg, wf):
         return zq.web.api_properties_setter()
     elif flag == 'prefs':
         return zq.backend.formatting_properties_setter()
+    elif flag == 'ftcache':
+        return zq.backend.update_ftcache_db()
+    elif flag == 'update':
+        return updates.check(wf)
+    elif flag == 'prefetch':
+        return prefetch.run(wf)
     elif flag == 'all':
         return zq.web.api_properties_setter()
         return zq.backend.formatting_properties_setter()
@@ -29,7 +38,8 @@ def config_freshen(arg):
         zq.backend.update_clone()
         zq.backend.update_cache()
         return 0
-    update, spot = zq.backend.is_fresh()
+    with timing.span('freshness'):
+        update, spot = zq.backend.is_fresh()
     if update:
         if spot == 'Clone':
             zq.backend.update_clone()
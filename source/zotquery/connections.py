@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+"""Per-process registry of SQLite connections.
+
+Connections are shared by database path and role, so a search (or a
+batch of them) opens each database once. SQL functions and attached
+databases are set up once per connection, by the ``init`` callable
+passed when it is first requested, and `sqlite3` reuses the prepared
+statements of each connection (up to :data:`CACHED_STATEMENTS`).
+
+Connections for reading are opened with a read-only URI if SQLite
+interprets filenames as URIs, and otherwise switched to `query_only`.
+
+"""
+from __future__ import unicode_literals
+
+# Standard Library
+from contextlib import closing
+import sqlite3
+import urllib
+
+# Internal Dependencies
+import config
+
+# Prepared statements kept per connection
+CACHED_STATEMENTS = 100
+
+# Roles whose connections may write to the database
+WRITE_ROLES = ('write',)
+
+_connections = {}
+_uri_filenames = None
+
+
+def uri_filenames():
+    """Does SQLite interpret filenames as URIs (`SQLITE_USE_URI`)?"""
+    global _uri_filenames
+    if _uri_filenames is None:
+        with closing(sqlite3.connect(':memory:')) as con:
+            opts = [r[0] for r in con.execute('PRAGMA compile_options')]
+        _uri_filenames = 'USE_URI=1' in opts
+    return _uri_filenames
+
+
+# 1.  -------------------------------------------------------------------------
+def get(path, role='read', init=None):
+    """Return the shared connection to ``path`` for ``role``.
+
+    :param path: path to database
+    :type path: :class:`unicode`
+    :param role: what the connection is for. Connections for different
+        roles can be set up differently; only ``'write'`` connections
+        can change the database.
+    :type role: :class:`unicode`
+    :param init: called with the new connection when it is opened,
+        e.g. to register functions
+    :type init: ``callable``
+    :returns: connection to database
+    :rtype: :class:`sqlite3.Connection`
+
+    """
+    con = _connections.get((path, role))
+    if con is None:
+        con = connect(path, readonly=role not in WRITE_ROLES)
+        if init:
+            init(con)
+        _connections[(path, role)] = con
+        config.log.debug('Opened %s connection to `%s`', role,
+                         path.split('/')[-1])
+    return con
+
+
+## 1.1  -----------------------------------------------------------------------
+def connect(path, readonly=True):
+    """Open a new connection to ``path``."""
+    if readonly and uri_filenames():
+        uri = 'file:{}?mode=ro'.format(urllib.quote(path.encode('utf-8')))
+        return sqlite3.connect(uri, cached_statements=CACHED_STATEMENTS)
+    con = sqlite3.connect(path, cached_statements=CACHED_STATEMENTS)
+    if readonly:
+        con.execute('PRAGMA query_only = ON')
+    return con
+
+
+# 2.  -------------------------------------------------------------------------
+def close(path=None):
+    """Close all connections to ``path`` (or to every database).
+
+    Must be called before a database is deleted or replaced.
+
+    """
+    for key in _connections.keys():
+        if path is None or key[0] == path:
+            _connections.pop(key).close()
@@ -0,0 +1,392 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+"""Format citations and references without the Zotero web API.
+
+Items are formatted straight from the entries cache (see
+:meth:`ZotqueryBackend.get_all_items`) in the CSL styles that ZotQuery
+offers, except the two "scannable cite" styles (see :data:`STYLES`).
+The output is HTML like the API's (`citation` and `bib`).
+
+This is not a full CSL processor. Each style's rules for the common
+item types (articles, books, chapters, theses) are written out here,
+and all other types are formatted like articles. As the cache only
+keeps the year of each item's date, so do the references.
+
+"""
+from __future__ import unicode_literals
+
+# Standard Library
+import re
+
+# Creator types that are an item's authors, if it has any
+AUTHOR_TYPES = ('author', 'bookAuthor', 'artist', 'director', 'inventor',
+                'programmer', 'presenter', 'interviewee', 'cartographer',
+                'composer', 'podcaster', 'performer', 'sponsor')
+
+# Item types formatted as a book, a part of a book and a thesis
+BOOK_TYPES = ('book', 'report', 'film', 'computerProgram', 'map',
+              'artwork', 'audioRecording', 'videoRecording')
+CHAPTER_TYPES = ('bookSection', 'conferencePaper', 'encyclopediaArticle',
+                 'dictionaryEntry')
+THESIS_TYPES = ('thesis',)
+
+# BibTeX entry types, by item type
+BIBTEX_TYPES = {'journalArticle': 'article', 'magazineArticle': 'article',
+                'newspaperArticle': 'article', 'book': 'book',
+                'bookSection': 'incollection',
+                'conferencePaper': 'inproceedings', 'thesis': 'phdthesis',
+                'report': 'techreport', 'manuscript': 'unpublished'}
+
+# Item fields written to BibTeX entries, by BibTeX field
+BIBTEX_FIELDS = (('title', 'title'), ('journal', 'publicationTitle'),
+                 ('booktitle', 'bookTitle'), ('booktitle', 'proceedingsTitle'),
+                 ('volume', 'volume'), ('number', 'issue'),
+                 ('pages', 'pages'), ('edition', 'edition'),
+                 ('publisher', 'publisher'), ('school', 'university'),
+                 ('institution', 'institution'), ('address', 'place'),
+                 ('doi', 'DOI'), ('url', 'url'), ('year', 'date'))
+
+# Words left out of BibTeX citekeys
+STOP_WORDS = ('a', 'an', 'the', 'on', 'of', 'in', 'and', 'for', 'to')
+
+
+def escape(text):
+    """Return ``text`` with HTML special characters escaped."""
+    return (text.replace('&', '&amp;').replace('<', '&lt;')
+            .replace('>', '&gt;'))
+
+
+# 1.  -------------------------------------------------------------------------
+def supports(style):
+    """Can references in CSL ``style`` be formatted here?
+
+    :param style: name of CSL style, e.g. ``'apa'``
+    :type style: :class:`unicode`
+    :rtype: :class:`boolean`
+
+    """
+    return style in STYLES
+
+
+def citation(item, style):
+    """Return HTML of the in-text citation of ``item``.
+
+    :param item: item ``dict`` from the entries cache
+    :type item: :class:`dict`
+    :param style: name of CSL style in :data:`STYLES`
+    :type style: :class:`unicode`
+    :rtype: :class:`unicode`
+
+    """
+    return '<span>{}</span>'.format(STYLES[style][0](item))
+
+
+def reference(item, style):
+    """Return HTML of the bibliography entry of ``item``.
+
+    :param item: item ``dict`` from the entries cache
+    :type item: :class:`dict`
+    :param style: name of CSL style in :data:`STYLES`
+    :type style: :class:`unicode`
+    :rtype: :class:`unicode`
+
+    """
+    entry = STYLES[style][1](item)
+    return ('<div class="csl-bib-body">\n'
+            '  <div class="csl-entry">{}</div>\n'
+            '</div>').format(entry)
+
+
+## 1.1  -----------------------------------------------------------------------
+def authors(item):
+    """Return ``(creators, editors)`` of ``item``, in order.
+
+    The authors are the creators of the first of :data:`AUTHOR_TYPES`
+    the item has (or of its first creator's type). If the item has no
+    authors, its editors take their place.
+
+    """
+    creators = sorted(item.get('creators', []), key=lambda c: c['index'])
+    editors = [c for c in creators if c['type'] == 'editor']
+    types = [c['type'] for c in creators]
+    kind = next((t for t in AUTHOR_TYPES if t in types),
+                types[0] if types else None)
+    if kind in (None, 'editor'):
+        return editors, []
+    return [c for c in creators if c['type'] == kind], editors
+
+
+def field(item, name):
+    """Return HTML-escaped value of field ``name`` (or ``''``)."""
+    return escape(item['data'].get(name) or '').strip()
+
+
+def year(item):
+    return field(item, 'date') or 'n.d.'
+
+
+def container(item):
+    """Return title of the journal, book, etc. the item is part of."""
+    for name in ('publicationTitle', 'bookTitle', 'proceedingsTitle',
+                 'encyclopediaTitle', 'dictionaryTitle', 'websiteTitle',
+                 'blogTitle', 'forumTitle'):
+        if field(item, name):
+            return field(item, name)
+    return ''
+
+
+def page_range(item):
+    return field(item, 'pages').replace('-', '–')
+
+
+def publisher(item):
+    """Return ``place: publisher`` of ``item``."""
+    parts = [field(item, 'place'), field(item, 'publisher')]
+    return ': '.join(p for p in parts if p)
+
+
+def family(creator):
+    return escape(creator.get('family') or '')
+
+
+def given(creator):
+    return escape(creator.get('given') or '')
+
+
+def full_name(creator):
+    return ' '.join(n for n in (given(creator), family(creator)) if n)
+
+
+def inverted_name(creator):
+    return ', '.join(n for n in (family(creator), given(creator)) if n)
+
+
+def initials(creator):
+    """Return ``Family, G. H.`` for ``creator``."""
+    names = re.split(r'[\s.]+', creator.get('given') or '')
+    inits = ' '.join(escape(n[0]) + '.' for n in names if n)
+    return ', '.join(n for n in (family(creator), inits) if n)
+
+
+def join(names, conjunction, serial=True):
+    """Join ``names`` as a list: ``A, B, and C``."""
+    if len(names) < 2:
+        return ''.join(names)
+    if len(names) == 2 and not serial:
+        return '{} {} {}'.format(names[0], conjunction, names[1])
+    return '{}, {} {}'.format(', '.join(names[:-1]), conjunction, names[-1])
+
+
+def sentence(text):
+    """Return ``text`` ending in a full stop."""
+    text = text.strip()
+    if not text or text[-1] in '.?!':
+        return text
+    return text + '.'
+
+
+def short_names(item, conjunction, limit):
+    """Return family names of ``item``'s authors for a citation.
+
+    More than ``limit`` authors are shortened to ``First et al.``.
+
+    """
+    names = [family(c) for c in authors(item)[0]]
+    if not names:
+        return '<i>{}</i>'.format(field(item, 'title'))
+    if len(names) > limit:
+        return names[0] + ' et al.'
+    return join(names, conjunction, serial=len(names) > 2)
+
+
+def title_part(item, quoted):
+    """Return the title, in quotes for parts of a container or in
+    italics for stand-alone works.
+
+    """
+    title = field(item, 'title')
+    if not quoted:
+        return '<i>{}</i>'.format(title)
+    if title and title[-1] not in '.?!':
+        title += '.'
+    return '“{}”'.format(title)
+
+
+def is_part(item):
+    return item['type'] not in BOOK_TYPES + THESIS_TYPES
+
+
+# 2.  -------------------------------------------------------------------------
+def chicago_citation(item):
+    return '({} {})'.format(short_names(item, 'and', 3), year(item))
+
+
+def chicago_reference(item):
+    """Chicago Manual of Style (17th ed.), author-date."""
+    creators, editors = authors(item)
+    names = [inverted_name(c) if i == 0 else full_name(c)
+             for i, c in enumerate(creators)]
+    parts = [sentence(join(names, 'and')), sentence(year(item))]
+    title = title_part(item, is_part(item))
+    parts.append(title if is_part(item) else sentence(title))
+    if item['type'] in CHAPTER_TYPES:
+        text = 'In <i>{}</i>'.format(container(item))
+        if editors and creators:
+            text += ', edited by ' + join([full_name(c) for c in editors],
+                                          'and', serial=len(editors) > 2)
+        if page_range(item):
+            text += ', ' + page_range(item)
+        parts.append(sentence(text))
+        parts.append(sentence(publisher(item)))
+    elif item['type'] in THESIS_TYPES:
+        kind = field(item, 'thesisType') or 'PhD diss.'
+        parts.append(sentence(', '.join(p for p in (
+            kind, field(item, 'university')) if p)))
+    elif not is_part(item):
+        parts.append(sentence(publisher(item)))
+    else:
+        text = '<i>{}</i>'.format(container(item)) if container(item) else ''
+        if field(item, 'volume'):
+            text += ' ' + field(item, 'volume')
+        if field(item, 'issue'):
+            text += ' ({})'.format(field(item, 'issue'))
+        if page_range(item):
+            text += ': ' + page_range(item)
+        parts.append(sentence(text))
+    if field(item, 'DOI'):
+        parts.append('https://doi.org/{}.'.format(field(item, 'DOI')))
+    return ' '.join(p for p in parts if p)
+
+
+# 3.  -------------------------------------------------------------------------
+def apa_citation(item):
+    return '({}, {})'.format(short_names(item, '&amp;', 2), year(item))
+
+
+def apa_reference(item):
+    """American Psychological Association (7th ed.)."""
+    creators, editors = authors(item)
+    names = [initials(c) for c in creators]
+    if len(names) == 2:
+        names = '{}, &amp; {}'.format(*names)
+    else:
+        names = join(names, '&amp;')
+    parts = [names, '({}).'.format(year(item))]
+    title = field(item, 'title')
+    if is_part(item):
+        parts.append(sentence(title))
+    else:
+        parts.append(sentence('<i>{}</i>'.format(title)))
+    if item['type'] in CHAPTER_TYPES:
+        text = 'In '
+        if editors and creators:
+            eds = [' '.join(initials(c).split(', ')[::-1]) for c in editors]
+            text += '{} ({}), '.format(join(eds, '&amp;'),
+                                       'Eds.' if len(eds) > 1 else 'Ed.')
+        text += '<i>{}</i>'.format(container(item))
+        if page_range(item):
+            text += ' (pp. {})'.format(page_range(item))
+        parts.append(sentence(text))
+        parts.append(sentence(field(item, 'publisher')))
+    elif item['type'] in THESIS_TYPES:
+        parts.append(sentence('[{}, {}]'.format(
+            field(item, 'thesisType') or 'Doctoral dissertation',
+            field(item, 'university'))))
+    elif not is_part(item):
+        parts.append(sentence(field(item, 'publisher')))
+    else:
+        text = '<i>{}</i>'.format(container(item)) if container(item) else ''
+        if field(item, 'volume'):
+            text += ', <i>{}</i>'.format(field(item, 'volume'))
+        if field(item, 'issue'):
+            text += '({})'.format(field(item, 'issue'))
+        if page_range(item):
+            text += ', ' + page_range(item)
+        parts.append(sentence(text))
+    if field(item, 'DOI'):
+        parts.append('https://doi.org/{}'.format(field(item, 'DOI')))
+    return ' '.join(p for p in parts if p)
+
+
+# 4.  -------------------------------------------------------------------------
+def mla_citation(item):
+    return '({})'.format(short_names(item, 'and', 2))
+
+
+def mla_reference(item):
+    """Modern Language Association (8th ed.)."""
+    creators, editors = authors(item)
+    if len(creators) > 2:
+        names = inverted_name(creators[0]) + ', et al'
+    else:
+        names = join([inverted_name(c) if i == 0 else full_name(c)
+                      for i, c in enumerate(creators)], 'and')
+    parts = [sentence(names), title_part(item, is_part(item))]
+    if not is_part(item):
+        parts[-1] = sentence(parts[-1])
+    details = []
+    if container(item):
+        details.append('<i>{}</i>'.format(container(item)))
+    if editors and creators:
+        details.append('edited by ' + join([full_name(c) for c in editors],
+                                           'and', serial=len(editors) > 2))
+    if field(item, 'volume'):
+        details.append('vol. ' + field(item, 'volume'))
+    if field(item, 'issue'):
+        details.append('no. ' + field(item, 'issue'))
+    if not is_part(item) or item['type'] in CHAPTER_TYPES:
+        details.append(field(item, 'publisher') or
+                       field(item, 'university'))
+    details.append(field(item, 'date'))
+    if page_range(item):
+        details.append('pp. ' + page_range(item))
+    parts.append(sentence(', '.join(d for d in details if d)))
+    return ' '.join(p for p in parts if p)
+
+
+# 5.  -------------------------------------------------------------------------
+def bibtex_citation(item):
+    return citekey(item)
+
+
+def bibtex_reference(item):
+    """BibTeX entry, like Zotero's `bibtex` CSL style."""
+    creators, editors = authors(item)
+    fields = []
+    if creators:
+        fields.append(('author', ' and '.join(inverted_name(c)
+                                              for c in creators)))
+    if editors:
+        fields.append(('editor', ' and '.join(inverted_name(c)
+                                              for c in editors)))
+    for name, source in BIBTEX_FIELDS:
+        value = field(item, source)
+        if value and name not in dict(fields):
+            fields.append((name, value.replace('-', '--') if name == 'pages'
+                           else value))
+    body = ',\n'.join('\t{} = {{{}}}'.format(*f) for f in fields)
+    return '@{}{{{},\n{}\n}}'.format(BIBTEX_TYPES.get(item['type'], 'misc'),
+                                    citekey(item), body)
+
+
+def citekey(item):
+    """Return ``family_word_year`` citekey of ``item``."""
+    creators = authors(item)[0]
+    name = family(creators[0]) if creators else ''
+    words = [w for w in re.findall(r'\w+', item['data'].get('title') or '',
+                                   re.UNICODE) if w.lower() not in STOP_WORDS]
+    parts = [name, words[0] if words else '', field(item, 'date')]
+    key = '_'.join(p for p in parts if p).lower()
+    return re.sub(r'[\s{},~#%\\]', '', key)
+
+
+# Citation and reference formatters, by style
+STYLES = {
+    'chicago-author-date': (chicago_citation, chicago_reference),
+    'apa': (apa_citation, apa_reference),
+    'modern-language-association': (mla_citation, mla_reference),
+    'bibtex': (bibtex_citation, bibtex_reference),
+}
@@ -0,0 +1,202 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+"""Find the user's Zotero database and preferences.
+
+Zotero (5 and later) keeps its database in ``~/Zotero`` unless its
+`dataDir` preference says otherwise, and its preferences in the
+`prefs.js` file of a profile directory. Zotero 4 for Firefox kept both
+in the Firefox profile.
+
+Files are looked for in these well-known locations first (on macOS and
+Linux). Only if none of them has the file is the home directory
+scanned, with `mdfind` on macOS and by walking it elsewhere. Found
+paths are cached in :data:`CACHE` and used for as long as they exist;
+files that weren't found aren't scanned for again for a day.
+
+"""
+from __future__ import unicode_literals
+
+# Standard Library
+from glob import glob
+import json
+import os
+import re
+import subprocess
+import sys
+from time import time
+
+# Internal Dependencies
+import config
+
+# Cache file (in workflow's cache directory) of found paths
+CACHE = 'zotero-paths.json'
+
+# Seconds before a file that a scan didn't find is scanned for again
+SCAN_INTERVAL = 86400
+
+# Directories of Zotero and Firefox profiles, in order of preference
+PROFILE_DIRS = [
+    '~/Library/Application Support/Zotero/Profiles',
+    '~/.zotero/zotero',
+    '~/Library/Application Support/Firefox/Profiles',
+    '~/.mozilla/firefox',
+]
+
+# Zotero's default data directory
+DATA_DIR = '~/Zotero'
+
+# How many directories deep the home directory is walked, and which
+# hidden directories are walked
+SCAN_DEPTH = 6
+SCAN_HIDDEN = ('.zotero', '.mozilla')
+
+PREF_RE = re.compile(r'^user_pref\("extensions\.zotero\.([^"]+)",\s*(.+)\);',
+                     re.MULTILINE)
+
+# path -> (mtime, prefs) of parsed `prefs.js` files
+_prefs = {}
+
+
+# 1.  -------------------------------------------------------------------------
+def sqlite():
+    """Return path to Zotero's `zotero.sqlite` (or ``None``)."""
+    candidates = (os.path.join(d, 'zotero.sqlite') for d in data_dirs())
+    return locate('zotero.sqlite', candidates)
+
+
+## 1.1  -----------------------------------------------------------------------
+def data_dirs():
+    """Generate directories that may hold Zotero's data, most likely first.
+    """
+    pref = prefs()
+    if pref.get('useDataDir', True) and pref.get('dataDir'):
+        yield pref['dataDir']
+    if pref.get('lastDataDir'):
+        yield pref['lastDataDir']
+    yield os.path.expanduser(DATA_DIR)
+    # Zotero 4 (for Firefox or standalone)
+    for path in profile_prefs():
+        yield os.path.join(os.path.dirname(path), 'zotero')
+
+
+# 2.  -------------------------------------------------------------------------
+def prefs():
+    """Return Zotero's preferences, without the ``extensions.zotero.``
+    prefix, e.g. ``{'dataDir': '/Users/me/Zotero', ...}``.
+
+    :rtype: :class:`dict`
+
+    """
+    path = locate('prefs.js', profile_prefs())
+    return read_prefs(path) if path else {}
+
+
+## 2.1  -----------------------------------------------------------------------
+def profile_prefs():
+    """Return `prefs.js` files in well-known profile directories,
+    most recently changed first within each location.
+
+    """
+    paths = []
+    for dirpath in PROFILE_DIRS:
+        found = glob(os.path.join(os.path.expanduser(dirpath), '*',
+                                  'prefs.js'))
+        paths.extend(sorted(found, key=os.path.getmtime, reverse=True))
+    return paths
+
+
+## 2.2  -----------------------------------------------------------------------
+def read_prefs(path):
+    """Parse the Zotero preferences in `prefs.js` file at ``path``.
+
+    Each file is only parsed once per process (unless it changes).
+
+    """
+    mtime = os.path.getmtime(path)
+    if path not in _prefs or _prefs[path][0] != mtime:
+        with open(path, 'rb') as fp:
+            text = fp.read().decode('utf-8', 'replace')
+        values = {}
+        for name, value in PREF_RE.findall(text):
+            # Values are JS literals, which JSON can read (mostly)
+            try:
+                values[name] = json.loads(value)
+            except ValueError:
+                values[name] = value.strip('"')
+        _prefs[path] = (mtime, values)
+    return _prefs[path][1]
+
+
+# 3.  -------------------------------------------------------------------------
+def locate(name, candidates):
+    """Return path to file ``name``.
+
+    The cached path is returned if it still exists. Otherwise the first
+    existing path in ``candidates`` is, or failing that the first found
+    by :func:`scan` (unless the last scan was less than
+    :data:`SCAN_INTERVAL` ago).
+
+    :param name: file name
+    :type name: :class:`unicode`
+    :param candidates: paths where the file is expected
+    :type candidates: iterable
+    :returns: path or ``None`` if the file isn't found
+    :rtype: :class:`unicode`
+
+    """
+    cache = config.WF.cachefile(CACHE)
+    try:
+        with open(cache, 'rb') as fp:
+            paths = json.load(fp)
+    except (IOError, ValueError):
+        paths = {}
+    # ``[path, time of last scan]``
+    cached, scanned = paths.get(name) or (None, 0)
+    if cached and os.path.isfile(cached):
+        return cached
+
+    path = next((p for p in candidates if os.path.isfile(p)), None)
+    if path is None:
+        if cached is None and time() - scanned < SCAN_INTERVAL:
+            # Not found by the last scan either
+            return None
+        config.log.info('Scanning for `%s` ...', name)
+        path = next(iter(scan(name)), None)
+        scanned = time()
+    paths[name] = [path, scanned]
+    with open(cache, 'wb') as fp:
+        json.dump(paths, fp)
+    return path
+
+
+# 4.  -------------------------------------------------------------------------
+def scan(name):
+    """Return paths of all files called ``name`` in the home directory.
+
+    Uses Spotlight (`mdfind`) on macOS. Elsewhere, walks the home
+    directory (:data:`SCAN_DEPTH` deep, skipping most hidden
+    directories).
+
+    :rtype: :class:`list`
+
+    """
+    home = os.path.expanduser('~')
+    if sys.platform == 'darwin':
+        cmd = ['mdfind', 'kMDItemFSName={}'.format(name), '-onlyin', home]
+        output = subprocess.check_output(cmd).decode('utf-8')
+        return [s.strip() for s in output.split('\n') if s.strip()]
+
+    found = []
+    depth = home.rstrip(os.sep).count(os.sep)
+    for dirpath, dirnames, filenames in os.walk(home):
+        if name in filenames:
+            found.append(os.path.join(dirpath, name))
+        if dirpath.count(os.sep) - depth >= SCAN_DEPTH:
+            dirnames[:] = []
+        else:
+            dirnames[:] = [d for d in dirnames
+                           if not d.startswith('.') or d in SCAN_HIDDEN]
+    return found
@@ -2,14 +2,21 @@
 # encoding: utf-8
 from __future__ import unicode_literals
 # Standard Library
+from collections import OrderedDict
+import httplib
 import re
-import subprocess
 # Internal Dependencies
-from lib import html2text, utils
+from lib import html2rtf, html2text, utils
 from . import zq
 import config
+import csl
+import refcache
 import search
 
+# Errors of Zotero web API requests, after which references are
+# formatted locally if their style can be
+API_ERRORS = (IOError, httplib.HTTPException)
+
 
 # 1.  -------------------------------------------------------------------------
 def export(flag, uid, wf):
@@ -21,6 +28,8 @@ def export(flag, uid, wf):
     """
     # Retrieve HTML of item
     cites = get_export_html(flag, uid, wf)
+    if flag in ('bib', 'citation'):
+        zq.backend.record_usage(uid)
     # Export text of item to clipboard
     text = export_formatted(cites, flag, wf)
     utils.set_clipboard(text.strip())
@@ -31,27 +40,46 @@ def export(flag, uid, wf):
 def get_export_html(flag, uid, wf):
     """Get HTML of item reference.
 
+    References are formatted locally if possible (see :mod:`csl`).
+    Otherwise, they are fetched from the Zotero web API and cached (see
+    :mod:`refcache`) until the item, or an item in the group, changes
+    in Zotero. If the API can't be reached, they are formatted locally
+    after all, if the style allows.
+
     """
-    # check if item reference has already been generated and cached
-    no_cache = True
-    cached = wf.cached_data(uid, max_age=600)
-    if cached:
-        # check if item reference is right kind
-        if flag in cached.keys():
-            cites = cached[flag]
-            no_cache = False
-    # if not exported before
-    if no_cache:
-        # Choose appropriate code branch
-        if flag in ('bib', 'citation'):
-            cites = export_item(flag, uid)
-        elif flag == 'group':
-            cites = export_group(uid)
-        # Cache exported HTML?
-        if config.CACHE_REFERENCES:
-            cache = {flag: cites}
-            wf.cache_data(uid, cache)
-    return cites
+    cites = export_local(flag, uid)
+    if cites is not None:
+        return cites
+    try:
+        if not config.CACHE_REFERENCES:
+            return export_html(flag, uid)
+        db = zq.backend.refcache_sqlite
+        version = refcache.version(zq.backend.cloned_sqlite, uid)
+        key = (uid, version, zq.backend.csl_style, flag,
+               config.CSL_LOCALE)
+        cites = refcache.get(db, *key) if version else None
+        if cites is None:
+            cites = export_html(flag, uid)
+            if version:
+                refcache.put(db, *key + (cites,))
+        return cites
+    except API_ERRORS:
+        cites = export_local(flag, uid, fallback=True)
+        if cites is None:
+            raise
+        return cites
+
+
+## 1.1.0  ---------------------------------------------------------------------
+def export_html(flag, uid):
+    """Get HTML of item reference from the Zotero API.
+
+    """
+    # Choose appropriate code branch
+    if flag in ('bib', 'citation'):
+        return export_item(flag, uid)
+    elif flag == 'group':
+        return export_group(uid)
 
 
 ## 1.1.1  ---------------------------------------------------------------------
@@ -62,7 +90,8 @@ def export_item(flag, uid):
     item_id = uid.split('_')[1]
     cite = zq.web.item(item_id,
                        include=flag,
-                       style=zq.backend.csl_style)
+                       style=zq.backend.csl_style,
+                       locale=config.CSL_LOCALE)
     return cite[flag]
 
 
@@ -76,10 +105,11 @@ def export_group(uid):
         marker = item_id
         ref_method = zq.web.collection_references
     elif group_type == 't':
-        marker = search._get_tag_name(item_id)
+        marker = search.get_tag_name(item_id)
         ref_method = zq.web.tag_references
     cites = ref_method(marker,
-                       style=zq.backend.csl_style)
+                       style=zq.backend.csl_style,
+                       locale=config.CSL_LOCALE)
     bib = '\n\n'.join(cites)
     return _bib_sort(bib, '\n\n')
 
@@ -97,6 +127,83 @@ def _bib_sort(bib, delim):
     return delim.join(sorted_bib)
 
 
+## 1.1.3  ---------------------------------------------------------------------
+def export_local(flag, uid, fallback=False):
+    """Format item (or group) from the entries cache.
+
+    :param fallback: format it even if `config.LOCAL_CSL` is off, as
+        the web API has failed
+    :type fallback: ``bool``
+    :returns: HTML like the API's, or ``None`` if the CSL style (or
+        an item) can't be formatted locally, or the group is empty
+    :rtype: ``unicode``
+
+    """
+    style = zq.backend.csl_style
+    if not ((config.LOCAL_CSL or fallback) and csl.supports(style)):
+        return None
+    if flag == 'group':
+        keys = search.get_group_keys(uid)
+    else:
+        keys = [uid.split('_')[1]]
+    items = [zq.backend.cache.get(key) for key in keys]
+    if not items or None in items:
+        return None
+    if flag == 'citation':
+        return csl.citation(items[0], style)
+    refs = [csl.reference(item, style) for item in items]
+    if flag == 'bib':
+        return refs[0]
+    return _bib_sort('\n\n'.join(refs), '\n\n')
+
+
+### 1.1.3.1  ------------------------------------------------------------------
+def items_bibliography(keys):
+    """Get citations and references of the items with ``keys``.
+
+    Formatted locally if possible (see :func:`export_local`), and
+    otherwise by the Zotero web API.
+
+    :returns: ``{'cites': [...], 'refs': [...]}``
+    :rtype: ``dict``
+
+    """
+    bib = _local_bibliography(keys)
+    if bib is not None:
+        return bib
+    try:
+        return zq.web.items_bibliography(keys,
+                                         style=zq.backend.csl_style,
+                                         locale=config.CSL_LOCALE)
+    except API_ERRORS:
+        bib = _local_bibliography(keys, fallback=True)
+        if bib is None:
+            raise
+        return bib
+
+
+#### 1.1.3.1.1  ---------------------------------------------------------------
+def _local_bibliography(keys, fallback=False):
+    """Format the items with ``keys`` from the entries cache.
+
+    :param fallback: as for :func:`export_local`
+    :type fallback: ``bool``
+    :returns: as :func:`items_bibliography`, or ``None`` if the items
+        can't be formatted locally
+    :rtype: ``dict``
+
+    """
+    style = zq.backend.csl_style
+    if not ((config.LOCAL_CSL or fallback) and csl.supports(style)):
+        return None
+    keys = list(OrderedDict.fromkeys(keys))
+    items = [zq.backend.cache.get(key) for key in keys]
+    if None in items:
+        return None
+    return {'cites': [csl.citation(i, style) for i in items],
+            'refs': [csl.reference(i, style) for i in items]}
+
+
 ## 1.2  -----------------------------------------------------------------------
 def export_formatted(cites, flag, wf):
     """Format the HTML citations in the proper format.
@@ -105,7 +212,7 @@ def export_formatted(cites, flag, wf):
     if zq.backend.output_format == 'Markdown':
         return _export_markdown(cites, flag)
     elif zq.backend.output_format == 'Rich Text':
-        return _export_rtf(cites, flag, wf)
+        return _export_rtf(cites, flag)
     else:
         msg = 'Invalid format: {}'.format(zq.backend.output_format)
         raise ValueError(msg)
@@ -123,16 +230,13 @@ def _export_markdown(html, flag):
 
 
 #### 1.2.2  -------------------------------------------------------------------
-def _export_rtf(html, flag, wf):
+def _export_rtf(html, flag):
     """Convert to RTF"""
-    path = wf.cachefile('temp_export.html')
     html = _prepare_html(html)
     if flag == 'citation':
         if zq.backend.csl_style == 'bibtex':
             html = '[@' + html.strip() + ']'
-    utils.write_path(html, path)
-    rtf = html2rtf(path)
-    return rtf
+    return html2rtf.html2rtf(html)
 
 
 ##### 1.2.1.1; 1.2.2.1 --------------------------------------------------------
@@ -143,16 +247,6 @@ def _prepare_html(html):
     return ascii_html.strip()
 
 
-##### 1.2.2.2  ----------------------------------------------------------------
-def html2rtf(path):
-    """Convert html to RTF and copy to clipboard"""
-    return subprocess.check_output(['textutil',
-                                    '-convert',
-                                    'rtf',
-                                    path,
-                                    '-stdout'])
-
-
 ###### 1.2.1.1.1  -------------------------------------------------------------
 def _preprocess(item):
     """Clean up `item` formatting"""
@@ -0,0 +1,255 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+"""Index the `.zotero-ft-cache` files in Zotero's storage directory.
+
+Zotero keeps the text it extracts from each attachment in
+``storage/<attachment key>/.zotero-ft-cache``, even if the words have
+been pruned from its own full-text index. This module adds that text
+to a separate FTS database.
+
+Files are split into chunks of :data:`CHUNK_SIZE` bytes (on whitespace),
+so memory use is bounded however large a file is. Files bigger than
+one chunk are read via `mmap`. Chunks are read and decoded by a pool
+of worker processes, and written to the database by the calling
+process.
+
+Each chunk is an FTS row whose `docid` is the file's ID shifted left by
+:data:`DOCID_BITS` plus the chunk's number, so all chunks of a file
+form a contiguous `docid` range.
+
+"""
+from __future__ import unicode_literals
+
+# Standard Library
+from contextlib import closing
+from itertools import islice
+import os
+import re
+import sqlite3
+from time import time
+
+# Internal Dependencies
+import config
+
+# Bump when the layout of the database changes to force a rebuild
+VERSION = 1
+
+FILENAME = '.zotero-ft-cache'
+
+# Chunks are read and indexed in pieces of this many bytes
+CHUNK_SIZE = 1 << 20
+
+# Number of low bits of a chunk's `docid` used for the chunk number
+DOCID_BITS = 20
+
+# Chunks handed to each worker process per batch
+BATCH_SIZE = 4
+
+# Write chunks to the database in transactions of this many
+COMMIT_EVERY = 50
+
+WHITESPACE_RE = re.compile(br'\s')
+
+
+# 1.  -------------------------------------------------------------------------
+def create_db(db):
+    """Create the tables of the `.zotero-ft-cache` index.
+
+    `files` holds the key, parent item key, size and modification time
+    of every indexed file. `chunks` holds their text.
+
+    :param db: path to `.db` file
+    :type db: :class:`unicode`
+
+    """
+    with closing(sqlite3.connect(db)) as con:
+        # Searches can read while the indexer writes
+        con.execute('PRAGMA journal_mode = WAL')
+        with con as cur:
+            cur.execute("""CREATE TABLE files (
+                               fileID INTEGER PRIMARY KEY,
+                               attachment TEXT NOT NULL UNIQUE,
+                               parent TEXT NOT NULL,
+                               size INTEGER,
+                               mtime REAL
+                           )""")
+            cur.execute("CREATE VIRTUAL TABLE chunks USING fts4(text)")
+            cur.execute('PRAGMA user_version = {:d}'.format(VERSION))
+    config.log.debug('Created ft-cache database: {}'.format(db))
+
+
+# 2.  -------------------------------------------------------------------------
+def update(db, clone, storage, workers=1):
+    """Index new and changed `.zotero-ft-cache` files.
+
+    Files whose size and modification time are the same as when they
+    were last indexed are skipped. Files of attachments that no longer
+    exist are removed from the index.
+
+    :param db: path to `.db` file created by :func:`create_db`
+    :type db: :class:`unicode`
+    :param clone: path to ZotQuery's clone of Zotero's database
+    :type clone: :class:`unicode`
+    :param storage: path to Zotero's storage directory
+    :type storage: :class:`unicode`
+    :param workers: number of processes that read files
+    :type workers: :class:`int`
+
+    """
+    start = time()
+    with closing(sqlite3.connect(db)) as con:
+        stored = dict((r[0], r[1:]) for r in con.execute(
+            'SELECT attachment, fileID, parent, size, mtime FROM files'))
+
+        changed = []
+        found = set()
+        for attachment, parent in get_attachments(clone):
+            path = os.path.join(storage, attachment, FILENAME)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            found.add(attachment)
+            info = (parent, stat.st_size, stat.st_mtime)
+            if attachment not in stored or stored[attachment][1:] != info:
+                changed.append((attachment, path) + info)
+
+        stale = found.intersection(c[0] for c in changed)
+        removed = [v[0] for k, v in stored.items()
+                   if k not in found or k in stale]
+        with con as cur:
+            for file_id in removed:
+                first = file_id << DOCID_BITS
+                cur.execute("""DELETE FROM chunks
+                               WHERE docid BETWEEN ? AND ?""",
+                            (first, first + (1 << DOCID_BITS) - 1))
+                cur.execute('DELETE FROM files WHERE fileID = ?', (file_id,))
+
+        # `size` and `mtime` are only set once all chunks of a file are
+        # written, so files are re-indexed if the indexer is interrupted
+        pending = {}
+        tasks = []
+        with con as cur:
+            for attachment, path, parent, size, mtime in changed:
+                file_id = cur.execute("""INSERT INTO files (attachment, parent)
+                                         VALUES (?, ?)""",
+                                      (attachment, parent)).lastrowid
+                offsets = range(0, size, CHUNK_SIZE)[:1 << DOCID_BITS]
+                pending[file_id] = [len(offsets), size, mtime]
+                tasks.extend((file_id << DOCID_BITS | i, path, offset, size)
+                             for i, offset in enumerate(offsets))
+            cur.executemany("""UPDATE files SET size = ?, mtime = ?
+                               WHERE fileID = ?""",
+                            [(v[1], v[2], k) for k, v in pending.items()
+                             if not v[0]])
+
+        count = 0
+        for docid, text in read_chunks(tasks, workers):
+            if text:
+                con.execute('INSERT INTO chunks (docid, text) VALUES (?, ?)',
+                            (docid, text))
+            file_id = docid >> DOCID_BITS
+            pending[file_id][0] -= 1
+            if not pending[file_id][0]:
+                _, size, mtime = pending.pop(file_id)
+                con.execute("""UPDATE files SET size = ?, mtime = ?
+                               WHERE fileID = ?""", (size, mtime, file_id))
+            count += 1
+            if not count % COMMIT_EVERY:
+                con.commit()
+        con.commit()
+
+    config.log.debug('ft-cache index: removed %d, added %d files '
+                     '(%d chunks) in %0.3fs', len(removed), len(changed),
+                     count, time() - start)
+
+
+## 2.1  -----------------------------------------------------------------------
+def get_attachments(clone):
+    """Generate ``(attachment key, parent key)`` for all child attachments.
+
+    :param clone: path to ZotQuery's clone of Zotero's database
+    :type clone: :class:`unicode`
+
+    """
+    sql = """
+        SELECT items.key, parents.key
+        FROM itemAttachments
+            JOIN items ON items.itemID = itemAttachments.itemID
+            JOIN items AS parents
+                ON parents.itemID = itemAttachments.parentItemID
+    """
+    with closing(sqlite3.connect(clone)) as con:
+        for row in con.execute(sql):
+            yield row
+
+
+## 2.2  -----------------------------------------------------------------------
+def read_chunks(tasks, workers=1):
+    """Generate ``(docid, text)`` for each task in ``tasks``.
+
+    Tasks are handed to the worker processes in batches, so at most
+    ``workers * BATCH_SIZE`` chunks are in memory at once.
+
+    """
+    if workers < 2:
+        for task in tasks:
+            yield read_chunk(task)
+        return
+
+    # imported here, as searches import this module for its constants
+    import multiprocessing
+    tasks = iter(tasks)
+    pool = multiprocessing.Pool(workers)
+    try:
+        while True:
+            batch = list(islice(tasks, workers * BATCH_SIZE))
+            if not batch:
+                break
+            for result in pool.imap_unordered(read_chunk, batch):
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+### 2.2.1  --------------------------------------------------------------------
+def read_chunk(task):
+    """Return ``(docid, text)`` of the chunk described by ``task``.
+
+    ``task`` is a ``(docid, path, offset, size)`` tuple. The chunk
+    starts after the first whitespace at or after ``offset`` and ends
+    after the first whitespace at or after the start of the next chunk,
+    so words are never split between chunks. Unreadable files have no
+    text.
+
+    """
+    docid, path, offset, size = task
+    try:
+        with open(path, 'rb') as fp:
+            if size <= CHUNK_SIZE:
+                data = fp.read()
+            else:
+                import mmap
+                buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    data = buf[word_boundary(buf, offset):
+                               word_boundary(buf, offset + CHUNK_SIZE)]
+                finally:
+                    buf.close()
+    except (IOError, OSError, ValueError) as err:
+        config.log.error('Could not read %s : %s', path, err)
+        return docid, None
+    return docid, data.decode('utf-8', 'replace')
+
+
+#### 2.2.1.1  -----------------------------------------------------------------
+def word_boundary(buf, pos):
+    """Return position after first whitespace at or after ``pos``."""
+    if pos <= 0:
+        return 0
+    m = WHITESPACE_RE.search(buf, pos)
+    return m.end() if m else len(buf)
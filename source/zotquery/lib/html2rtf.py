@@ -0,0 +1,227 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+"""Convert the HTML of formatted citations and references to RTF.
+
+Only the HTML that CSL processors (and the Zotero API) produce is
+understood: text in `div`, `p` and `span` elements, styled with `i`,
+`em`, `b`, `strong`, `u`, `sup`, `sub` and `sc` elements or the
+equivalent inline CSS. Other elements are kept as their text.
+
+RTF is written to a file-like object as the HTML is parsed, so no
+temporary files or external programs (e.g. macOS's `textutil`) are
+needed.
+
+"""
+from __future__ import unicode_literals
+
+from htmlentitydefs import name2codepoint
+from HTMLParser import HTMLParser
+import re
+from StringIO import StringIO
+
+HEADER = (r'{\rtf1\ansi\ansicpg1252\deff0'
+          r'{\fonttbl{\f0\froman Times New Roman;}}'
+          '\n' r'\f0\fs24 ')
+FOOTER = '}'
+
+# RTF control words for styling elements
+TAG_STYLES = {
+    'i': r'\i', 'em': r'\i', 'cite': r'\i',
+    'b': r'\b', 'strong': r'\b',
+    'u': '\\ul',
+    'sup': r'\super', 'sub': r'\sub',
+    'sc': r'\scaps',
+}
+
+# RTF control words for inline CSS, by (property, value)
+CSS_STYLES = {
+    ('font-style', 'italic'): r'\i',
+    ('font-style', 'normal'): r'\i0',
+    ('font-weight', 'bold'): r'\b',
+    ('font-weight', 'normal'): r'\b0',
+    ('font-variant', 'small-caps'): r'\scaps',
+    ('font-variant', 'normal'): r'\scaps0',
+    ('text-decoration', 'underline'): '\\ul',
+    ('vertical-align', 'super'): r'\super',
+    ('vertical-align', 'sub'): r'\sub',
+}
+
+# Elements that are paragraphs
+BLOCKS = ('div', 'p', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+
+# Elements without end tags
+VOID = ('br', 'img', 'hr', 'meta', 'link', 'input')
+
+# Elements whose content isn't text
+SKIP = ('head', 'style', 'script', 'title')
+
+WHITESPACE = re.compile(r'\s+')
+
+
+def escape(text):
+    """Return ``text`` as RTF (which is ASCII)."""
+    out = []
+    for char in text:
+        code = ord(char)
+        if char in '\\{}':
+            out.append('\\' + char)
+        elif code < 128:
+            out.append(char)
+        elif code < 0x10000:
+            # signed 16-bit, followed by a replacement for readers
+            # that don't know `\u`
+            out.append('\\u{}?'.format(code if code < 0x8000
+                                       else code - 0x10000))
+        else:
+            # astral characters as UTF-16 surrogate pairs
+            code -= 0x10000
+            for unit in (0xD800 + (code >> 10), 0xDC00 + (code & 0x3FF)):
+                out.append('\\u{}?'.format(unit - 0x10000))
+    return ''.join(out)
+
+
+def css_styles(style):
+    """Return RTF control words for inline CSS ``style``."""
+    words = []
+    for declaration in style.split(';'):
+        prop, _, value = declaration.partition(':')
+        word = CSS_STYLES.get((prop.strip().lower(), value.strip().lower()))
+        if word:
+            words.append(word)
+    return words
+
+
+class RTFWriter(HTMLParser):
+    """Write RTF for the HTML fed to it to file-like ``out``.
+
+    Call :meth:`close` when all HTML has been fed, to finish the RTF.
+
+    """
+
+    def __init__(self, out):
+        HTMLParser.__init__(self)
+        self.out = out
+        # For each open element, whether it opened an RTF group
+        self.stack = []
+        # Is there text in the current paragraph? Is whitespace due
+        # before the next text?
+        self.pending = False
+        self.space = False
+        self.skipping = 0
+        self.out.write(HEADER)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP:
+            self.skipping += 1
+            return
+        if tag == 'br':
+            self.out.write('\\line ')
+            self.space = False
+            return
+        if tag in VOID:
+            return
+        if tag in BLOCKS:
+            self.end_paragraph()
+        words = []
+        if tag in TAG_STYLES:
+            words.append(TAG_STYLES[tag])
+        words.extend(css_styles(dict(attrs).get('style') or ''))
+        if words:
+            self.write_space()
+            self.out.write('{' + ''.join(words) + ' ')
+        self.stack.append((tag, bool(words)))
+
+    def handle_startendtag(self, tag, attrs):
+        if tag == 'br':
+            self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in SKIP:
+            self.skipping = max(self.skipping - 1, 0)
+            return
+        if tag in VOID or tag not in [t for t, _ in self.stack]:
+            return
+        # Close elements left open inside this one, too
+        while self.stack:
+            name, group = self.stack.pop()
+            if group:
+                self.out.write('}')
+            if name == tag:
+                break
+        if tag in BLOCKS:
+            self.end_paragraph()
+
+    def handle_data(self, data):
+        if self.skipping:
+            return
+        if not isinstance(data, unicode):
+            data = data.decode('utf-8')
+        # Whitespace is collapsed, as in HTML
+        text = WHITESPACE.sub(' ', data)
+        if not text.strip():
+            self.space = self.space or (bool(text) and self.pending)
+            return
+        if text[0] == ' ' and self.pending:
+            self.space = True
+        self.write_space()
+        self.out.write(escape(text.strip()))
+        self.pending = True
+        self.space = text[-1] == ' '
+
+    def handle_entityref(self, name):
+        if name in name2codepoint:
+            self.handle_data(unichr(name2codepoint[name]))
+        else:
+            self.handle_data('&{};'.format(name))
+
+    def handle_charref(self, name):
+        if name.lower().startswith('x'):
+            code = int(name[1:], 16)
+        else:
+            code = int(name)
+        self.write_space()
+        self.out.write(escape(unichr(code) if code < 0x10000
+                              else ('\\U%08x' % code).decode(
+                                  'unicode-escape')))
+        self.pending = True
+
+    def write_space(self):
+        if self.space:
+            self.out.write(' ')
+        self.space = False
+
+    def end_paragraph(self):
+        """End the current paragraph if it has any text."""
+        if self.pending:
+            self.out.write('\\par\n')
+        self.pending = self.space = False
+
+    def close(self):
+        HTMLParser.close(self)
+        while self.stack:
+            if self.stack.pop()[1]:
+                self.out.write('}')
+        self.out.write(FOOTER)
+
+
+def write(html, out):
+    """Write RTF of ``html`` to file-like ``out``."""
+    writer = RTFWriter(out)
+    writer.feed(html)
+    writer.close()
+
+
+def html2rtf(html):
+    """Return RTF of ``html``.
+
+    :param html: HTML of citations or references
+    :type html: :class:`unicode` or UTF-8 :class:`str`
+    :rtype: :class:`str`
+
+    """
+    buf = StringIO()
+    write(html, buf)
+    return buf.getvalue().encode('ascii')
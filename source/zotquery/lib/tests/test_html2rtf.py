@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""Unit tests for html2rtf.py"""
+
+from __future__ import print_function, absolute_import, unicode_literals
+
+import pytest
+
+from zotquery.lib.html2rtf import HEADER, FOOTER, html2rtf
+
+
+def body(rtf):
+    """Return ``rtf`` without header and footer."""
+    assert rtf.startswith(HEADER) and rtf.endswith(FOOTER)
+    return rtf[len(HEADER):-len(FOOTER)]
+
+
+@pytest.mark.parametrize('html,expected', [
+    ('(Smith 2001)', '(Smith 2001)'),
+    ('<i>Title</i>, <b>bold</b>', '{\\i Title}, {\\b bold}'),
+    ('a<sup>2</sup>', 'a{\\super 2}'),
+    ('<span style="font-variant:small-caps;">Caps</span> and <sc>sc</sc>',
+     '{\\scaps Caps} and {\\scaps sc}'),
+    ('<span style="font-style: italic">it</span>', '{\\i it}'),
+    ('{braces} \\ back', '\\{braces\\} \\\\ back'),
+    ('&amp; &#8220;q&#x201d; &eacute;', '& \\u8220?q\\u8221? \\u233?'),
+    ('<i>open', '{\\i open}'),
+])
+def test_inline(html, expected):
+    """Inline elements, escapes and entities."""
+    assert body(html2rtf(html)) == expected
+
+
+def test_unicode():
+    """Non-ASCII text is escaped, astral characters as surrogates."""
+    rtf = html2rtf('Olé \U0001f600'.encode('utf-8'))
+    assert isinstance(rtf, bytes)
+    assert body(rtf) == 'Ol\\u233? \\u-10179?\\u-8704?'
+
+
+def test_bibliography():
+    """Each entry is a paragraph, whitespace between them is dropped."""
+    html = ('<div class="csl-bib-body">\n'
+            '  <div class="csl-entry">Doe, Jane.  <i>One</i>.</div>\n'
+            '  <div class="csl-entry">\n   Roe, Jim. Two.</div>\n'
+            '</div>')
+    assert body(html2rtf(html)) == ('Doe, Jane. {\\i One}.\\par\n'
+                                    'Roe, Jim. Two.\\par\n')
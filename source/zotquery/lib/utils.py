@@ -245,13 +245,6 @@ def convert(camel_case):
 
 def html2rtf(html_path):
     """Convert html to RTF and copy to clipboard"""
-    textutil = subprocess.Popen(
-        ["textutil", "-convert", "rtf", html_path, '-stdout'],
-        stdout=subprocess.PIPE)
-    copy = subprocess.Popen(
-        ["pbcopy"],
-        stdin=textutil.stdout)
-
-    textutil.stdout.close()
-    copy.communicate()
+    from html2rtf import html2rtf as convert_html
+    set_clipboard(convert_html(read_path(html_path)))
     return True
@@ -15,8 +15,11 @@ def open(flag, arg, wf):
 
     """
     if flag == 'item':
+        zq.backend.record_usage(arg)
         open_item(arg)
     elif flag == 'attachment':
+        if not os.path.isfile(arg):
+            zq.backend.record_usage(arg)
         open_attachment(arg)
 
 
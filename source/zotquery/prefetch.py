@@ -0,0 +1,167 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+"""Fetch the references of the top search results before one is chosen.
+
+Prefetching is off unless `config.PREFETCH_RESULTS` is set. Then, once
+a search has sent its results to Alfred, :func:`queue` writes the
+arguments of the top results whose references aren't cached yet to
+:data:`QUEUE` and starts a background job (`configure prefetch`). The
+job, :func:`run`, exports the citation and reference of each queued
+item, which puts them in the reference cache (see :mod:`refcache`).
+Exporting the item the user then chooses doesn't wait for the web API.
+
+The queue's ``job`` flag says whether a job will read the queue again.
+It is only changed with the queue locked: :func:`queue` sets it when it
+starts a job, and :func:`run` clears it when it finds nothing new and
+exits. Items queued while a job is running are therefore always
+fetched, by that job or by a new one.
+
+References that :mod:`csl` formats locally are fast anyway, so nothing
+is queued for its styles.
+
+"""
+from __future__ import unicode_literals
+
+# Standard Library
+import json
+import sys
+import time
+
+# Internal Dependencies
+from . import zq
+import config
+import refcache
+
+# Alfred-Workflow
+from workflow.background import is_running, run_in_background
+from workflow.workflow import LockFile
+
+QUEUE = 'prefetch.json'
+
+# Exports made for each queued item
+FLAGS = ('citation', 'bib')
+
+# Times a job is started while the last one is still exiting, and
+# seconds between tries
+START_TRIES = 10
+START_DELAY = 0.05
+
+
+def read(wf):
+    """Return the queue (or ``None``)."""
+    try:
+        with open(wf.cachefile(QUEUE), 'rb') as fp:
+            return json.load(fp)
+    except (IOError, ValueError):
+        return None
+
+
+def write(wf, todo):
+    with open(wf.cachefile(QUEUE), 'wb') as fp:
+        json.dump(todo, fp)
+
+
+def items(todo):
+    """Return the queued style and arguments of ``todo``."""
+    return (todo or {}).get('style'), (todo or {}).get('args')
+
+
+# 1.  -------------------------------------------------------------------------
+def queue(wf, style, args):
+    """Queue items ``args`` and start the background job if need be.
+
+    :param wf: a :class:`Workflow` instance
+    :type wf: :class:`object`
+    :param style: current CSL style
+    :type style: :class:`unicode`
+    :param args: ``<library>_<key>`` arguments of results, best first
+    :type args: :class:`list`
+    :returns: ``True`` if the queue was changed
+    :rtype: :class:`bool`
+
+    """
+    args = args[:config.PREFETCH_RESULTS]
+    if not (args and config.CACHE_REFERENCES):
+        return False
+    if config.LOCAL_CSL:
+        # imported here, as most searches don't need it
+        import csl
+        if csl.supports(style):
+            return False
+    args = refcache.missing(zq.backend.refcache_sqlite,
+                            zq.backend.cloned_sqlite, args, style, FLAGS,
+                            config.CSL_LOCALE)
+    if not args:
+        return False
+    with LockFile(wf.cachefile(QUEUE)):
+        queued = read(wf)
+        if items(queued) == (style, args):
+            return False
+        # A job that hasn't exited reads the queue again (unless it
+        # crashed)
+        job = bool(queued and queued.get('job')) and is_running('prefetch')
+        write(wf, {'style': style, 'args': args, 'job': True})
+    if not job:
+        start(wf)
+    return True
+
+
+## 1.1  -----------------------------------------------------------------------
+def start(wf):
+    """Start the background job."""
+    cmd = [sys.executable, wf.workflowfile('zotquery.py'),
+           'configure', 'prefetch']
+    for _ in range(START_TRIES):
+        # `None` if the last job's process is still running
+        if run_in_background('prefetch', cmd) is not None:
+            return
+        time.sleep(START_DELAY)
+    config.log.error('Prefetch job could not be started')
+
+
+# 2.  -------------------------------------------------------------------------
+def run(wf):
+    """Export the queued items, until the queue stops changing.
+
+    Stops fetching a queue at its first network error (e.g. when
+    offline).
+
+    :param wf: a :class:`Workflow` instance
+    :type wf: :class:`object`
+
+    """
+    done = None
+    while True:
+        with LockFile(wf.cachefile(QUEUE)):
+            todo = read(wf)
+            if not todo or items(todo) == done:
+                if todo:
+                    # From now on, :func:`queue` starts a new job
+                    todo['job'] = False
+                    write(wf, todo)
+                return
+        # The same results aren't queued again (even if they failed),
+        # new ones are
+        fetch(wf, todo['args'])
+        done = items(todo)
+
+
+## 2.1  -----------------------------------------------------------------------
+def fetch(wf, args):
+    """Export items ``args``. Return ``False`` on a network error."""
+    # imported here, as searches don't need them
+    import httplib
+    import socket
+    import export
+    for arg in args:
+        for flag in FLAGS:
+            try:
+                export.get_export_html(flag, arg, wf)
+            except (IOError, socket.timeout, httplib.HTTPException) as err:
+                config.log.error('Prefetch of %s failed: %s', arg, err)
+                return False
+    config.log.debug('Prefetched %d items', len(args))
+    return True
@@ -0,0 +1,392 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+"""Compile structured search arguments into a single SQLite query.
+
+Supported syntax (terms are ANDed together):
+
+    smith               text term, searched in the scope's columns
+    "exact phrase"      phrase
+    creator:smith       text term restricted to one column
+    year:2010..2015     range (also `year:2010`, `year:2010..`, `year:..2015`)
+    type:book           item type (see `config.TYPE_ALIASES`)
+    library:1           Zotero library ID
+    -tag:read           negation of any of the above
+
+Text terms become one FTS `MATCH` expression; `type`, `year` and
+`library` are compiled to conditions on the indexed `metadata` table
+of the search database, so all filtering happens inside SQLite.
+
+Item queries expect the usage database (see :mod:`usage`) to be
+attached as `usage`, and add each item's decayed use count to its rank.
+
+"""
+from __future__ import unicode_literals
+
+# Standard Library
+from contextlib import closing
+import re
+import sqlite3
+
+# Internal Dependencies
+import config
+import usage
+
+TOKEN_RE = re.compile(r"""
+    (?P<neg>-)?
+    (?:(?P<field>[A-Za-z]+):)?
+    (?:"(?P<phrase>[^"]*)"?|(?P<word>[^\s"]+))
+""", re.VERBOSE | re.UNICODE)
+
+# What the FTS tokenizer considers part of a word
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+YEAR_RE = re.compile(r'^(\d{1,4})?(?:(\.\.)(\d{1,4})?)?$')
+
+# Words the FTS query parser treats as operators
+OPERATORS = ('AND', 'OR', 'NOT', 'NEAR')
+
+_enhanced = None
+
+
+class Term(object):
+    """One parsed search term.
+
+    :param value: text of the term
+    :type value: ``unicode``
+    :param field: name of field the term applies to (or ``None``)
+    :type field: ``unicode``
+    :param negated: term was prefixed with ``-``
+    :type negated: ``Boolean``
+    :param phrase: term was quoted
+    :type phrase: ``Boolean``
+
+    """
+    def __init__(self, value, field=None, negated=False, phrase=False):
+        self.value = value
+        self.field = field
+        self.negated = negated
+        self.phrase = phrase
+        # Match as prefix (i.e. the user is still typing it)
+        self.prefix = False
+
+    def __repr__(self):
+        return 'Term({!r}, field={!r}, negated={!r}, phrase={!r})'.format(
+            self.value, self.field, self.negated, self.phrase)
+
+
+def enhanced_syntax():
+    """Does SQLite use the enhanced FTS query syntax?
+
+    The two syntaxes differ in operator precedence, so grouped
+    expressions need parentheses only with the enhanced one.
+
+    """
+    global _enhanced
+    if _enhanced is None:
+        with closing(sqlite3.connect(':memory:')) as con:
+            opts = [r[0] for r in con.execute('PRAGMA compile_options')]
+        _enhanced = 'ENABLE_FTS3_PARENTHESIS' in opts
+    return _enhanced
+
+
+# 1.  -------------------------------------------------------------------------
+def parse(query):
+    """Split ``query`` into a list of :class:`Term` objects.
+
+    Unknown fields are treated as text, so malformed input never
+    produces an invalid query.
+
+    """
+    terms = []
+    for m in TOKEN_RE.finditer(query):
+        phrase = m.group('phrase') is not None
+        value = m.group('phrase') if phrase else m.group('word')
+        field = m.group('field')
+        if field:
+            field = field.lower()
+            if (field not in config.QUERY_COLUMNS and
+                    field not in config.QUERY_FILTERS):
+                value = '{}:{}'.format(m.group('field'), value)
+                field = None
+        terms.append(Term(value, field, bool(m.group('neg')), phrase))
+
+    # Last word is still being typed
+    if terms and query[-1:].strip() and not terms[-1].phrase:
+        terms[-1].prefix = True
+    return terms
+
+
+# 2.  -------------------------------------------------------------------------
+def compile_query(query, columns, conditions=()):
+    """Compile ``query`` into an SQL statement for the search database.
+
+    :param query: user's search arguments
+    :type query: ``unicode``
+    :param columns: FTS columns to search for text without a field
+    :type columns: ``list``
+    :param conditions: extra ``(sql, params)`` conditions on `metadata`
+    :type conditions: ``list``
+    :returns: ``(sql, params)`` or ``None`` if there's nothing to search
+    :rtype: ``tuple``
+
+    """
+    match, where, params = compile_terms(query, columns)
+
+    for sql, values in conditions:
+        where.append(sql)
+        params.extend(values)
+
+    used = usage.BOOST_SQL
+    if match:
+        sections = ["SELECT metadata.key,",
+                    "rank(matchinfo(zotquery)) + {} AS score".format(used),
+                    "FROM zotquery CROSS JOIN metadata",
+                    "ON metadata.docid = zotquery.docid",
+                    "LEFT JOIN usage.items AS used",
+                    "ON used.key = metadata.key",
+                    "WHERE zotquery MATCH ?"]
+        sections.extend('AND ' + w for w in where)
+        sections.append("ORDER BY score DESC;")
+        params[:0] = usage.boost_params() + [match]
+    elif where:
+        sections = ["SELECT metadata.key, {} AS score".format(used),
+                    "FROM metadata",
+                    "LEFT JOIN usage.items AS used",
+                    "ON used.key = metadata.key",
+                    "WHERE " + ' AND '.join(where),
+                    "ORDER BY score DESC, metadata.docid;"]
+        params[:0] = usage.boost_params()
+    else:
+        return None
+
+    return ' '.join(sections), tuple(params)
+
+
+## 2.1  -----------------------------------------------------------------------
+def compile_terms(query, columns):
+    """Compile the terms of ``query``.
+
+    Returns the FTS `MATCH` expression for all positive text terms
+    (or ``None``) and the SQL conditions and their parameters for the
+    other terms.
+
+    :rtype: ``tuple``
+
+    """
+    matches = []
+    where, params = [], []
+    for term in parse(query):
+        if term.field in config.QUERY_FILTERS:
+            condition = compile_filter(term)
+            if condition:
+                where.append(condition[0])
+                params.extend(condition[1])
+            continue
+
+        cols = [config.QUERY_COLUMNS[term.field]] if term.field else columns
+        expr = compile_text(term, cols)
+        if not expr:
+            continue
+        if term.negated:
+            # Both FTS syntaxes agree on a single MATCH, so exclude
+            # negated terms with a sub-query instead of `-` or `NOT`
+            where.append('metadata.docid NOT IN (SELECT docid FROM zotquery '
+                         'WHERE zotquery MATCH ?)')
+            params.append(expr)
+        else:
+            matches.append(expr)
+
+    if not matches:
+        return None, where, params
+    if enhanced_syntax():
+        matches = ['({})'.format(m) if ' OR ' in m else m for m in matches]
+    return ' '.join(matches), where, params
+
+
+## 2.2  -----------------------------------------------------------------------
+def compile_text(term, columns=None):
+    """Return FTS expression matching ``term`` in any of ``columns``
+    (or in any column of the table).
+
+    """
+    words = WORD_RE.findall(term.value)
+    # Keep query words from being read as operators
+    words = [w.lower() if w.upper() in OPERATORS else w for w in words]
+    if not words:
+        return None
+    if term.prefix:
+        words[-1] += '*'
+    if columns is None:
+        if len(words) == 1:
+            return words[0]
+        return '"{}"'.format(' '.join(words))
+    # FTS3 can't restrict a quoted phrase to a column, so the words of
+    # a phrase must be next to each other (in either order) instead
+    return ' OR '.join(' NEAR/0 '.join('{}:{}'.format(col, word)
+                                       for word in words)
+                       for col in columns)
+
+
+## 2.3  -----------------------------------------------------------------------
+def compile_filter(term):
+    """Return ``(sql, params)`` condition on `metadata` for ``term``."""
+    column = config.QUERY_FILTERS[term.field]
+    value = term.value.strip()
+    if column == 'year':
+        m = YEAR_RE.match(value)
+        if not m or not (m.group(1) or m.group(3)):
+            return None
+        start, dots, end = m.groups()
+        if not dots:
+            sql, params = 'metadata.year = ?', [int(start)]
+        elif start and end:
+            sql, params = 'metadata.year BETWEEN ? AND ?', [int(start),
+                                                            int(end)]
+        elif start:
+            sql, params = 'metadata.year >= ?', [int(start)]
+        else:
+            sql, params = 'metadata.year <= ?', [int(end)]
+    elif column == 'type':
+        value = config.TYPE_ALIASES.get(value.lower(), value)
+        sql, params = 'metadata.type = ?', [value]
+    else:
+        sql, params = 'metadata.{} = ?'.format(column), [value]
+
+    if term.negated:
+        sql = '(metadata.{} IS NULL OR NOT {})'.format(column, sql)
+    return sql, params
+
+
+## 2.4  -----------------------------------------------------------------------
+def compile_snippet_query(query, columns, keys):
+    """Compile SQL statement to get snippets of the matches of ``query``
+    in the items with ``keys``.
+
+    Each row holds an item's key, the `offsets()` of its matches and
+    a snippet of each column in `config.SNIPPET_COLUMNS`. Snippets
+    are only generated for the rows of ``keys``.
+
+    :param query: user's search arguments
+    :type query: ``unicode``
+    :param columns: FTS columns to search for text without a field
+    :type columns: ``list``
+    :param keys: keys of items to get snippets for
+    :type keys: ``list``
+    :returns: ``(sql, params)`` or ``None`` if there's no text to match
+    :rtype: ``tuple``
+
+    """
+    match = compile_terms(query, columns)[0]
+    if not match or not keys:
+        return None
+    start, end, ellipsis = config.SNIPPET_MARKS
+    snippets, params = [], []
+    for column in config.SNIPPET_COLUMNS:
+        snippets.append('snippet(zotquery, ?, ?, ?, {:d}, ?)'.format(
+            config.FILTERS['general'].index(column)))
+        params.extend([start, end, ellipsis, config.SNIPPET_TOKENS])
+    sections = ["SELECT metadata.key, offsets(zotquery),",
+                ', '.join(snippets),
+                "FROM zotquery CROSS JOIN metadata",
+                "ON metadata.docid = zotquery.docid",
+                "WHERE zotquery MATCH ?",
+                "AND metadata.key IN ({})".format(', '.join('?' * len(keys)))]
+    params.append(match)
+    params.extend(keys)
+    return ' '.join(sections), tuple(params)
+
+
+# 3.  -------------------------------------------------------------------------
+def compile_fulltext_query(query):
+    """Compile ``query`` into an SQL statement for the full-text index.
+
+    Each word is looked up in the words Zotero has extracted from
+    attachments. Results are the parent items of attachments that
+    contain every word (and none of the negated ones), ranked by the
+    number of such attachments. Fields and filters are ignored.
+
+    :param query: user's search arguments
+    :type query: ``unicode``
+    :returns: ``(sql, params)`` or ``None`` if there's nothing to search
+    :rtype: ``tuple``
+
+    """
+    where, params = [], []
+    positive = False
+    for term in parse(query):
+        if term.field in config.QUERY_FILTERS:
+            continue
+        words = WORD_RE.findall(term.value.lower())
+        for i, word in enumerate(words):
+            if term.prefix and i == len(words) - 1:
+                # Zotero's words are lowercase, so a range lookup on
+                # the word's index finds all completions
+                match, values = 'word >= ? AND word < ?', [word,
+                                                           word + '\uffff']
+            else:
+                match, values = 'word = ?', [word]
+            where.append('attachments.itemID {}IN (SELECT itemID FROM '
+                         'attachment_words WHERE wordID IN (SELECT wordID '
+                         'FROM words WHERE {}))'.format(
+                             'NOT ' if term.negated else '', match))
+            params.extend(values)
+            positive = positive or not term.negated
+
+    if not positive:
+        return None
+    sections = ["SELECT attachments.parent, COUNT(*) AS score",
+                "FROM attachments",
+                "WHERE " + ' AND '.join(where),
+                "GROUP BY attachments.parent",
+                "ORDER BY score DESC;"]
+    return ' '.join(sections), tuple(params)
+
+
+# 4.  -------------------------------------------------------------------------
+def compile_ftcache_query(query):
+    """Compile ``query`` into an SQL statement for the index of
+    `.zotero-ft-cache` files.
+
+    Results are the parent items of files with a chunk that matches
+    every term (and no chunk that matches a negated term). There is a
+    row for each matching chunk, ordered by rank, so items may appear
+    more than once. Fields and filters are ignored.
+
+    :param query: user's search arguments
+    :type query: ``unicode``
+    :returns: ``(sql, params)`` or ``None`` if there's nothing to search
+    :rtype: ``tuple``
+
+    """
+    # imported here, as only the `fulltext` scope needs it
+    import ftcache
+    matches = []
+    where, params = [], []
+    for term in parse(query):
+        if term.field in config.QUERY_FILTERS:
+            continue
+        expr = compile_text(term)
+        if not expr:
+            continue
+        if term.negated:
+            where.append('files.fileID NOT IN (SELECT docid >> {:d} FROM '
+                         'chunks WHERE chunks MATCH ?)'.format(
+                             ftcache.DOCID_BITS))
+            params.append(expr)
+        else:
+            matches.append(expr)
+
+    if not matches:
+        return None
+    sections = ["SELECT files.parent, rank(matchinfo(chunks)) AS score",
+                "FROM chunks JOIN files",
+                "ON files.fileID = chunks.docid >> {:d}".format(
+                    ftcache.DOCID_BITS),
+                "WHERE chunks MATCH ?"]
+    sections.extend('AND ' + w for w in where)
+    sections.append("ORDER BY score DESC;")
+    params.insert(0, ' '.join(matches))
+    return ' '.join(sections), tuple(params)
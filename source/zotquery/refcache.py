@@ -0,0 +1,162 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+"""Cache the references that the Zotero API formats for exports.
+
+Each reference is stored by the ``uid`` of the item (or group), the CSL
+style, the kind of export (`flag`) and the locale, along with the
+version of the item (or of each item in the group) in ZotQuery's clone
+of Zotero's database when it was formatted.
+
+References don't expire. A reference is used for as long as the
+version it was made from is current, and replaced once the item (or
+group) has changed in Zotero and the clone has been updated.
+
+"""
+from __future__ import unicode_literals
+
+# Standard Library
+from contextlib import closing
+import hashlib
+import sqlite3
+
+# Internal Dependencies
+import config
+
+# Items of a group, by kind of group (`c` or `t`)
+GROUP_ITEMS = {
+    'c': """SELECT items.key, items.version, items.clientDateModified
+            FROM items
+                JOIN collectionItems
+                    ON collectionItems.itemID = items.itemID
+                JOIN collections
+                    ON collections.collectionID = collectionItems.collectionID
+            WHERE collections.key = ?""",
+    't': """SELECT items.key, items.version, items.clientDateModified
+            FROM items
+                JOIN itemTags ON itemTags.itemID = items.itemID
+            WHERE itemTags.tagID = ?""",
+}
+
+
+# 1.  -------------------------------------------------------------------------
+def create_db(db):
+    """Create the references table.
+
+    :param db: path to `.db` file
+    :type db: :class:`unicode`
+
+    """
+    with closing(sqlite3.connect(db)) as con:
+        with con as cur:
+            cur.execute("""CREATE TABLE IF NOT EXISTS refs (
+                               uid TEXT NOT NULL,
+                               style TEXT NOT NULL,
+                               flag TEXT NOT NULL,
+                               locale TEXT NOT NULL,
+                               version TEXT NOT NULL,
+                               html TEXT NOT NULL,
+                               PRIMARY KEY (uid, style, flag, locale)
+                           ) WITHOUT ROWID""")
+
+
+# 2.  -------------------------------------------------------------------------
+def version(clone, uid):
+    """Return the version of item or group ``uid`` in the clone.
+
+    Zotero only changes an item's `version` when it syncs, so its
+    `clientDateModified` (changed by every local edit) is included.
+    A group's version covers each of its items.
+
+    :param clone: path to ZotQuery's clone of Zotero's database
+    :type clone: :class:`unicode`
+    :param uid: ``<library>_<key>`` of an item, ``c_<key>`` of a
+        collection or ``t_<tagID>`` of a tag
+    :type uid: :class:`unicode`
+    :returns: version or ``None`` if ``uid`` isn't in the clone
+    :rtype: :class:`unicode`
+
+    """
+    kind, key = uid.split('_', 1)
+    sql = GROUP_ITEMS.get(kind, """SELECT key, version, clientDateModified
+                                   FROM items
+                                   WHERE key = ?""")
+    with closing(sqlite3.connect(clone)) as con:
+        rows = sorted(con.execute(sql, (key,)))
+    if not rows:
+        return None
+    if kind not in GROUP_ITEMS:
+        return '{1}:{2}'.format(*rows[0])
+    text = '\n'.join('{}:{}:{}'.format(*row) for row in rows)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+# 3.  -------------------------------------------------------------------------
+def get(db, uid, version, style, flag, locale):
+    """Return the cached reference, if it was made from ``version``.
+
+    :param db: path to `.db` file created by :func:`create_db`
+    :type db: :class:`unicode`
+    :returns: HTML of reference or ``None``
+    :rtype: :class:`unicode`
+
+    """
+    with closing(sqlite3.connect(db)) as con:
+        row = con.execute("""SELECT html FROM refs
+                             WHERE uid = ? AND style = ? AND flag = ?
+                                 AND locale = ? AND version = ?""",
+                          (uid, style, flag, locale, version)).fetchone()
+    return row[0] if row else None
+
+
+## 3.1  -----------------------------------------------------------------------
+def missing(db, clone, uids, style, flags, locale):
+    """Return the items of ``uids`` without current cached references.
+
+    :param db: path to `.db` file created by :func:`create_db`
+    :type db: :class:`unicode`
+    :param clone: path to ZotQuery's clone of Zotero's database
+    :type clone: :class:`unicode`
+    :param uids: ``<library>_<key>`` of items (not groups)
+    :type uids: :class:`list`
+    :param flags: kinds of export that must all be cached
+    :type flags: :class:`tuple`
+    :returns: the ``uids`` that lack any reference, in order
+    :rtype: :class:`list`
+
+    """
+    keys = [uid.split('_', 1)[1] for uid in uids]
+    marks = ', '.join('?' * len(uids))
+    with closing(sqlite3.connect(clone)) as con:
+        versions = dict(
+            (key, '{}:{}'.format(version, modified))
+            for key, version, modified in con.execute(
+                """SELECT key, version, clientDateModified FROM items
+                   WHERE key IN ({})""".format(marks), keys))
+    with closing(sqlite3.connect(db)) as con:
+        cached = set(con.execute(
+            """SELECT uid, flag, version FROM refs
+               WHERE style = ? AND locale = ? AND uid IN ({})""".format(marks),
+            [style, locale] + list(uids)))
+    return [uid for uid, key in zip(uids, keys)
+            if not all((uid, flag, versions.get(key)) in cached
+                       for flag in flags)]
+
+
+# 4.  -------------------------------------------------------------------------
+def put(db, uid, version, style, flag, locale, html):
+    """Cache reference ``html``, replacing any of an older version.
+
+    :param db: path to `.db` file created by :func:`create_db`
+    :type db: :class:`unicode`
+
+    """
+    with closing(sqlite3.connect(db)) as con:
+        with con as cur:
+            cur.execute("""INSERT OR REPLACE INTO refs
+                           (uid, style, flag, locale, version, html)
+                           VALUES (?, ?, ?, ?, ?, ?)""",
+                        (uid, style, flag, locale, version, html))
+    config.log.debug('Cached %s of %s (%s)', flag, uid, style)
@@ -26,8 +26,7 @@ def generate_bibliography(key_dicts, md_text):
     keys = [x['key'] for x in key_dicts]
     print len(keys)
     #citekeys = [x['citekey'] for x in key_dicts]
-    dict = zq.web.items_bibliography(keys,
-                                     style=zq.backend.csl_style)
+    dict = export.items_bibliography(keys)
     citations, references = dict['cites'], dict['refs']
     print len(citations)
     #citations, references = '\n'.join(citations), '\n'.join(references)
@@ -8,6 +8,10 @@ from workflow.workflow import isascii
 from lib import utils
 from . import zq
 import config
+import connections
+import querylang
+import timing
+import usage
 
 
 #------------------------------------------------------------------------------
@@ -86,14 +90,16 @@ class ResultsFormatter(object):
         ```
 
     """
-    def __init__(self, item):
+    def __init__(self, item, snippet=None):
         """``item`` is a Python dictionary for an item in the JSON db
-        `zotquery.json`.
+        `zotquery.json`. ``snippet`` is a ``(column, text)`` tuple
+        showing where a search matched ``item``.
 
         """
         self.item = item
+        self.snippet = snippet
 
-    def prepare_item_feedback(self):
+    def prepare_item_feedback(self, largetext=True):
         """Format the subtitle string for ``item``
 
         """
@@ -103,10 +109,11 @@ class ResultsFormatter(object):
         alfred['valid'] = True
         alfred['arg'] = self.format_arg()
         alfred['icon'] = self.format_icon()
-        alfred['largetext'] = self.format_largetext()
+        if largetext:
+            alfred['largetext'] = self.format_largetext()
         alfred['copytext'] = self.format_quickcopy()
         if config.ALFRED_LEARN:
-            alfred['uid'] = str(self.item['id'])
+            alfred['uid'] = str(self.item['key'])
         return alfred
 
     def prepare_group_feedback(self):
@@ -140,6 +147,10 @@ class ResultsFormatter(object):
         return title_final
 
     def format_subtitle(self):
+        if self.snippet:
+            column, text = self.snippet
+            return '{}: {}'.format(column.replace('_', ' ').capitalize(),
+                                   text)
         subtitle = ' '.join([self.format_creator(),
                              self.format_date()])
         if self.item['attachments'] != []:
@@ -254,38 +265,27 @@ class ResultsFormatter(object):
 # 1.  -------------------------------------------------------------------------
 def search_for_items(scope, query):
     # Generate appropriate sqlite query
-    sqlite_query = make_item_sqlite_query(scope, query)
+    with timing.span('query'):
+        sqlite_query = make_item_sqlite_query(scope, query)
+    if sqlite_query is None:
+        return []
     config.log.info('Item sqlite query : %s', sqlite_query)
     # Run sqlite query and get back item keys
-    item_keys = run_item_sqlite_query(sqlite_query)
-    # Get JSON data of user's Zotero library
-    cache = zq.backend.cache
-
-    results = []
-    for key in item_keys:
-        item = cache.get(key, None)
-        if item:
-            # Prepare dictionary for Alfred
-            formatter = ResultsFormatter(item)
-            results.append(formatter.prepare_item_feedback())
-
-    return results
+    db = get_fts_db(query)
+    item_keys = run_item_sqlite_query(db, *sqlite_query)
+    # Show where the top results matched
+    snippets = get_snippets(db, query, get_item_columns(scope),
+                            item_keys[:config.SNIPPET_RESULTS])
+    return format_item_results(item_keys, snippets)
 
 
 ## 1.1  -----------------------------------------------------------------------
 def make_item_sqlite_query(scope, query):
-    fuzzy_query = make_item_fuzzy(query)
     columns = get_item_columns(scope)
-    query = make_disjunctive_item_query(fuzzy_query, columns)
-    return get_item_sql().format(query)
+    return querylang.compile_query(query, columns)
 
 
 ### 1.1.1  --------------------------------------------------------------------
-def make_item_fuzzy(query):
-    return query + '*'
-
-
-### 1.1.2  --------------------------------------------------------------------
 def get_item_columns(scope):
     if scope in config.FILTERS.keys():
         return [s for s in config.FILTERS.get(scope, []) if s != 'key']
@@ -293,39 +293,27 @@ def get_item_columns(scope):
         raise ValueError('Invalid search scope : `{}`'.format(scope))
 
 
-### 1.1.3  --------------------------------------------------------------------
-def make_disjunctive_item_query(query, columns):
-    # Format `column:query`
-    bits = ['{}:{}'.format(col, query) for col in columns]
-    # Make a disjunctive query
-    return ' OR '.join(bits)
-
-
-### 1.1.4; 3.2.2.1  -----------------------------------------------------------
-def get_item_sql():
-    sections = ("SELECT key, rank(matchinfo(zotquery)) AS score",
-                "FROM zotquery",
-                "WHERE zotquery MATCH '{}'",
-                "ORDER BY score DESC;")
-    sql_str = ' '.join(sections)
-    return sql_str.strip()
-
-
 ## 1.2  -----------------------------------------------------------------------
-def run_item_sqlite_query(query):
-    db = get_fts_db(query)
+def run_item_sqlite_query(db, query, params=()):
     config.log.info('Connecting to : `%s`', db.split('/')[-1])
-
-    def ranker(con):
-        ranks = [1.0] * len(config.FILTERS['general'])
-        con.create_function('rank', 1, zq.backend.make_rank_func(ranks))
-
-    results = execute_sql(db, query, context=ranker).fetchall()
+    with timing.span('sql'):
+        results = execute_sql(db, query, params, context=init_item_ranking,
+                              role='rank').fetchall()
     config.log.info('Number of results : %d', len(results))
     # Omit rankings from the returned list
     return [x[0] for x in results]
 
 
+### 1.2.2  --------------------------------------------------------------------
+def init_item_ranking(con):
+    # Set up (once) connection to search database for ranked queries
+    ranks = [1.0] * len(config.FILTERS['general'])
+    con.create_function('rank', 1, zq.backend.make_rank_func(ranks))
+    # Usage counts are blended into the ranking
+    con.create_function('frecency', 3, usage.factor)
+    con.execute('ATTACH DATABASE ? AS usage', (zq.backend.usage_sqlite,))
+
+
 ### 1.2.1  --------------------------------------------------------------------
 def get_fts_db(query):
     # Search against either Unicode or ASCII database
@@ -340,6 +328,47 @@ def get_fts_db(query):
 #     item = data.get(key, None)
 
 
+## 1.4  -----------------------------------------------------------------------
+def get_snippets(db, query, columns, keys):
+    # Snippets are only made for the (top) results in `keys`
+    sqlite_query = querylang.compile_snippet_query(query, columns, keys)
+    if sqlite_query is None:
+        return {}
+    general = config.FILTERS['general']
+    snippets = {}
+    with timing.span('snippets'):
+        rows = execute_sql(db, *sqlite_query, context=init_item_ranking,
+                           role='rank').fetchall()
+    for row in rows:
+        key, offsets = row[:2]
+        # `offsets()` is a list of (column, term, offset, size) numbers
+        matched = set(int(i) for i in offsets.split()[::4])
+        for i, column in enumerate(config.SNIPPET_COLUMNS):
+            if general.index(column) in matched:
+                snippets[key] = (column, row[2 + i])
+                break
+    return snippets
+
+
+## 1.5; 3.3; 4.3  -------------------------------------------------------------
+def format_item_results(item_keys, snippets=None):
+    # Get JSON data of user's Zotero library
+    with timing.span('hydrate'):
+        cache = zq.backend.cache
+        items = [cache.get(key, None) for key in item_keys]
+    snippets = snippets or {}
+    results = []
+    with timing.span('format'):
+        for i, item in enumerate(items):
+            if item:
+                # Prepare dictionary for Alfred. Only the top results
+                # carry large text, which may be a long abstract or notes
+                formatter = ResultsFormatter(item, snippets.get(item['key']))
+                results.append(formatter.prepare_item_feedback(
+                    largetext=i < config.SNIPPET_RESULTS))
+    return results
+
+
 #------------------------------------------------------------------------------
 #  Functions to search *for* groups
 #------------------------------------------------------------------------------
@@ -347,18 +376,21 @@ def get_fts_db(query):
 # 2.  -------------------------------------------------------------------------
 def search_for_groups(scope, query):
     # Generate appropriate sqlite query
-    sqlite_query = make_group_sqlite_query(scope, query)
+    with timing.span('query'):
+        sqlite_query = make_group_sqlite_query(scope, query)
     config.log.info('Item sqlite query : {}'.format(sqlite_query))
     # Run sqlite query and get back item keys
-    coll_data = run_group_sqlite_query(sqlite_query)
-    coll_dicts = [{'flag': scope, 'name': coll[0], 'key': coll[1]}
+    with timing.span('sql'):
+        coll_data = run_group_sqlite_query(sqlite_query)
+    coll_dicts = [{'flag': scope, 'name': coll[0], 'key': unicode(coll[1])}
                   for coll in coll_data]
     results_dict = []
-    for coll in coll_dicts:
-        # Prepare dictionary for Alfred
-        formatter = ResultsFormatter(coll)
-        alfred_dict = formatter.prepare_group_feedback()
-        results_dict.append(alfred_dict)
+    with timing.span('format'):
+        for coll in coll_dicts:
+            # Prepare dictionary for Alfred
+            formatter = ResultsFormatter(coll)
+            alfred_dict = formatter.prepare_group_feedback()
+            results_dict.append(alfred_dict)
     return results_dict
 
 
@@ -367,6 +399,7 @@ def make_group_sqlite_query(scope, query):
     fuzzy_query = make_group_fuzzy(query)
     column = get_group_column(scope)
     return get_group_sql().format(col=column,
+                                  key=get_group_key_column(scope),
                                   table=scope,
                                   query=fuzzy_query)
 
@@ -387,8 +420,16 @@ def get_group_column(scope):
 
 
 ### 2.1.3  --------------------------------------------------------------------
+def get_group_key_column(scope):
+    # Tags are identified by their ID (they have no key in Zotero 5)
+    if scope == 'tags':
+        return 'tagID'
+    return 'key'
+
+
+### 2.1.4  --------------------------------------------------------------------
 def get_group_sql():
-    sections = ("SELECT {col}, key",
+    sections = ("SELECT {col}, {key}",
                 "FROM {table}",
                 "WHERE {col} LIKE '{query}'")
     sql_str = ' '.join(sections)
@@ -411,26 +452,22 @@ def run_group_sqlite_query(query):
 # 3.  -------------------------------------------------------------------------
 def search_within_group(scope, query):
     config.log.debug('scope=%r, query=%r', scope, query)
-    group_type = scope.split('-')[-1]
+    group_type = scope.split('-')[1]
     # Read saved group info
     path = config.WF.cachefile('{}_query_result.txt'.format(group_type))
-    group_id = utils.read_path(path)
-    group_name = get_group_name(group_id)
-    sqlite_query = make_in_group_sqlite_query(scope, query, group_name)
+    group_id = utils.read_path(path).strip()
+    # A collection's items include those of its sub-collections
+    recursive = group_type == 'collection'
+    with timing.span('query'):
+        sqlite_query = make_in_group_sqlite_query(query, group_id, recursive)
     config.log.info('Item sqlite query : {}'.format(sqlite_query))
     # Run sqlite query and get back item keys
-    item_keys = run_item_sqlite_query(sqlite_query)
-    # Get JSON data of user's Zotero library
-    cache = zq.backend.cache
-    results = []
-    for key in item_keys:
-        item = cache.get(key, None)
-        if item:
-            # Prepare dictionary for Alfred
-            formatter = ResultsFormatter(item)
-            alfred_dict = formatter.prepare_item_feedback()
-            results.append(alfred_dict)
-    return results
+    db = get_fts_db(query)
+    item_keys = run_item_sqlite_query(db, *sqlite_query)
+    # Show where the top results matched
+    snippets = get_snippets(db, query, get_item_columns('general'),
+                            item_keys[:config.SNIPPET_RESULTS])
+    return format_item_results(item_keys, snippets)
 
 
 ## 3.1  -----------------------------------------------------------------------
@@ -447,76 +484,154 @@ def get_group_name(group_arg):
 
 ### 3.1.1  --------------------------------------------------------------------
 def get_collection_name(uid):
-    """Get name of tag from `key`"""
+    """Get name of collection from `key`"""
     db = zq.backend.cloned_sqlite
     config.log.info('Connecting to : `{}`'.format(db.split('/')[-1]))
     sql_query = """SELECT collectionName
                    FROM collections
-                   WHERE key = "{}" """.format(uid)
-    col_name = execute_sql(db, sql_query).fetchone()
+                   WHERE key = ?"""
+    col_name = execute_sql(db, sql_query, (uid,)).fetchone()
     return col_name[0]
 
 
 ### 3.1.2  --------------------------------------------------------------------
+def get_group_keys(group_arg):
+    """Get keys of the items in group ``c_<key>`` or ``t_<tagID>``"""
+    db = zq.backend.fts_sqlite
+    sql_query = """SELECT metadata.key
+                   FROM group_members
+                       JOIN metadata
+                           ON metadata.docid = group_members.docid
+                   WHERE group_members.group_id = ?"""
+    return [row[0] for row in execute_sql(db, sql_query, (group_arg,))]
+
+
+### 3.1.3  --------------------------------------------------------------------
 def get_tag_name(uid):
+    """Get name of tag from `tagID`"""
     db = zq.backend.cloned_sqlite
     config.log.info('Connecting to : `{}`'.format(db.split('/')[-1]))
     sql_query = """SELECT name
                    FROM tags
-                   WHERE key = "{}" """.format(uid)
-    tag_name = execute_sql(db, sql_query).fetchone()
+                   WHERE tagID = ?"""
+    tag_name = execute_sql(db, sql_query, (uid,)).fetchone()
     return tag_name[0]
 
 
 #### 3.1.1.1; 2.2.1; 1.2.1  ---------------------------------------------------
-def execute_sql(db, sql, context=None):
+def execute_sql(db, sql, params=(), context=None, role='read'):
     """Execute sqlite query and return sqlite object.
 
+    The (read-only) connection to ``db`` is shared by all queries for
+    the same ``role`` in this process.
+
     :param sql: SQL or SQLITE query string
     :type sql: :class:`unicode`
+    :param params: values for the query's placeholders
+    :type params: :class:`tuple`
+    :param context: function to set up a new connection for ``role``
+    :type context: ``callable``
+    :param role: name of connection's set-up (see :mod:`connections`)
+    :type role: :class:`unicode`
     :returns: SQLITE object of executed query
     :rtype: :class:`object`
 
     """
-    con = sqlite3.connect(db)
-    with con:
-        cur = con.cursor()
-        if context:
-            context(con)
-        try:
-            return cur.execute(sql)
-        except sqlite3.OperationalError as err:
-            # If the query is invalid,
-            # show an appropriate warning and exit
-            if b'malformed MATCH' in err.message:
-                config.WF.add_item('Invalid query')
-                config.WF.send_feedback()
-                return 1
-            # Otherwise raise error for Workflow to catch and log
-            else:
-                raise err
+    con = connections.get(db, role, context)
+    try:
+        return con.execute(sql, params)
+    except sqlite3.OperationalError as err:
+        # If the query is invalid,
+        # show an appropriate warning and exit
+        if b'malformed MATCH' in err.message:
+            config.WF.add_item('Invalid query')
+            config.WF.send_feedback()
+            return 1
+        # Otherwise raise error for Workflow to catch and log
+        else:
+            raise err
 
 
 ## 3.2  -----------------------------------------------------------------------
-def make_in_group_sqlite_query(scope, query, group):
-    fuzzy_query = make_item_fuzzy(query)
-    column = get_in_group_column(scope)
-    query = make_conjunctive_item_query(fuzzy_query, column, group)
-    return get_item_sql().format(query)
+def make_in_group_sqlite_query(query, group_id, recursive=False):
+    # Restrict results to the group's (indexed) member set.
+    # An empty query lists the members without any MATCH.
+    members = 'metadata.docid IN ({})'.format(get_members_sql(recursive))
+    columns = get_item_columns('general')
+    return querylang.compile_query(query, columns,
+                                   conditions=[(members, (group_id,))])
 
 
 ### 3.2.1  --------------------------------------------------------------------
-def get_in_group_column(scope):
-    return scope.split('-')[-1] + 's'
+def get_members_sql(recursive=False):
+    # Sub-collections are resolved through the precomputed closure table
+    if recursive:
+        sections = ("SELECT group_members.docid FROM collection_tree",
+                    "JOIN group_members",
+                    "ON group_members.group_id = collection_tree.descendant",
+                    "WHERE collection_tree.ancestor = ?")
+    else:
+        sections = ("SELECT docid FROM group_members",
+                    "WHERE group_id = ?")
+    return ' '.join(sections)
+
+
+#------------------------------------------------------------------------------
+#  Functions to search the contents of attachments
+#------------------------------------------------------------------------------
+
+# 4.  -------------------------------------------------------------------------
+def search_fulltext(query):
+    # Generate appropriate sqlite query
+    with timing.span('query'):
+        sqlite_query = querylang.compile_fulltext_query(query)
+    if sqlite_query is None:
+        return []
+    config.log.info('Full-text sqlite query : %s', sqlite_query)
+    # Run sqlite query and get back item keys
+    item_keys = run_fulltext_sqlite_query(*sqlite_query)
+    # Add matches from the text of `.zotero-ft-cache` files
+    ftcache_query = querylang.compile_ftcache_query(query)
+    if ftcache_query:
+        config.log.info('ft-cache sqlite query : %s', ftcache_query)
+        found = set(item_keys)
+        item_keys.extend(k for k in run_ftcache_sqlite_query(*ftcache_query)
+                         if k not in found)
+    return format_item_results(item_keys)
+
+
+## 4.1  -----------------------------------------------------------------------
+def run_fulltext_sqlite_query(query, params=()):
+    db = zq.backend.fulltext_sqlite
+    config.log.info('Connecting to : `%s`', db.split('/')[-1])
+    with timing.span('sql'):
+        results = execute_sql(db, query, params).fetchall()
+    config.log.info('Number of results : %d', len(results))
+    # Omit rankings from the returned list
+    return [x[0] for x in results]
 
 
-### 3.2.2  --------------------------------------------------------------------
-def make_conjunctive_item_query(query, column, group):
-    # Prepare in-column search (remove error causing `'`)
-    specifier = ':'.join([column, group.replace("'", "")])
-    # Make conjunctive query
-    query = ' AND '.join([query, specifier])
-    return query
+## 4.2  -----------------------------------------------------------------------
+def run_ftcache_sqlite_query(query, params=()):
+    db = zq.backend.ftcache_sqlite
+    if not db:
+        return []
+    config.log.info('Connecting to : `%s`', db.split('/')[-1])
+
+    def ranker(con):
+        con.create_function('rank', 1, zq.backend.make_rank_func([1.0]))
+
+    with timing.span('sql'):
+        results = execute_sql(db, query, params, context=ranker,
+                              role='rank').fetchall()
+    config.log.info('Number of results : %d', len(results))
+    # Omit rankings and all but the best chunk of each item
+    keys, seen = [], set()
+    for key, _ in results:
+        if key not in seen:
+            seen.add(key)
+            keys.append(key)
+    return keys
 
 
 #------------------------------------------------------------------------------
@@ -535,6 +650,9 @@ def search(scope, query, wf):
     # Search for individual items in an individual group
     elif scope in config.SCOPE_TYPES['in-groups']:
         found_items = search_within_group(scope, query)
+    # Search the contents of attachments
+    elif scope in config.SCOPE_TYPES['fulltext']:
+        found_items = search_fulltext(query)
     # Search for certain debugging options
     elif scope in config.SCOPE_TYPES['meta']:
         if scope == 'debug':
@@ -546,5 +664,14 @@ def search(scope, query, wf):
     else:
         raise Exception('Unknown search flag: `{}`'.format(scope))
 
-    [wf.add_item(**item) for item in found_items]
-    wf.send_feedback()
+    with timing.span('feedback'):
+        [wf.add_item(**item) for item in found_items]
+        wf.send_feedback()
+
+    # The user will likely export one of the top results
+    if scope in config.SCOPE_TYPES['items'] and config.PREFETCH_RESULTS:
+        with timing.span('prefetch'):
+            # imported here, as prefetching is off by default
+            import prefetch
+            prefetch.queue(wf, zq.backend.csl_style,
+                           [item['arg'] for item in found_items])
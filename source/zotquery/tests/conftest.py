@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""Fixtures shared by the unit tests."""
+
+from __future__ import print_function, absolute_import
+
+import os
+import sys
+
+import pytest
+
+SOURCE = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(SOURCE, 'bench'))
+
+import searchbench  # noqa: E402
+import synthlib  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def library(tmpdir_factory):
+    """Synthetic Zotero library (with `.zotero-ft-cache` files).
+
+    Returns the root directory and path to `zotero.sqlite`.
+
+    """
+    root = str(tmpdir_factory.mktemp('library'))
+    path = synthlib.generate(os.path.join(root, 'zotero'), 200, seed=2,
+                             storage=True)
+    return root, path
+
+
+@pytest.fixture()
+def backend(library, monkeypatch):
+    """Backend with fresh workflow data for :func:`library`.
+
+    It is also `zq.backend`, and `config.WF` is its workflow.
+
+    """
+    from workflow import Workflow
+    from zotquery import backend, config, connections, zq
+
+    root, path = library
+    for name, value in searchbench.make_env(root).items():
+        if name.startswith('alfred_'):
+            monkeypatch.setenv(name, str(value))
+    searchbench.prepare(root, path, os.path.join(os.path.dirname(path),
+                                                 'storage'))
+    wf = Workflow()
+    zotquery = backend.data(wf)
+    monkeypatch.setattr(config, 'WF', wf)
+    monkeypatch.setattr(zq, '_backend', zotquery)
+    yield zotquery
+    # The next test's databases have the same paths
+    connections.close()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""Unit tests for connections.py."""
+
+from __future__ import print_function, absolute_import, unicode_literals
+
+from contextlib import closing
+import sqlite3
+
+import pytest
+
+from zotquery import connections
+
+
+@pytest.fixture()
+def db(tmpdir):
+    """Database with one table, and no open connections."""
+    path = str(tmpdir.join('test.sqlite3'))
+    with closing(sqlite3.connect(path)) as con:
+        with con as cur:
+            cur.execute('CREATE TABLE t (x)')
+    yield path
+    connections.close()
+
+
+def test_reuse(db, tmpdir):
+    """There is one connection per database and role."""
+    calls = []
+    con = connections.get(db, 'rank', init=calls.append)
+    assert connections.get(db, 'rank', init=calls.append) is con
+    assert calls == [con]
+
+    other = connections.get(db)
+    assert other is not con
+    assert connections.get(db, 'read') is other
+
+    path = str(tmpdir.join('other.sqlite3'))
+    sqlite3.connect(path).close()
+    assert connections.get(path, 'rank') is not con
+
+
+def test_readonly(db):
+    """Only `write` connections can change the database."""
+    with pytest.raises(sqlite3.OperationalError):
+        connections.get(db).execute('INSERT INTO t VALUES (1)')
+    with connections.get(db, 'write') as con:
+        con.execute('INSERT INTO t VALUES (1)')
+    assert connections.get(db).execute('SELECT x FROM t').fetchall() == \
+        [(1,)]
+
+
+def test_close(db, tmpdir):
+    """Closed connections are opened again when next requested."""
+    path = str(tmpdir.join('other.sqlite3'))
+    sqlite3.connect(path).close()
+    con = connections.get(db)
+    other = connections.get(path)
+
+    connections.close(db)
+    with pytest.raises(sqlite3.ProgrammingError):
+        con.execute('SELECT 1')
+    assert connections.get(path) is other
+    assert connections.get(db) is not con
+
+    connections.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        other.execute('SELECT 1')
+
+
+if __name__ == '__main__':  # pragma: no cover
+    pytest.main([__file__])
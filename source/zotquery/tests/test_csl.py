@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""Unit tests for csl.py."""
+
+from __future__ import print_function, absolute_import, unicode_literals
+
+import re
+
+import pytest
+
+from zotquery import csl
+
+ARTICLE = {
+    'key': 'C3KEUQJW',
+    'type': 'journalArticle',
+    'creators': [
+        {'index': 1, 'given': 'Jane', 'type': 'author', 'family': 'Doe'},
+        {'index': 0, 'given': 'Stephen', 'type': 'author',
+         'family': 'Margheim'},
+    ],
+    'data': {'volume': '1', 'issue': '2', 'pages': '1-14',
+             'publicationTitle': 'A Sample Publication', 'date': '2013',
+             'title': 'The Test Item'},
+}
+
+CHAPTER = {
+    'key': 'ABCD1234',
+    'type': 'bookSection',
+    'creators': [
+        {'index': 0, 'given': 'Ann', 'type': 'author', 'family': 'Smith'},
+        {'index': 1, 'given': 'Bob', 'type': 'editor', 'family': 'Jones'},
+    ],
+    'data': {'title': 'A Chapter', 'bookTitle': 'The Book',
+             'publisher': 'Penguin', 'place': 'London', 'date': '2001',
+             'pages': '10-20'},
+}
+
+EXPECTED = {
+    'chicago-author-date': (
+        '(Margheim and Doe 2013)',
+        'Margheim, Stephen, and Jane Doe. 2013. “The Test Item.” '
+        '<i>A Sample Publication</i> 1 (2): 1–14.',
+        'Smith, Ann. 2001. “A Chapter.” In <i>The Book</i>, edited by '
+        'Bob Jones, 10–20. London: Penguin.'),
+    'apa': (
+        '(Margheim &amp; Doe, 2013)',
+        'Margheim, S., &amp; Doe, J. (2013). The Test Item. '
+        '<i>A Sample Publication</i>, <i>1</i>(2), 1–14.',
+        'Smith, A. (2001). A Chapter. In B. Jones (Ed.), <i>The Book</i> '
+        '(pp. 10–20). Penguin.'),
+    'modern-language-association': (
+        '(Margheim and Doe)',
+        'Margheim, Stephen, and Jane Doe. “The Test Item.” '
+        '<i>A Sample Publication</i>, vol. 1, no. 2, 2013, pp. 1–14.',
+        'Smith, Ann. “A Chapter.” <i>The Book</i>, edited by Bob Jones, '
+        'Penguin, 2001, pp. 10–20.'),
+}
+
+
+def entry(html):
+    return re.search(r'<div class="csl-entry">(.*?)</div>', html,
+                     re.DOTALL).group(1)
+
+
+@pytest.mark.parametrize('style', sorted(EXPECTED))
+def test_styles(style):
+    """Citations and references follow the style."""
+    cite, article, chapter = EXPECTED[style]
+    assert csl.citation(ARTICLE, style) == '<span>{}</span>'.format(cite)
+    assert entry(csl.reference(ARTICLE, style)) == article
+    assert entry(csl.reference(CHAPTER, style)) == chapter
+
+
+def test_bibtex():
+    """BibTeX entries have a citekey and the item's fields."""
+    assert csl.citation(ARTICLE, 'bibtex') == \
+        '<span>margheim_test_2013</span>'
+    bib = entry(csl.reference(ARTICLE, 'bibtex'))
+    assert bib.startswith('@article{margheim_test_2013,\n')
+    assert '\tauthor = {Margheim, Stephen and Doe, Jane},\n' in bib
+    assert '\tpages = {1--14},\n' in bib
+
+
+def test_supports():
+    """The scannable cite styles are left to the web API."""
+    assert csl.supports('apa')
+    assert not csl.supports('rtf-scan')
+
+
+if __name__ == '__main__':  # pragma: no cover
+    pytest.main([__file__])
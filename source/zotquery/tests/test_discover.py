@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""Unit tests for discover.py in a temporary home directory."""
+
+from __future__ import print_function, absolute_import
+
+import os
+
+import pytest
+
+from zotquery import config, discover
+
+
+@pytest.fixture()
+def home(tmpdir, monkeypatch):
+    """Empty home directory of a Linux user, and a workflow cache."""
+    from workflow import Workflow
+    home = tmpdir.mkdir('home')
+    monkeypatch.setenv('HOME', str(home))
+    monkeypatch.setenv('alfred_workflow_cache', str(tmpdir.join('cache')))
+    monkeypatch.setenv('alfred_workflow_data', str(tmpdir.join('data')))
+    monkeypatch.setattr(config, 'WF', Workflow())
+    monkeypatch.setattr(discover.sys, 'platform', 'linux2')
+    monkeypatch.setattr(discover, '_prefs', {})
+    return home
+
+
+def write_prefs(home, **prefs):
+    """Write Zotero 5 `prefs.js` with ``prefs``; return its path."""
+    lines = ['// Mozilla User Preferences']
+    for name, value in sorted(prefs.items()):
+        lines.append('user_pref("extensions.zotero.{}", {});'.format(
+            name, '"{}"'.format(value) if isinstance(value, str)
+            else str(value).lower()))
+    path = home.ensure('.zotero', 'zotero', 'abcd1234.default', 'prefs.js')
+    path.write('\n'.join(lines) + '\n')
+    return str(path)
+
+
+def test_default(home):
+    """The database is in `~/Zotero` by default."""
+    write_prefs(home, lastViewedFolder='L1')
+    expected = str(home.ensure('Zotero', 'zotero.sqlite'))
+    assert discover.prefs() == {'lastViewedFolder': 'L1'}
+    assert discover.sqlite() == expected
+
+
+def test_data_dir(home, tmpdir):
+    """The `dataDir` preference overrides the default location."""
+    home.ensure('Zotero', 'zotero.sqlite')
+    elsewhere = tmpdir.mkdir('elsewhere')
+    expected = str(elsewhere.ensure('zotero.sqlite'))
+    write_prefs(home, dataDir=str(elsewhere), useDataDir=True)
+    assert discover.prefs()['dataDir'] == str(elsewhere)
+    assert discover.sqlite() == expected
+
+
+def test_data_dir_unused(home, tmpdir):
+    """`dataDir` is ignored if `useDataDir` is off."""
+    expected = str(home.ensure('Zotero', 'zotero.sqlite'))
+    elsewhere = tmpdir.mkdir('elsewhere')
+    elsewhere.ensure('zotero.sqlite')
+    write_prefs(home, dataDir=str(elsewhere), useDataDir=False)
+    assert discover.sqlite() == expected
+
+
+def test_cached(home):
+    """Found paths are used until they no longer exist."""
+    default = home.ensure('Zotero', 'zotero.sqlite')
+    assert discover.sqlite() == str(default)
+
+    prefs = write_prefs(home, dataDir=str(home.join('Other')))
+    other = home.ensure('Other', 'zotero.sqlite')
+    assert discover.sqlite() == str(default)
+    default.remove()
+    assert discover.sqlite() == str(other)
+    assert discover.prefs() == discover.read_prefs(prefs)
+
+
+def test_scan(home, monkeypatch):
+    """The home directory is scanned only if the file isn't found."""
+    assert discover.sqlite() is None
+    expected = str(home.ensure('Documents', 'Research', 'zotero.sqlite'))
+    home.ensure('.cache', 'zotero.sqlite')
+    # Not scanned again for a while
+    assert discover.sqlite() is None
+    monkeypatch.setattr(discover, 'SCAN_INTERVAL', 0)
+    assert discover.sqlite() == expected
+
+
+if __name__ == '__main__':  # pragma: no cover
+    pytest.main([__file__])
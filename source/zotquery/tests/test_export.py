@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""Unit tests for export.py against a synthetic library."""
+
+from __future__ import print_function, absolute_import
+
+import pytest
+
+from zotquery import config, export, search, webclient
+
+
+@pytest.fixture()
+def local(backend, monkeypatch):
+    """Backend with a style that is formatted locally."""
+    monkeypatch.setattr(config, 'LOCAL_CSL', True)
+    monkeypatch.setitem(backend.properties, 'csl_style',
+                        'chicago-author-date')
+    backend.update_cache()
+    return backend
+
+
+def group_uid(backend):
+    """UID of a collection with items."""
+    rows = search.execute_sql(backend.fts_sqlite, """
+        SELECT group_id FROM group_members
+        WHERE group_id LIKE 'c\\_%' ESCAPE '\\' LIMIT 1""").fetchall()
+    return rows[0][0]
+
+
+def test_local(local):
+    """Items and groups in supported styles are formatted locally."""
+    uid = group_uid(local)
+    html = export.export_local('group', uid)
+    assert html.startswith('WORKS CITED\n\n')
+    assert html.count('\n\n') == len(search.get_group_keys(uid))
+    key = search.get_group_keys(uid)[0]
+    assert export.export_local('bib', '1_' + key) in html
+
+
+def test_not_local(local, monkeypatch):
+    """Otherwise the web API formats them."""
+    uid = group_uid(local)
+    # Empty groups
+    assert export.export_local('group', 'c_NOSUCHKEY') is None
+    monkeypatch.setitem(local.properties, 'csl_style', 'rtf-scan')
+    assert export.export_local('group', uid) is None
+    monkeypatch.setattr(config, 'LOCAL_CSL', False)
+    monkeypatch.setitem(local.properties, 'csl_style',
+                        'chicago-author-date')
+    assert export.export_local('group', uid) is None
+
+
+def test_fallback(local, monkeypatch):
+    """Supported styles are formatted locally when the API fails."""
+    monkeypatch.setattr(config, 'LOCAL_CSL', False)
+    monkeypatch.setattr(config, 'CACHE_REFERENCES', False)
+
+    def fail(*args, **kwargs):
+        res = webclient.Response('https://api.zotero.org/', 503, {}, b'')
+        raise webclient.HTTPError(res)
+
+    class Web(object):
+        item = collection_references = items_bibliography = \
+            staticmethod(fail)
+
+    monkeypatch.setattr(export.zq, '_web', Web())
+    uid = group_uid(local)
+    key = search.get_group_keys(uid)[0]
+    monkeypatch.setattr(config, 'LOCAL_CSL', True)
+    expected = export.export_local('group', uid)
+    monkeypatch.setattr(config, 'LOCAL_CSL', False)
+    assert export.get_export_html('group', uid, None) == expected
+    bib = export.items_bibliography([key])
+    assert bib['refs'][0] in expected
+    # Nor can other styles be, so the error is raised
+    monkeypatch.setitem(local.properties, 'csl_style', 'rtf-scan')
+    with pytest.raises(webclient.HTTPError):
+        export.get_export_html('bib', '1_' + key, None)
+    with pytest.raises(webclient.HTTPError):
+        export.items_bibliography([key])
+
+
+if __name__ == '__main__':  # pragma: no cover
+    pytest.main([__file__])
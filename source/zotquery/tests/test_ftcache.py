@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""Unit tests for ftcache.py."""
+
+from __future__ import print_function, absolute_import, unicode_literals
+
+from contextlib import closing
+import os
+import sqlite3
+
+import pytest
+
+from zotquery import ftcache
+
+# Texts of the attachments' `.zotero-ft-cache` files
+TEXTS = {
+    'ATT1': 'alpha beta gamma',
+    # Longer than a chunk
+    'ATT2': ' '.join('word{:03d}'.format(i) for i in range(40)) + ' omega',
+    'ATT3': 'delta epsilon',
+}
+
+
+@pytest.fixture()
+def library(tmpdir, monkeypatch):
+    """Clone of a library with three attachments, and their storage."""
+    monkeypatch.setattr(ftcache, 'CHUNK_SIZE', 64)
+    clone = str(tmpdir.join('zotero.sqlite'))
+    with closing(sqlite3.connect(clone)) as con:
+        with con as cur:
+            cur.executescript("""
+                CREATE TABLE items (itemID INTEGER PRIMARY KEY, key TEXT);
+                CREATE TABLE itemAttachments (itemID INTEGER PRIMARY KEY,
+                                              parentItemID INT);
+                INSERT INTO items VALUES (1, 'PARENT1');
+                INSERT INTO items VALUES (2, 'PARENT2');
+                INSERT INTO items VALUES (11, 'ATT1');
+                INSERT INTO items VALUES (12, 'ATT2');
+                INSERT INTO items VALUES (13, 'ATT3');
+                INSERT INTO itemAttachments VALUES (11, 1);
+                INSERT INTO itemAttachments VALUES (12, 1);
+                INSERT INTO itemAttachments VALUES (13, 2);
+            """)
+    storage = tmpdir.mkdir('storage')
+    for key, text in TEXTS.items():
+        storage.mkdir(key).join(ftcache.FILENAME).write(text)
+    db = str(tmpdir.join('ftcache.sqlite3'))
+    ftcache.create_db(db)
+    return db, clone, str(storage)
+
+
+def files(db):
+    with closing(sqlite3.connect(db)) as con:
+        return dict((r[0], r[1:]) for r in con.execute(
+            'SELECT attachment, fileID, parent FROM files'))
+
+
+def chunks(db, attachment):
+    """Texts of the chunks of ``attachment``'s file, in order."""
+    with closing(sqlite3.connect(db)) as con:
+        rows = con.execute("""
+            SELECT chunks.docid, chunks.text
+            FROM chunks JOIN files ON files.fileID = chunks.docid >> ?
+            WHERE files.attachment = ? ORDER BY chunks.docid""",
+                           (ftcache.DOCID_BITS, attachment)).fetchall()
+    return [text for _, text in rows]
+
+
+def match(db, query):
+    with closing(sqlite3.connect(db)) as con:
+        return sorted(set(r[0] for r in con.execute("""
+            SELECT files.parent
+            FROM chunks JOIN files ON files.fileID = chunks.docid >> ?
+            WHERE chunks MATCH ?""", (ftcache.DOCID_BITS, query))))
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_update(library, workers):
+    """Files are indexed in chunks that don't split words."""
+    db, clone, storage = library
+    ftcache.update(db, clone, storage, workers)
+    assert set(files(db)) == set(TEXTS)
+    assert chunks(db, 'ATT1') == [TEXTS['ATT1']]
+    parts = chunks(db, 'ATT2')
+    assert len(parts) > 1
+    assert ''.join(parts) == TEXTS['ATT2']
+    assert match(db, 'word039') == ['PARENT1']
+    assert match(db, 'omega') == ['PARENT1']
+    assert match(db, 'delta') == ['PARENT2']
+
+
+def test_changes(library):
+    """Only changed files are re-indexed; removed ones are dropped."""
+    db, clone, storage = library
+    ftcache.update(db, clone, storage)
+
+    path = os.path.join(storage, 'ATT1', ftcache.FILENAME)
+    with open(path, 'wb') as fp:
+        fp.write(b'alpha zeta')
+    os.unlink(os.path.join(storage, 'ATT2', ftcache.FILENAME))
+    with closing(sqlite3.connect(clone)) as con:
+        with con as cur:
+            cur.execute('DELETE FROM itemAttachments WHERE itemID = 13')
+    ftcache.update(db, clone, storage)
+
+    after = files(db)
+    assert set(after) == set(['ATT1'])
+    assert chunks(db, 'ATT1') == ['alpha zeta']
+    assert match(db, 'beta OR omega OR delta') == []
+
+    # Unchanged files are kept as they are
+    ftcache.update(db, clone, storage)
+    assert files(db) == after
+
+
+def test_interrupted(library):
+    """Files whose chunks weren't all written are indexed again."""
+    db, clone, storage = library
+    ftcache.update(db, clone, storage)
+    with closing(sqlite3.connect(db)) as con:
+        with con as cur:
+            cur.execute("""UPDATE files SET size = NULL, mtime = NULL
+                           WHERE attachment = 'ATT2'""")
+    ftcache.update(db, clone, storage)
+    assert ''.join(chunks(db, 'ATT2')) == TEXTS['ATT2']
+
+
+@pytest.mark.parametrize('pos,expected', [
+    (0, 0), (-1, 0), (1, 2), (2, 6), (5, 6), (6, 7), (8, 7),
+])
+def test_word_boundary(pos, expected):
+    """Chunks start after whitespace."""
+    assert ftcache.word_boundary(b'a bcd e', pos) == expected
+
+
+if __name__ == '__main__':  # pragma: no cover
+    pytest.main([__file__])
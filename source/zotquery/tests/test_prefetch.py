@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""Unit tests for prefetch.py, without background processes."""
+
+from __future__ import print_function, absolute_import
+
+import httplib
+import socket
+
+import pytest
+
+from zotquery import config, export, prefetch
+
+STYLE = 'rtf-scan'
+
+
+class Backend(object):
+    """Backend without databases."""
+    refcache_sqlite = cloned_sqlite = None
+
+
+@pytest.fixture()
+def wf(tmpdir, monkeypatch):
+    """Workflow whose background jobs are recorded, not started."""
+    from workflow import Workflow
+    monkeypatch.setenv('alfred_workflow_cache', str(tmpdir.join('cache')))
+    monkeypatch.setenv('alfred_workflow_data', str(tmpdir.join('data')))
+    monkeypatch.setattr(config, 'CACHE_REFERENCES', True)
+    monkeypatch.setattr(config, 'PREFETCH_RESULTS', 2)
+    wf = Workflow()
+    wf.started = []
+    wf.running = False
+    # Tries for which the process of the last job hasn't ended
+    wf.exiting = 0
+
+    def is_running(name):
+        return wf.running or wf.exiting > 0
+
+    def run_in_background(name, cmd):
+        if is_running(name):
+            wf.exiting = max(wf.exiting - 1, 0)
+            return None
+        wf.started.append(cmd[-1])
+        wf.running = True
+        return 0
+
+    monkeypatch.setattr(prefetch, 'run_in_background', run_in_background)
+    monkeypatch.setattr(prefetch, 'is_running', is_running)
+    monkeypatch.setattr(prefetch, 'START_DELAY', 0)
+    # No references are cached
+    monkeypatch.setattr(prefetch.refcache, 'missing',
+                        lambda db, clone, uids, *args: uids)
+    monkeypatch.setattr(prefetch.zq, '_backend', Backend())
+    return wf
+
+
+@pytest.fixture()
+def actions():
+    """What to do at each export, by ``(flag, arg)``."""
+    return {}
+
+
+@pytest.fixture()
+def exports(actions, monkeypatch):
+    """Arguments of exports."""
+    exports = []
+
+    def get_export_html(flag, arg, wf):
+        exports.append((flag, arg))
+        action = actions.pop((flag, arg), None)
+        if action:
+            action()
+
+    monkeypatch.setattr(export, 'get_export_html', get_export_html)
+    return exports
+
+
+def test_queue(wf):
+    """Only new results are queued; a job is started for them."""
+    assert prefetch.queue(wf, STYLE, ['1_A', '1_B', '1_C'])
+    assert prefetch.read(wf) == {'style': STYLE, 'args': ['1_A', '1_B'],
+                                 'job': True}
+    assert wf.started == ['prefetch']
+    assert not prefetch.queue(wf, STYLE, ['1_A', '1_B'])
+    assert prefetch.queue(wf, STYLE, ['1_C'])
+    assert wf.started == ['prefetch']
+    assert not prefetch.queue(wf, STYLE, [])
+
+
+def test_run(wf, exports, actions):
+    """Results queued while a job runs are fetched by that job."""
+    prefetch.queue(wf, STYLE, ['1_A'])
+    # The user types on while the last export is made
+    actions[('bib', '1_A')] = \
+        lambda: prefetch.queue(wf, STYLE, ['1_B'])
+    prefetch.run(wf)
+    wf.running = False
+    assert exports == [('citation', '1_A'), ('bib', '1_A'),
+                       ('citation', '1_B'), ('bib', '1_B')]
+    assert wf.started == ['prefetch']
+    assert prefetch.read(wf)['job'] is False
+
+    # The next results need a new job
+    prefetch.queue(wf, STYLE, ['1_C'])
+    assert wf.started == ['prefetch'] * 2
+
+
+def test_exiting(wf, exports):
+    """Results queued as a job exits start a new job."""
+    prefetch.queue(wf, STYLE, ['1_A'])
+    prefetch.run(wf)
+    # The process of the job hasn't quite ended yet
+    wf.running = False
+    wf.exiting = 3
+    prefetch.queue(wf, STYLE, ['1_B'])
+    assert wf.started == ['prefetch'] * 2
+    assert wf.exiting == 0
+
+
+def test_crashed(wf):
+    """A job that died without clearing the flag is replaced."""
+    prefetch.queue(wf, STYLE, ['1_A'])
+    wf.running = False
+    prefetch.queue(wf, STYLE, ['1_B'])
+    assert wf.started == ['prefetch'] * 2
+
+
+@pytest.mark.parametrize('error', [
+    IOError('offline'), socket.timeout('timed out'),
+    httplib.BadStatusLine(''),
+])
+def test_network_error(wf, exports, actions, error):
+    """A queue is fetched until the first network error."""
+    prefetch.queue(wf, STYLE, ['1_A', '1_B'])
+
+    def fail():
+        raise error
+
+    actions[('citation', '1_A')] = fail
+    prefetch.run(wf)
+    assert exports == [('citation', '1_A')]
+    assert prefetch.read(wf)['job'] is False
+
+
+if __name__ == '__main__':  # pragma: no cover
+    pytest.main([__file__])
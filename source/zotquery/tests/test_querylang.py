@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""Unit tests for querylang.py."""
+
+from __future__ import print_function, absolute_import, unicode_literals
+
+from contextlib import closing
+import sqlite3
+
+import pytest
+
+from zotquery import querylang, usage
+
+COLUMNS = ['title', 'creators']
+
+NOT_MATCH = ('metadata.docid NOT IN (SELECT docid FROM zotquery '
+             'WHERE zotquery MATCH ?)')
+
+
+@pytest.fixture(params=[False, True], ids=['standard', 'enhanced'])
+def syntax(request, monkeypatch):
+    """Compile for either FTS query syntax."""
+    monkeypatch.setattr(querylang, '_enhanced', request.param)
+    return request.param
+
+
+@pytest.mark.parametrize('query,expected', [
+    ('smith', [('smith', None, False, False, True)]),
+    ('smith ', [('smith', None, False, False, False)]),
+    ('"exact phrase"', [('exact phrase', None, False, True, False)]),
+    ('"open phrase', [('open phrase', None, False, True, False)]),
+    ('-tag:read x', [('read', 'tag', True, False, False),
+                     ('x', None, False, False, True)]),
+    ('Creator:"de la"', [('de la', 'creator', False, True, False)]),
+    ('foo:bar', [('foo:bar', None, False, False, True)]),
+    ('year:2010..2015', [('2010..2015', 'year', False, False, True)]),
+    ('', []),
+])
+def test_parse(query, expected):
+    """Terms, fields, negation, quoting and prefixes."""
+    assert [(t.value, t.field, t.negated, t.phrase, t.prefix)
+            for t in querylang.parse(query)] == expected
+
+
+@pytest.mark.parametrize('query,match,where,params', [
+    # Text in any column; the last word is a prefix
+    ('smith', 'title:smith* OR creators:smith*', [], []),
+    ('smith 2010 ', 'title:smith OR creators:smith title:2010 OR '
+     'creators:2010', [], []),
+    # Quoting
+    ('"war and peace"', 'title:war NEAR/0 title:and NEAR/0 title:peace OR '
+     'creators:war NEAR/0 creators:and NEAR/0 creators:peace', [], []),
+    ('"it\'s"', 'title:it NEAR/0 title:s OR creators:it NEAR/0 creators:s',
+     [], []),
+    # Fields
+    ('author:smith ', 'creators:smith', [], []),
+    ('title:"the end"', 'title:the NEAR/0 title:end', [], []),
+    ('title:the_end', 'title:the_end*', [], []),
+    # Negation
+    ('-tag:read', None, [NOT_MATCH], ['tags:read*']),
+    ('x -smith ', 'title:x OR creators:x', [NOT_MATCH],
+     ['title:smith OR creators:smith']),
+    # Filters
+    ('year:2010', None, ['metadata.year = ?'], [2010]),
+    ('year:2010..2015', None, ['metadata.year BETWEEN ? AND ?'],
+     [2010, 2015]),
+    ('year:2010..', None, ['metadata.year >= ?'], [2010]),
+    ('year:..2015', None, ['metadata.year <= ?'], [2015]),
+    ('year:..', None, [], []),
+    ('year:later', None, [], []),
+    ('type:article', None, ['metadata.type = ?'], ['journalArticle']),
+    ('-type:book', None,
+     ['(metadata.type IS NULL OR NOT metadata.type = ?)'], ['book']),
+    ('library:2', None, ['metadata.library = ?'], ['2']),
+    # Operators are only text
+    ('AND', 'title:and* OR creators:and*', [], []),
+    ('NOT OR ', 'title:not OR creators:not title:or OR creators:or', [],
+     []),
+    # Nothing to search
+    ('', None, [], []),
+    ('   ', None, [], []),
+    ('-', None, [], []),
+    ('"" ', None, [], []),
+    ('*', None, [], []),
+])
+def test_compile_terms(query, match, where, params, monkeypatch):
+    """Query compiles to MATCH expression and SQL conditions."""
+    monkeypatch.setattr(querylang, '_enhanced', False)
+    assert querylang.compile_terms(query, COLUMNS) == (match, where, params)
+
+
+def test_grouping(syntax):
+    """Alternatives are parenthesized only for the enhanced syntax."""
+    match = querylang.compile_terms('a b', COLUMNS)[0]
+    if syntax:
+        assert match == '(title:a OR creators:a) (title:b* OR creators:b*)'
+    else:
+        assert match == 'title:a OR creators:a title:b* OR creators:b*'
+
+
+@pytest.fixture()
+def db():
+    """Search database with a few titles and creators."""
+    with closing(sqlite3.connect(':memory:')) as con:
+        con.create_function('rank', 1, lambda matchinfo: 0)
+        con.create_function('frecency', 3, usage.factor)
+        con.executescript("""
+            CREATE VIRTUAL TABLE zotquery USING fts3(title, creators);
+            CREATE TABLE metadata (docid INTEGER PRIMARY KEY, key TEXT,
+                                   type TEXT, year INTEGER, library TEXT);
+            ATTACH DATABASE ':memory:' AS usage;
+            CREATE TABLE usage.items (key TEXT, score REAL);
+            CREATE TABLE usage.anchor (time REAL, rate REAL);
+            INSERT INTO usage.anchor VALUES (0, 0);
+        """)
+        for i, (title, creators) in enumerate([
+                ('War and Peace', 'Tolstoy'),
+                ('Peace or War, and not', 'Smith and Peace'),
+                ('Leo', 'War, Peace')], 1):
+            con.execute('INSERT INTO zotquery (docid, title, creators) '
+                        'VALUES (?, ?, ?)', (i, title, creators))
+            con.execute('INSERT INTO metadata (docid, key) VALUES (?, ?)',
+                        (i, 'K{}'.format(i)))
+        yield con
+
+
+def search(db, query):
+    compiled = querylang.compile_query(query, COLUMNS)
+    return sorted(row[0] for row in db.execute(*compiled))
+
+
+@pytest.mark.parametrize('query,keys', [
+    ('"war and peace"', ['K1']),
+    ('title:"peace or"', ['K2']),
+    ('creator:"war peace"', ['K3']),
+    ('"war peace"', ['K3']),
+    ('"smith and peace', ['K2']),
+    ('peace -title:"and peace"', ['K2', 'K3']),
+])
+def test_phrase(db, query, keys):
+    """Phrases match adjacent words, also in one column."""
+    assert search(db, query) == keys
+
+
+@pytest.mark.parametrize('query,compiles', [
+    ('', False), ('-', False), ('"', False), ('- "" *', False),
+    ('NOT', True), ('-AND', True), ('OR -x', True), ('"NEAR"', True),
+])
+def test_only_operators(db, query, compiles):
+    """Queries of operators alone are valid or not compiled at all."""
+    compiled = querylang.compile_query(query, COLUMNS)
+    assert bool(compiled) == compiles
+    if compiled:
+        db.execute(*compiled).fetchall()
+
+
+def test_compile_query(monkeypatch):
+    """Text and conditions compile to one statement."""
+    monkeypatch.setattr(querylang, '_enhanced', False)
+    sql, params = querylang.compile_query(
+        'x year:2001', COLUMNS, conditions=[('metadata.docid IN (?)', (7,))])
+    assert 'WHERE zotquery MATCH ? AND metadata.year = ? AND ' \
+        'metadata.docid IN (?)' in sql
+    assert params[2:] == ('title:x OR creators:x', 2001, 7)
+
+    sql, params = querylang.compile_query('year:2001', COLUMNS)
+    assert 'MATCH' not in sql
+    assert params[2:] == (2001,)
+
+
+def test_enhanced_syntax(monkeypatch):
+    """The syntax is read from SQLite's compile options once."""
+    monkeypatch.setattr(querylang, '_enhanced', None)
+    with closing(sqlite3.connect(':memory:')) as con:
+        opts = [r[0] for r in con.execute('PRAGMA compile_options')]
+    assert querylang.enhanced_syntax() == \
+        ('ENABLE_FTS3_PARENTHESIS' in opts)
+    monkeypatch.setattr(querylang, '_enhanced', 'cached')
+    assert querylang.enhanced_syntax() == 'cached'
+
+
+if __name__ == '__main__':  # pragma: no cover
+    pytest.main([__file__])
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""Unit tests for refcache.py."""
+
+from __future__ import print_function, absolute_import
+
+from contextlib import closing
+import sqlite3
+
+import pytest
+
+from zotquery import refcache
+
+
+@pytest.fixture()
+def clone(tmpdir):
+    """Clone with two items, one in a collection and tagged."""
+    path = str(tmpdir.join('zotero.sqlite'))
+    with closing(sqlite3.connect(path)) as con:
+        with con as cur:
+            cur.executescript("""
+                CREATE TABLE items (itemID INTEGER PRIMARY KEY, key TEXT,
+                                    version INT, clientDateModified TEXT);
+                CREATE TABLE collections (collectionID INTEGER PRIMARY KEY,
+                                          key TEXT);
+                CREATE TABLE collectionItems (collectionID INT, itemID INT);
+                CREATE TABLE itemTags (itemID INT, tagID INT);
+                INSERT INTO items VALUES (1, 'AAAA', 3, '2018-01-01');
+                INSERT INTO items VALUES (2, 'BBBB', 5, '2018-01-02');
+                INSERT INTO collections VALUES (1, 'COLL');
+                INSERT INTO collectionItems VALUES (1, 1);
+                INSERT INTO itemTags VALUES (1, 7);
+            """)
+    return path
+
+
+@pytest.fixture()
+def db(tmpdir):
+    path = str(tmpdir.join('references.sqlite3'))
+    refcache.create_db(path)
+    return path
+
+
+def touch(clone, version):
+    with closing(sqlite3.connect(clone)) as con:
+        with con as cur:
+            cur.execute('UPDATE items SET version = ? WHERE key = ?',
+                        (version, 'AAAA'))
+
+
+@pytest.mark.parametrize('uid', ['1_AAAA', 'c_COLL', 't_7'])
+def test_changed_item(clone, db, uid):
+    """References are replaced when an item changes."""
+    version = refcache.version(clone, uid)
+    refcache.put(db, uid, version, 'apa', 'bib', 'en-US', '<div>A</div>')
+    assert refcache.get(db, uid, version, 'apa', 'bib', 'en-US') == \
+        '<div>A</div>'
+    touch(clone, 4)
+    new = refcache.version(clone, uid)
+    assert new != version
+    assert refcache.get(db, uid, new, 'apa', 'bib', 'en-US') is None
+
+
+def test_key(clone, db):
+    """References are kept by style, flag and locale."""
+    version = refcache.version(clone, '1_AAAA')
+    refcache.put(db, '1_AAAA', version, 'apa', 'bib', 'en-US', 'apa')
+    refcache.put(db, '1_AAAA', version, 'mla', 'bib', 'en-US', 'mla')
+    refcache.put(db, '1_AAAA', version, 'apa', 'citation', 'en-US', 'cite')
+    assert refcache.get(db, '1_AAAA', version, 'apa', 'bib', 'en-US') == 'apa'
+    assert refcache.get(db, '1_AAAA', version, 'mla', 'bib', 'en-US') == 'mla'
+    assert refcache.get(db, '1_AAAA', version, 'apa', 'bib', 'de-DE') is None
+    assert refcache.version(clone, 'c_NONE') is None
+
+
+def test_missing(clone, db):
+    """Items lack references until each kind is cached at its version."""
+    uids = ['1_AAAA', '1_BBBB', '1_CCCC']
+    flags = ('citation', 'bib')
+
+    def missing():
+        return refcache.missing(db, clone, uids, 'apa', flags, 'en-US')
+
+    assert missing() == uids
+    for uid in uids[:2]:
+        version = refcache.version(clone, uid)
+        for flag in flags:
+            refcache.put(db, uid, version, 'apa', flag, 'en-US', '<div/>')
+    assert missing() == ['1_CCCC']
+    assert refcache.missing(db, clone, uids[:2], 'apa', flags, 'de-DE') \
+        == uids[:2]
+    touch(clone, 4)
+    assert missing() == ['1_AAAA', '1_CCCC']
+
+
+if __name__ == '__main__':  # pragma: no cover
+    pytest.main([__file__])
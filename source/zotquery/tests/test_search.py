@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""Unit tests for search.py against a synthetic library."""
+
+from __future__ import print_function, absolute_import
+
+from contextlib import closing
+import sqlite3
+
+import pytest
+
+from zotquery import querylang, search, store
+
+
+def clone_rows(backend, sql, params=()):
+    with closing(sqlite3.connect(backend.cloned_sqlite)) as con:
+        return con.execute(sql, params).fetchall()
+
+
+def nested_collection(backend):
+    """Return ID and key of a collection with items in a sub-collection."""
+    return clone_rows(backend, """
+        SELECT parent.collectionID, parent.key
+        FROM collections AS parent
+            JOIN collections AS child
+                ON child.parentCollectionID = parent.collectionID
+            JOIN collectionItems
+                ON collectionItems.collectionID = child.collectionID
+        LIMIT 1""")[0]
+
+
+def tree_keys(backend, collection_id):
+    """Keys of the items in a collection and all its sub-collections."""
+    rows = clone_rows(backend, """
+        WITH RECURSIVE tree (id) AS (
+            SELECT ?
+            UNION SELECT collectionID
+                FROM collections JOIN tree ON parentCollectionID = tree.id)
+        SELECT DISTINCT items.key
+        FROM tree
+            JOIN collectionItems ON collectionItems.collectionID = tree.id
+            JOIN items ON items.itemID = collectionItems.itemID""",
+                      (collection_id,))
+    return set(row[0] for row in rows)
+
+
+def test_collection_tree(backend):
+    """Collection searches include the items of sub-collections."""
+    collection_id, key = nested_collection(backend)
+    expected = tree_keys(backend, collection_id)
+    db = backend.fts_sqlite
+
+    # Items in the collection itself only
+    direct = search.get_group_keys('c_' + key)
+    assert set(direct) < expected
+
+    # Closure has each collection as its own descendant
+    tree = search.execute_sql(db, """SELECT descendant FROM collection_tree
+                                     WHERE ancestor = ?""",
+                              ('c_' + key,)).fetchall()
+    assert ('c_' + key,) in tree and len(tree) > 1
+
+    query = search.make_in_group_sqlite_query('', 'c_' + key, recursive=True)
+    assert set(search.run_item_sqlite_query(db, *query)) == expected
+
+    query = search.make_in_group_sqlite_query('', 'c_' + key)
+    assert set(search.run_item_sqlite_query(db, *query)) == set(direct)
+
+
+def test_in_collection(backend):
+    """The `in-collection` scope searches the whole tree."""
+    collection_id, key = nested_collection(backend)
+    store.store('collection', 'c_' + key, backend.wf)
+    results = search.search_within_group('in-collection', '')
+    assert set(r['arg'].split('_', 1)[1] for r in results) == \
+        tree_keys(backend, collection_id)
+
+
+def attachment_words(backend):
+    """Map ID of each attachment with words to its parent key and words."""
+    rows = clone_rows(backend, """
+        SELECT fulltextItemWords.itemID, parents.key, fulltextWords.word
+        FROM fulltextItemWords
+            JOIN fulltextWords USING (wordID)
+            JOIN itemAttachments
+                ON itemAttachments.itemID = fulltextItemWords.itemID
+            JOIN items AS parents
+                ON parents.itemID = itemAttachments.parentItemID""")
+    attachments = {}
+    for id_, parent, word in rows:
+        attachments.setdefault(id_, (parent, set()))[1].add(word)
+    return attachments
+
+
+def indexed_words(db, id_):
+    return set(row[0] for row in search.execute_sql(db, """
+        SELECT word FROM words JOIN attachment_words USING (wordID)
+        WHERE itemID = ?""", (id_,)))
+
+
+def test_update_fulltext_db(backend):
+    """The word index follows changes to Zotero's."""
+    attachments = attachment_words(backend)
+    db = backend.fulltext_sqlite
+    changed, removed = sorted(attachments)[:2]
+    assert indexed_words(db, changed) == attachments[changed][1]
+
+    with closing(sqlite3.connect(backend.cloned_sqlite)) as con:
+        with con as cur:
+            cur.execute('DELETE FROM fulltextItemWords WHERE itemID = ?',
+                        (changed,))
+            word_id = cur.execute("""INSERT INTO fulltextWords (word)
+                                     VALUES ('zzyzx')""").lastrowid
+            cur.execute('INSERT INTO fulltextItemWords VALUES (?, ?)',
+                        (word_id, changed))
+            cur.execute("""UPDATE fulltextItems SET version = version + 1
+                           WHERE itemID = ?""", (changed,))
+            cur.execute('DELETE FROM fulltextItems WHERE itemID = ?',
+                        (removed,))
+    backend.update_fulltext_db()
+
+    assert indexed_words(db, changed) == set(['zzyzx'])
+    assert indexed_words(db, removed) == set()
+    others = set.union(*[words for id_, (_, words) in attachments.items()
+                         if id_ not in (changed, removed)])
+    words = set(row[0] for row in search.execute_sql(
+        db, 'SELECT word FROM words'))
+    assert words == others | set(['zzyzx'])
+
+
+def test_search_fulltext(backend, monkeypatch):
+    """Items are found by the words in their attachments."""
+    monkeypatch.setattr(search.config, 'FTCACHE_WORKERS', 0)
+    attachments = attachment_words(backend)
+    first, second = sorted(attachments.values()[0][1])[:2]
+
+    def parents(include, exclude=()):
+        return set(parent for parent, words in attachments.values()
+                   if all(w in words for w in include) and
+                   not any(w in words for w in exclude))
+
+    def found(query):
+        return set(r['arg'].split('_', 1)[1]
+                   for r in search.search_fulltext(query))
+
+    assert found('{} {} '.format(first, second)) == parents([first, second])
+    assert found('{} -{} '.format(first, second)) == \
+        parents([first], [second])
+    # The last word may be incomplete
+    assert found(first.upper()[:-1]) == set(
+        parent for parent, words in attachments.values()
+        if any(w.startswith(first[:-1]) for w in words))
+    assert found('-{}'.format(first)) == set()
+
+
+def test_prefetch(backend, monkeypatch):
+    """Top results are queued for prefetching after feedback is sent."""
+    from zotquery import prefetch
+    events = []
+    monkeypatch.setattr(backend.wf, 'send_feedback',
+                        lambda: events.append('feedback'))
+    monkeypatch.setattr(prefetch, 'queue',
+                        lambda wf, style, args: events.append(args))
+
+    search.search('general', 'a', backend.wf)
+    assert events == ['feedback']
+
+    monkeypatch.setattr(search.config, 'PREFETCH_RESULTS', 2)
+    del events[:]
+    backend.wf._items = []
+    search.search('general', 'a', backend.wf)
+    assert events[0] == 'feedback'
+    assert events[1] == [item.arg for item in backend.wf._items]
+
+
+@pytest.fixture()
+def snippet_db(backend, tmpdir):
+    """Search database with three items."""
+    db = str(tmpdir.join('snippets.sqlite3'))
+    backend.create_index_db(db)
+    notes = ('one two three four five six seven eight nine ten beta '
+             'eleven twelve thirteen fourteen fifteen sixteen')
+    items = [('K1', {'title': 'Alpha study', 'notes': notes}),
+             ('K2', {'title': 'Beta', 'tags': 'alpha'}),
+             ('K3', {'title': 'Gamma', 'tags': 'beta'})]
+    with closing(sqlite3.connect(db)) as con:
+        with con as cur:
+            for docid, (key, columns) in enumerate(items, 1):
+                cur.execute('INSERT INTO zotquery (docid, key, {}) '
+                            'VALUES (?, ?, ?, ?)'.format(', '.join(columns)),
+                            [docid, key] + list(columns.values()))
+                cur.execute('INSERT INTO metadata (docid, key) VALUES (?, ?)',
+                            (docid, key))
+    return db
+
+
+def test_compile_snippet_query():
+    """Snippets are made only for text queries and the given keys."""
+    columns = search.get_item_columns('general')
+    assert querylang.compile_snippet_query('year:2001', columns, ['K1']) \
+        is None
+    assert querylang.compile_snippet_query('alpha', columns, []) is None
+    sql, params = querylang.compile_snippet_query('alpha', columns,
+                                                  ['K1', 'K2'])
+    assert sql.count('snippet(zotquery') == \
+        len(search.config.SNIPPET_COLUMNS)
+    assert 'metadata.key IN (?, ?)' in sql
+    assert params[-3:] == (querylang.compile_terms('alpha', columns)[0],
+                           'K1', 'K2')
+
+
+def test_get_snippets(snippet_db):
+    """Snippets show where the query matched outside title and creators."""
+    columns = search.get_item_columns('general')
+
+    def snippets(query, keys=('K1', 'K2', 'K3')):
+        return search.get_snippets(snippet_db, query, columns, list(keys))
+
+    # Titles are in every result anyway
+    assert snippets('alpha ') == {'K2': ('tags', '[alpha]')}
+    assert snippets('beta ', ['K2', 'K3']) == {'K3': ('tags', '[beta]')}
+    assert snippets('beta ')['K1'] == (
+        'notes', u'\u2026six seven eight nine ten [beta] eleven twelve '
+                 u'thirteen fourteen\u2026')
+    # Terms that only match a column snippets aren't made of
+    assert snippets('title:alpha ') == {}
+    assert snippets('title:gamma tag:beta') == {'K3': ('tags', '[beta]')}
+    assert snippets('nowhere') == {}
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""Startup-time budget for searches."""
+
+from __future__ import print_function, absolute_import
+
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from zotquery import config
+
+SOURCE = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+BENCH = os.path.join(SOURCE, 'bench')
+sys.path.insert(0, BENCH)
+
+import searchbench  # noqa: E402
+import synthlib  # noqa: E402
+
+# Median time (ms) of a search's startup spans: importing the script's
+# modules, creating the `ZotQuery` object and its backend. The search
+# itself varies with the query, so isn't counted. The default leaves
+# ample headroom; override with $ZOTQUERY_STARTUP_BUDGET on slower
+# machines.
+STARTUP_BUDGET = float(os.getenv('ZOTQUERY_STARTUP_BUDGET', 150))
+STARTUP_SPANS = ('import', 'ZotQuery()', 'backend')
+
+# Seconds to wait for background jobs started by the setup search
+JOB_TIMEOUT = 60
+
+# Number of timed searches
+RUNS = 7
+
+# Modules a search must not import
+NOT_FOR_SEARCH = ['zotquery.export', 'zotquery.append', 'zotquery.scan',
+                  'zotquery.open', 'zotquery.configure', 'zotquery.store',
+                  'zotquery.lib.docopt', 'zotquery.lib.html2text',
+                  'zotquery.ftcache', 'multiprocessing',
+                  'zotquery.prefetch', 'zotquery.csl']
+
+
+@pytest.fixture(scope='module')
+def env(tmpdir_factory):
+    """Environment of a workflow with a small library."""
+    root = str(tmpdir_factory.mktemp('startup'))
+    library = synthlib.generate(os.path.join(root, 'zotero'), 200)
+    env = searchbench.make_env(root)
+    # Set by Alfred; otherwise read from `info.plist` on every run
+    env['alfred_workflow_bundleid'] = 'com.hackademic.zotquery2'
+    env['alfred_workflow_version'] = '11'
+    saved = dict(os.environ)
+    os.environ.update(env)
+    try:
+        searchbench.prepare(root, library,
+                            os.path.join(root, 'zotero', 'storage'))
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+    # No background jobs to compete with the timed searches: prefetching
+    # is off unless configured, and an update check is made to seem
+    # recent
+    assert not config.PREFETCH_RESULTS
+    open(os.path.join(env['alfred_workflow_cache'],
+                      'update-checked'), 'wb').close()
+    # Build clone, cache and search databases
+    search('general', 'a', env)
+    wait_for_jobs(env)
+    return env
+
+
+def wait_for_jobs(env):
+    """Wait for the workflow's background jobs to exit."""
+    pattern = os.path.join(env['alfred_workflow_cache'], '*.pid')
+    deadline = time.time() + JOB_TIMEOUT
+    while glob.glob(pattern):
+        assert time.time() < deadline, 'background jobs still running'
+        time.sleep(0.1)
+
+
+def search(scope, query, env, script='zotquery.py', *options):
+    cmd = [sys.executable, os.path.join(SOURCE, script)]
+    cmd += list(options) + ['search', scope, query]
+    return subprocess.check_output(cmd, env=env, cwd=SOURCE,
+                                   stderr=open(os.devnull, 'wb'))
+
+
+def test_search_budget(env):
+    """Search cold start is within budget."""
+    log = os.path.join(env['alfred_workflow_cache'], 'timings.jsonl')
+    if os.path.exists(log):
+        os.unlink(log)
+    for query in ['e', 'ep', 'epi', 'a', 'an', 'the', 'tag'][:RUNS]:
+        search('general', query, env)
+    wait_for_jobs(env)
+    startups = []
+    with open(log) as fp:
+        for line in fp:
+            record = json.loads(line)
+            # Background jobs log their runs, too
+            if record.get('args', [None])[0] != 'search':
+                continue
+            startups.append(sum(duration
+                                for name, _, duration in record['spans']
+                                if name in STARTUP_SPANS))
+    assert len(startups) == RUNS
+    median = sorted(startups)[len(startups) // 2]
+    assert median <= STARTUP_BUDGET, \
+        'startup took {:.1f} ms (budget {:.1f} ms)'.format(median,
+                                                          STARTUP_BUDGET)
+
+
+def test_search_imports(env):
+    """Search doesn't import the modules of other actions."""
+    output = search('general', 'epi', env, 'bench/importtime.py',
+                    '--json', '--top=1000')
+    report = json.loads(output.strip().splitlines()[-1])
+    imported = set()
+    for name, _, _ in report['modules']:
+        imported.update(n.strip() for n in name.split(','))
+    assert not imported.intersection(NOT_FOR_SEARCH)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    pytest.main([__file__])
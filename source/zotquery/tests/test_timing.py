@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""Unit tests for timing.py."""
+
+from __future__ import print_function, absolute_import, unicode_literals
+
+import json
+
+import pytest
+
+from zotquery import timing
+
+
+@pytest.fixture()
+def spans(monkeypatch):
+    """Empty list of spans of a run that started at 100."""
+    monkeypatch.setattr(timing, '_spans', [])
+    monkeypatch.setattr(timing, '_started', 100.0)
+    return timing._spans
+
+
+def test_spans(spans):
+    """Spans are in milliseconds since the start of the run."""
+    timing.record('import', 100.0, 100.25)
+    with timing.span('sql'):
+        pass
+    assert timing.spans()[0] == ['import', 0.0, 250.0]
+    assert [s[0] for s in timing.spans()] == ['import', 'sql']
+
+
+def test_write(spans, tmpdir):
+    """Each run appends one JSON line."""
+    log = tmpdir.join('timings.jsonl')
+    timing.record('import', 100.0, 100.5)
+    timing.write(str(log), args=['search', 'general', '\xe9pi'])
+    timing.write(str(log), args=['search', 'general', 'x'])
+
+    lines = log.read_binary().splitlines()
+    assert len(lines) == 2
+    data = json.loads(lines[0].decode('utf-8'))
+    assert sorted(data) == ['args', 'spans', 'time', 'total']
+    assert data['args'] == ['search', 'general', '\xe9pi']
+    assert data['spans'] == [['import', 0.0, 500.0]]
+    assert data['total'] >= 500.0
+    assert json.loads(lines[1].decode('utf-8'))['args'][-1] == 'x'
+
+
+def test_rotate(spans, tmpdir, monkeypatch):
+    """Large logs are moved aside."""
+    monkeypatch.setattr(timing, 'MAX_LOG_SIZE', 10)
+    log = tmpdir.join('timings.jsonl')
+    log.write('x' * 11 + '\n')
+    timing.write(str(log))
+    assert tmpdir.join('timings.jsonl.1').read() == 'x' * 11 + '\n'
+    assert len(log.read().splitlines()) == 1
+
+
+if __name__ == '__main__':  # pragma: no cover
+    pytest.main([__file__])
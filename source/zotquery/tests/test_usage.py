@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""Unit tests for usage.py."""
+
+from __future__ import print_function, absolute_import, unicode_literals
+
+from contextlib import closing
+import sqlite3
+
+import pytest
+
+from zotquery import config, search, usage
+
+DAY = 86400
+# Some time in 2018
+NOW = 1530000000.0
+
+
+@pytest.fixture()
+def db(tmpdir):
+    """Usage database whose scores are stored at `NOW`."""
+    path = str(tmpdir.join('usage.sqlite3'))
+    usage.create_db(path)
+    with closing(sqlite3.connect(path)) as con:
+        with con as cur:
+            cur.execute('UPDATE anchor SET time = ?', (NOW,))
+    return path
+
+
+def anchor(db):
+    with closing(sqlite3.connect(db)) as con:
+        return con.execute('SELECT time, rate FROM anchor').fetchone()
+
+
+def uses(db, key):
+    with closing(sqlite3.connect(db)) as con:
+        return con.execute("""SELECT uses, last_used FROM items
+                              WHERE key = ?""", (key,)).fetchone()
+
+
+def test_record(db, monkeypatch):
+    """Each use adds one to the score, which halves every half-life."""
+    monkeypatch.setattr(config, 'FRECENCY_HALF_LIFE', 30)
+    usage.record(db, 'K1', NOW)
+    assert usage.score(db, 'K1', NOW) == pytest.approx(1.0)
+    usage.record(db, 'K1', NOW + 30 * DAY)
+    assert usage.score(db, 'K1', NOW + 30 * DAY) == pytest.approx(1.5)
+    assert usage.score(db, 'K1', NOW + 60 * DAY) == pytest.approx(0.75)
+    assert uses(db, 'K1') == (2, NOW + 30 * DAY)
+    assert usage.score(db, 'K3', NOW) == 0.0
+
+    # Uses recorded out of order count the same
+    usage.record(db, 'K2', NOW + 30 * DAY)
+    usage.record(db, 'K2', NOW)
+    assert usage.score(db, 'K2', NOW + 60 * DAY) == pytest.approx(0.75)
+    assert uses(db, 'K2') == uses(db, 'K1')
+
+
+def test_anchor(db, monkeypatch):
+    """Scores are moved to a later anchor before they grow too large."""
+    monkeypatch.setattr(config, 'FRECENCY_HALF_LIFE', 0.01)
+    usage.record(db, 'K1', NOW)
+    start = anchor(db)[0]
+    usage.record(db, 'K2', NOW + 365 * DAY)
+    usage.record(db, 'K2', NOW + 365 * DAY)
+    assert anchor(db)[0] == NOW + 365 * DAY > start
+    assert usage.score(db, 'K2', NOW + 365 * DAY) == pytest.approx(2.0)
+    assert usage.score(db, 'K1', NOW + 365 * DAY) == 0.0
+    # Searches from before the anchor, by three half-lives
+    assert usage.score(db, 'K2', NOW + 365 * DAY - 3 * 864) == \
+        pytest.approx(2.0 * 2 ** 3)
+    assert usage.score(db, 'K2', NOW) < float('inf')
+
+
+def test_half_life(db, monkeypatch):
+    """Scores are converted when the half-life changes."""
+    monkeypatch.setattr(config, 'FRECENCY_HALF_LIFE', 30)
+    usage.record(db, 'K1', NOW)
+    usage.record(db, 'K1', NOW + 30 * DAY)
+    monkeypatch.setattr(config, 'FRECENCY_HALF_LIFE', 10)
+    usage.record(db, 'K2', NOW + 40 * DAY)
+    assert anchor(db)[1] == usage.decay_rate()
+    # 1.5 at the last use, decayed for 20 days
+    assert usage.score(db, 'K1', NOW + 50 * DAY) == pytest.approx(0.375)
+    assert usage.score(db, 'K2', NOW + 50 * DAY) == pytest.approx(0.5)
+
+
+def test_factor_once(db, monkeypatch):
+    """The decay is computed once per query, not per row."""
+    for i in range(5):
+        usage.record(db, 'K{}'.format(i), NOW)
+    calls = []
+
+    def factor(*args):
+        calls.append(args)
+        return usage.factor(*args)
+
+    with closing(sqlite3.connect(':memory:')) as con:
+        con.create_function('frecency', 3, factor)
+        con.execute('ATTACH DATABASE ? AS usage', (db,))
+        con.execute('CREATE TABLE metadata (key TEXT)')
+        con.executemany('INSERT INTO metadata VALUES (?)',
+                        [('K{}'.format(i),) for i in range(10)])
+        rows = con.execute("""
+            SELECT metadata.key, {} FROM metadata
+                LEFT JOIN usage.items AS used ON used.key = metadata.key
+            """.format(usage.BOOST_SQL),
+                           usage.boost_params(NOW)).fetchall()
+    assert len(calls) == 1
+    boosts = dict(rows)
+    assert boosts['K0'] == pytest.approx(config.FRECENCY_WEIGHT)
+    assert boosts['K9'] == 0
+
+
+def test_ranking(backend):
+    """Items that were used more, and more recently, rank higher."""
+    query = 'type:journalArticle'
+    sql, params = search.make_item_sqlite_query('general', query)
+    db = backend.fts_sqlite
+    keys = search.run_item_sqlite_query(db, sql, params)
+    assert len(keys) > 3
+    # Without usage, results are in the order they were indexed
+    first, second, third = keys[-1], keys[-2], keys[-3]
+
+    now = params[0]
+    usage.record(backend.usage_sqlite, third, now - 365 * DAY)
+    usage.record(backend.usage_sqlite, third, now - 365 * DAY)
+    usage.record(backend.usage_sqlite, first, now)
+    usage.record(backend.usage_sqlite, second, now - DAY)
+    backend.record_usage('1_' + second)
+    ranked = search.run_item_sqlite_query(db, sql, params)
+    assert ranked[:3] == [second, first, third]
+    assert sorted(ranked) == sorted(keys)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    pytest.main([__file__])
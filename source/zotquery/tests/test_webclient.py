@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""Unit tests for webclient.py, against a local HTTP server."""
+
+from __future__ import print_function, absolute_import
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from contextlib import closing
+from SocketServer import ThreadingMixIn
+import gzip
+import json
+import sqlite3
+from StringIO import StringIO
+import threading
+import time
+
+import pytest
+
+from zotquery import webclient
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    connections = 0
+    # Requests to `/busy` answered with 429 before one succeeds
+    busy = 2
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith('/missing'):
+            return self.reply(404, b'Not found')
+        if self.path.startswith('/busy') and self.server.busy:
+            self.server.busy -= 1
+            return self.reply(429, b'Too many requests',
+                              {'Retry-After': '0.2'})
+        body = json.dumps({'path': self.path,
+                           'headers': dict(self.headers.items())})
+        body = body.encode('utf-8')
+        headers = {'Link': '<http://localhost/next>; rel="next"'}
+        if self.path.startswith('/backoff'):
+            headers['Backoff'] = '0.3'
+        if 'gzip' in self.headers.get('accept-encoding', ''):
+            buf = StringIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as fp:
+                fp.write(body)
+            body = buf.getvalue()
+            headers['Content-Encoding'] = 'gzip'
+        self.reply(200, body, headers)
+        if self.path.startswith('/hangup'):
+            # Close without saying so, like a server timing out an
+            # idle connection
+            self.close_connection = 1
+
+    def reply(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture()
+def server():
+    httpd = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture()
+def pool():
+    pool = webclient.ConnectionPool(timeout=5)
+    yield pool
+    pool.close()
+
+
+def url(server, path):
+    return 'http://127.0.0.1:{}{}'.format(server.server_address[1], path)
+
+
+def test_keep_alive(server, pool):
+    """Requests reuse one connection."""
+    for i in range(5):
+        res = pool.request('GET', url(server, '/items'), {'start': i})
+        assert res.json()['path'] == '/items?start={}'.format(i)
+    assert pool.opened == 1
+    assert server.connections == 1
+
+
+def test_gzip_and_headers(server, pool):
+    """Responses are gzipped and headers are sent and received."""
+    res = pool.request('GET', url(server, '/items'),
+                       headers={'Zotero-API-Version': 3})
+    data = res.json()
+    assert data['headers']['accept-encoding'] == 'gzip'
+    assert data['headers']['zotero-api-version'] == '3'
+    assert res.headers['content-encoding'] == 'gzip'
+    assert 'rel="next"' in res.headers['link']
+
+
+def test_error_status(server, pool):
+    """4xx responses raise `HTTPError`, and the connection is reused."""
+    res = pool.request('GET', url(server, '/missing'))
+    with pytest.raises(webclient.HTTPError) as err:
+        res.raise_for_status()
+    assert err.value.code == 404
+    pool.request('GET', url(server, '/items')).raise_for_status()
+    assert pool.opened == 1
+
+
+def test_reconnect(server, pool):
+    """A connection closed by the server is replaced."""
+    pool.request('GET', url(server, '/hangup'))
+    res = pool.request('GET', url(server, '/items'))
+    assert res.json()['path'] == '/items'
+    assert pool.opened == 2
+
+
+def test_threads(server, pool):
+    """Concurrent requests each get a connection, then share them."""
+    results = []
+
+    def fetch(i):
+        results.append(pool.request('GET', url(server, '/t{}'.format(i))))
+
+    threads = [threading.Thread(target=fetch, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(r.json()['path'] for r in results) == \
+        sorted('/t{}'.format(i) for i in range(8))
+    assert pool.opened <= 8
+    opened = pool.opened
+    pool.request('GET', url(server, '/items'))
+    assert pool.opened == opened
+
+
+def test_retry(server, pool):
+    """Requests are retried after `Retry-After` seconds."""
+    scheduler = webclient.Scheduler(rate=10, retries=3)
+    start = time.time()
+    res = scheduler.send(pool.request, 'GET', url(server, '/busy'))
+    assert res.status_code == 200
+    assert server.busy == 0
+    # Each retry waits 0.2s, plus up to as much again
+    assert 0.4 <= time.time() - start < 1.5
+
+
+def test_retries_exhausted(server, pool):
+    """The last response is returned when retries run out."""
+    scheduler = webclient.Scheduler(rate=10, retries=1)
+    res = scheduler.send(pool.request, 'GET', url(server, '/busy'))
+    assert res.status_code == 429
+    assert server.busy == 0
+
+
+def test_backoff(server, pool):
+    """No requests are sent for `Backoff` seconds."""
+    scheduler = webclient.Scheduler(rate=10, retries=0)
+    scheduler.send(pool.request, 'GET', url(server, '/backoff'))
+    start = time.time()
+    scheduler.send(pool.request, 'GET', url(server, '/items'))
+    assert time.time() - start >= 0.25
+
+
+def test_retry_jitter(monkeypatch):
+    """Threads retry at different times after a shared pause."""
+    scheduler = webclient.Scheduler(rate=10, retries=1)
+    # Each thread's share of the pause it waits for again
+    shares = iter([0.0, 0.5, 1.0])
+    monkeypatch.setattr(webclient.random, 'uniform',
+                        lambda a, b: a + (b - a) * next(shares))
+    # Times of each thread's requests
+    sent = {}
+    # Set when every thread has sent its first request
+    sent_all = threading.Event()
+
+    def request():
+        times = sent.setdefault(threading.current_thread(), [])
+        times.append(time.time())
+        if len(times) > 1:
+            return webclient.Response('/', 200, {}, b'')
+        if len(sent) == 3:
+            sent_all.set()
+        sent_all.wait(1)
+        return webclient.Response('/', 429, {'retry-after': '0.2'}, b'')
+
+    threads = [threading.Thread(target=scheduler.send, args=(request,))
+               for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    failed = max(times[0] for times in sent.values())
+    waits = sorted(times[1] - failed for times in sent.values())
+    # 0.2s, then 0-0.2s more
+    assert waits == pytest.approx([0.2, 0.3, 0.4], abs=0.04)
+
+
+def test_rate(server, pool):
+    """Requests beyond the first burst are spaced out."""
+    scheduler = webclient.Scheduler(rate=20, retries=0)
+    start = time.time()
+    for i in range(30):
+        scheduler.send(pool.request, 'GET', url(server, '/items'))
+    # 20 at once, then 10 at 20 per second
+    assert time.time() - start >= 0.45
+
+
+def test_refund():
+    """Requests answered `304` give their tokens back."""
+    scheduler = webclient.Scheduler(rate=5, retries=0)
+
+    def request(status):
+        return webclient.Response('/', status, {}, b'')
+
+    start = time.time()
+    for i in range(20):
+        assert scheduler.send(request, 304).status_code == 304
+    # So don't use up the tokens of others
+    for i in range(5):
+        scheduler.send(request, 200)
+    assert time.time() - start < 0.1
+    scheduler.send(request, 200)
+    assert time.time() - start >= 0.15
+
+
+def stored_urls(store):
+    with closing(sqlite3.connect(store.path)) as con:
+        return set(r[0] for r in con.execute('SELECT url FROM responses'))
+
+
+def test_response_store(tmpdir, monkeypatch):
+    """Only the latest responses are kept, and not for too long."""
+    now = [1000.0]
+    monkeypatch.setattr(webclient.time, 'time', lambda: now[0])
+    store = webclient.ResponseStore(str(tmpdir.join('api.db')),
+                                    max_rows=3, max_age=100)
+    for i in range(5):
+        now[0] += 1
+        store.put(webclient.Response('/{}'.format(i), 200,
+                                     {'etag': str(i)}, b'body'))
+    assert stored_urls(store) == set(['/2', '/3', '/4'])
+    res = store.get('/4')
+    assert (res.headers, res.content) == ({'etag': '4'}, b'body')
+    assert store.get('/0') is None
+
+    now[0] += 100
+    store.put(webclient.Response('/5', 200, {}, b''))
+    assert stored_urls(store) == set(['/4', '/5'])
+
+
+def test_response_store_version(tmpdir):
+    """Stores in an older layout are emptied."""
+    path = str(tmpdir.join('api.db'))
+    with closing(sqlite3.connect(path)) as con:
+        with con as cur:
+            cur.execute("""CREATE TABLE responses (url TEXT PRIMARY KEY,
+                               headers TEXT, content BLOB)""")
+            cur.execute("INSERT INTO responses VALUES ('/', '{}', '')")
+    store = webclient.ResponseStore(path)
+    assert stored_urls(store) == set()
+    store.put(webclient.Response('/', 200, {}, b''))
+    assert stored_urls(webclient.ResponseStore(path)) == set(['/'])
+
+
+if __name__ == '__main__':  # pragma: no cover
+    pytest.main([__file__])
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""Unit tests for WebZotero, against a local stand-in for the API."""
+
+from __future__ import print_function, absolute_import
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+import json
+import threading
+import time
+import urlparse
+
+import pytest
+
+from zotquery import config, webclient
+from zotquery.zotero import WebZotero
+
+# Items in the stand-in library
+ITEMS = 345
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, *args):
+        HTTPServer.__init__(self, *args)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.requests = []
+        self.statuses = []
+        # Library version
+        self.version = 10
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Pages take this long, so concurrent requests overlap
+    delay = 0.05
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse.urlsplit(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+        server = self.server
+        with server.lock:
+            server.requests.append(params)
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        time.sleep(self.delay)
+        with server.lock:
+            server.active -= 1
+
+        since = self.headers.get('If-Modified-Since-Version')
+        if since and int(since) >= server.version:
+            return self.reply(304, '', {})
+
+        if 'itemKey' in params:
+            keys = params['itemKey'].split(',')
+            if len(keys) > 50:
+                return self.reply(400, b'Too many keys', {})
+            # In no particular order; unknown keys are left out
+            found = sorted(int(k[1:]) for k in keys if int(k[1:]) < ITEMS)
+            return self.reply(200, json.dumps([item(i) for i in found]),
+                              {'Total-Results': str(len(found))})
+
+        start = int(params.get('start', 0))
+        limit = min(int(params.get('limit', 25)), 100)
+        items = [item(i) for i in range(start, min(start + limit, ITEMS))]
+        headers = {'Total-Results': str(ITEMS)}
+        if start + limit < ITEMS:
+            headers['Link'] = '<http://{}:{}{}?{}>; rel="next"'.format(
+                server.server_address[0], server.server_address[1],
+                url.path, 'start={}&limit={}&format=json'.format(
+                    start + limit, limit))
+        self.reply(200, json.dumps(items), headers)
+
+    def reply(self, status, body, headers):
+        body = body.encode('utf-8')
+        self.server.statuses.append(status)
+        headers['Last-Modified-Version'] = str(self.server.version)
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def item(i):
+    return {'key': 'K{:04d}'.format(i), 'bib': '<div>{}</div>'.format(i),
+            'citation': '<span>({})</span>'.format(i)}
+
+
+@pytest.fixture()
+def server():
+    httpd = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture()
+def web(server, tmpdir, monkeypatch):
+    # Credentials come from the cache, not the Keychain
+    monkeypatch.setitem(config._credentials, 'web_zotero', (
+        time.time(), json.dumps({'user_id': '1', 'api_key': 'secret',
+                                 'user_type': 'users'})))
+    web = WebZotero(config.WF)
+    web.base = 'http://{}:{}'.format(*server.server_address)
+    web._responses = webclient.ResponseStore(str(tmpdir.join('api.db')))
+    return web
+
+
+def test_collection_references(server, web):
+    """All pages are fetched, concurrently, and kept in order."""
+    refs = web.collection_references('ABCD')
+    assert refs == ['<div>{}</div>'.format(i) for i in range(ITEMS)]
+    assert sorted(int(r.get('start', 0)) for r in server.requests) == \
+        [0, 100, 200, 300]
+    assert server.max_active > 1
+
+
+def test_items_bibliography(server, web):
+    """Keys are requested in chunks, concurrently, and results returned
+    in the order of the keys, without duplicates."""
+    numbers = [(i * 7) % 300 for i in range(300)] + [5, 12, 999]
+    keys = ['K{:04d}'.format(i) for i in numbers]
+    bib = web.items_bibliography(keys)
+    assert bib['refs'] == ['<div>{}</div>'.format(i) for i in numbers[:300]]
+    assert bib['cites'] == \
+        ['<span>({})</span>'.format(i) for i in numbers[:300]]
+    assert len(server.requests) == 7
+    assert server.max_active > 1
+
+
+def test_not_modified(server, web):
+    """Unchanged resources are answered from the stored responses."""
+    refs = web.collection_references('ABCD')
+    bib = web.items_bibliography(['K0001', 'K0002'])
+    assert server.statuses == [200] * 5
+    del server.statuses[:]
+    assert web.collection_references('ABCD') == refs
+    assert web.items_bibliography(['K0001', 'K0002']) == bib
+    assert server.statuses == [304] * 5
+    del server.statuses[:]
+    server.version += 1
+    assert web.collection_references('ABCD') == refs
+    assert server.statuses == [200] * 4
+
+
+def test_follow(server, web):
+    """`next` links can be followed one page at a time."""
+    items = web.items(limit=100)
+    while web.links and web.links.get('next'):
+        items.extend(web.follow())
+    assert [i['key'] for i in items] == \
+        ['K{:04d}'.format(i) for i in range(ITEMS)]
+    assert web.follow() is None
+
+
+def test_responses_threads(web, monkeypatch):
+    """Request threads share one response store."""
+    made = []
+
+    def store(path):
+        made.append(path)
+        # Give other threads the chance to make one, too
+        time.sleep(0.05)
+        return path
+
+    monkeypatch.setattr(web, '_responses', None)
+    monkeypatch.setattr(webclient, 'ResponseStore', store)
+    threads = [threading.Thread(target=lambda: web.responses)
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(made) == 1
+    assert web.responses == made[0]
+
+
+if __name__ == '__main__':  # pragma: no cover
+    pytest.main([__file__])
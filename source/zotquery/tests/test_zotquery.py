@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""Unit tests for the ZotQuery components in `zotquery/__init__.py`."""
+
+from __future__ import print_function, absolute_import, unicode_literals
+
+import pytest
+
+import zotquery
+from zotquery import backend, timing, zotero
+
+
+@pytest.fixture()
+def made(monkeypatch):
+    """Map name of each component to the objects created for it."""
+    made = {'backend': [], 'web': [], 'local': []}
+
+    def make(name):
+        def factory(wf):
+            made[name].append(object())
+            return made[name][-1]
+        return factory
+
+    monkeypatch.setattr(zotquery, 'data', make('backend'))
+    monkeypatch.setattr(zotero, 'api', make('web'))
+    monkeypatch.setattr(backend, 'zot', make('local'))
+    monkeypatch.setattr(timing, '_spans', [])
+    return made
+
+
+def test_lazy(made):
+    """Components are created once, when first used."""
+    zq = zotquery.ZotQuery()
+    assert made == {'backend': [], 'web': [], 'local': []}
+
+    assert zq.backend is zq.backend
+    assert made['backend'] == [zq.backend]
+    assert [s[0] for s in timing.spans()] == ['backend']
+
+    assert zq.web is zq.web
+    assert made['web'] == [zq.web]
+    assert made['local'] == []
+
+
+def test_local(made, backend, monkeypatch):
+    """Only Zotero's own files need its installation to be found."""
+    # A backend whose settings are stored, so no dialog is shown
+    monkeypatch.setattr(zotquery, 'data', lambda wf: backend)
+    monkeypatch.setattr(backend, '_zotero', None)
+    zq = zotquery.ZotQuery()
+    zq.backend
+    assert made['local'] == []
+    assert zq.local is zq.local
+    assert made['local'] == [zq.local]
+    assert zq.local is zq.backend.zotero
+
+
+if __name__ == '__main__':  # pragma: no cover
+    pytest.main([__file__])
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+"""Time the phases of a workflow run.
+
+Phases are recorded as named spans, either around a block::
+
+    with timing.span('sql'):
+        ...
+
+or from start and end times taken elsewhere (e.g. before any imports)::
+
+    timing.record('import', start, time())
+
+:func:`write` appends all spans of the run to a log file as a single
+JSON line, e.g.::
+
+    {"time": 1539880000.1, "args": ["search", "general", "epi"],
+     "total": 212.4, "spans": [["import", 0.0, 98.1], ...]}
+
+where each span is ``[name, start, duration]`` in milliseconds since
+the run started.
+
+"""
+from __future__ import unicode_literals
+
+# Standard Library
+from contextlib import contextmanager
+import json
+import os
+from time import time
+
+# Log files are rotated when they grow larger than this
+MAX_LOG_SIZE = 1024 * 1024
+
+# (name, start, end) of every span in this run
+_spans = []
+_started = time()
+
+
+def start(when):
+    """Set the start of the run to ``when`` (default: import of module)."""
+    global _started
+    _started = when
+
+
+def record(name, start, end):
+    """Add span ``name`` from ``start`` to ``end``."""
+    _spans.append((name, start, end))
+
+
+@contextmanager
+def span(name):
+    """Record the time taken by the enclosed block as span ``name``."""
+    begin = time()
+    try:
+        yield
+    finally:
+        record(name, begin, time())
+
+
+def spans():
+    """Return ``[name, start, duration]`` of each span, in milliseconds."""
+    return [[name, round((begin - _started) * 1000, 2),
+             round((end - begin) * 1000, 2)]
+            for name, begin, end in _spans]
+
+
+def write(path, **fields):
+    """Append the spans of this run to the JSON-lines log at ``path``.
+
+    :param path: path to log file
+    :type path: :class:`unicode`
+    :param fields: extra fields for the record, e.g. the arguments
+    :type fields: :class:`dict`
+
+    """
+    now = time()
+    data = {'time': round(now, 3),
+            'total': round((now - _started) * 1000, 2),
+            'spans': spans()}
+    data.update(fields)
+    if os.path.exists(path) and os.path.getsize(path) > MAX_LOG_SIZE:
+        os.rename(path, path + '.1')
+    with open(path, 'ab') as fp:
+        fp.write(json.dumps(data, sort_keys=True).encode('utf-8') + b'\n')
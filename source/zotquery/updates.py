@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+"""Check for new versions of ZotQuery without slowing down any run.
+
+Runs only look at two empty files in the workflow's cache directory:
+
+- :data:`CHECKED`, whose modification time is when the last check
+  was started. If it is older than `config.UPDATE_FREQUENCY` days,
+  :func:`schedule` starts a new check in a background job.
+- :data:`AVAILABLE`, which the background job creates when GitHub
+  has a newer release. While it exists, :func:`install` downloads
+  and installs the release, also in the background.
+
+Neither costs more than a `stat`, so searches don't wait for the
+update cache or the network.
+
+"""
+from __future__ import unicode_literals
+
+# Standard Library
+import os
+import sys
+from time import time
+
+# Internal Dependencies
+import config
+
+# Alfred-Workflow
+from workflow.background import is_running, run_in_background
+
+CHECKED = 'update-checked'
+AVAILABLE = 'update-available'
+
+
+def touch(path):
+    with open(path, 'wb'):
+        pass
+
+
+# 1.  -------------------------------------------------------------------------
+def schedule(wf):
+    """Start a background update check if one is due.
+
+    :param wf: a :class:`Workflow` instance
+    :type wf: :class:`object`
+    :returns: ``True`` if a check was started
+    :rtype: :class:`bool`
+
+    """
+    stamp = wf.cachefile(CHECKED)
+    try:
+        age = time() - os.stat(stamp).st_mtime
+    except OSError:
+        age = None
+    if age is not None and age < config.UPDATE_FREQUENCY * 86400:
+        return False
+    if is_running('update'):
+        return False
+    # Mark the check as started, so the following runs don't start
+    # another one, even if this one fails (e.g. when offline)
+    touch(stamp)
+    cmd = [sys.executable, wf.workflowfile('zotquery.py'),
+           'configure', 'update']
+    run_in_background('update', cmd)
+    return True
+
+
+# 2.  -------------------------------------------------------------------------
+def available(wf):
+    """Has the last check found a newer release?"""
+    return os.path.exists(wf.cachefile(AVAILABLE))
+
+
+# 3.  -------------------------------------------------------------------------
+def check(wf):
+    """Ask GitHub for a newer release and set the flag file accordingly.
+
+    Runs in the background job started by :func:`schedule`.
+
+    :param wf: a :class:`Workflow` instance
+    :type wf: :class:`object`
+
+    """
+    from workflow import update
+
+    flag = wf.cachefile(AVAILABLE)
+    found = False
+    if wf.settings.get('__workflow_autoupdate', True):
+        found = update.check_update(config.GITHUB_SLUG, config.__version__,
+                                    wf.settings.get('__workflow_prereleases',
+                                                    False))
+    if found:
+        touch(flag)
+    elif os.path.exists(flag):
+        os.unlink(flag)
+    config.log.info('Update available? %s', found)
+
+
+# 4.  -------------------------------------------------------------------------
+def install(wf):
+    """Download and install the release found by :func:`check`.
+
+    :param wf: a :class:`Workflow` instance
+    :type wf: :class:`object`
+
+    """
+    import workflow
+
+    os.unlink(wf.cachefile(AVAILABLE))
+    script = os.path.join(os.path.dirname(workflow.__file__), 'update.py')
+    cmd = [sys.executable, script, 'install', config.GITHUB_SLUG,
+           config.__version__]
+    config.log.info('Installing update ...')
+    run_in_background('update-install', cmd)
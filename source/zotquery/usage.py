@@ -0,0 +1,180 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+"""Record which items are opened, exported and appended.
+
+An item's score is the number of times it has been used, with each use
+counting half as much for every `config.FRECENCY_HALF_LIFE` days that
+have passed since.
+
+All scores are stored as they are (or will be) at one time, the
+`anchor` of the database, using the decay rate stored with it. Their
+order therefore doesn't change as time passes, and a search multiplies
+them all by the same factor (see :func:`factor`) to decay them to the
+present. It calls Python for that factor once, not for every row.
+The anchor moves forward before stored scores would grow too large,
+and scores are converted to a new half-life at the next recorded use.
+
+Search queries join the `items` table on its primary key and add the
+decayed score (times `config.FRECENCY_WEIGHT`) to each result's rank
+with :data:`BOOST_SQL`. Their connection must have :func:`factor`
+registered as the SQL function `frecency`.
+
+"""
+from __future__ import unicode_literals
+
+# Standard Library
+from contextlib import closing
+import math
+import sqlite3
+from time import time
+
+# Internal Dependencies
+import config
+
+# Bump when the layout of the database changes to force a rebuild
+VERSION = 2
+
+# Rank boost of the item joined as `used` (see :func:`boost_params`).
+# The subquery doesn't depend on the row, so it is run once.
+BOOST_SQL = ('IFNULL(used.score * (SELECT frecency(time, rate, ?) '
+             'FROM usage.anchor), 0) * ?')
+
+# Largest exponent of the growth of a score stored at the anchor
+# before the anchor is moved (``e**30`` is about ``10**13``)
+MAX_GROWTH = 30
+
+
+def decay_rate():
+    """Return λ for `config.FRECENCY_HALF_LIFE` (in days)."""
+    return math.log(2) / (config.FRECENCY_HALF_LIFE * 86400)
+
+
+def factor(anchor, rate, now):
+    """Return the factor that decays scores from ``anchor`` to ``now``.
+
+    :param anchor: time the scores are stored at
+    :type anchor: :class:`float`
+    :param rate: decay rate the scores are stored with
+    :type rate: :class:`float`
+    :param now: time of search
+    :type now: :class:`float`
+    :rtype: :class:`float`
+
+    """
+    # Searches before the anchor (e.g. after the clock was reset) scale
+    # scores up, but not without limit
+    return math.exp(min(rate * (anchor - now), MAX_GROWTH))
+
+
+# 1.  -------------------------------------------------------------------------
+def create_db(db):
+    """Create the usage tables.
+
+    :param db: path to `.db` file
+    :type db: :class:`unicode`
+
+    """
+    with closing(sqlite3.connect(db)) as con:
+        with con as cur:
+            cur.execute("""CREATE TABLE IF NOT EXISTS items (
+                               key TEXT PRIMARY KEY NOT NULL,
+                               score REAL NOT NULL DEFAULT 0,
+                               uses INTEGER NOT NULL DEFAULT 0,
+                               last_used REAL
+                           ) WITHOUT ROWID""")
+            cur.execute("""CREATE TABLE IF NOT EXISTS anchor (
+                               time REAL NOT NULL,
+                               rate REAL NOT NULL
+                           )""")
+            if not cur.execute('SELECT 1 FROM anchor').fetchone():
+                cur.execute('INSERT INTO anchor VALUES (?, ?)',
+                            (time(), decay_rate()))
+            cur.execute('PRAGMA user_version = {:d}'.format(VERSION))
+
+
+# 2.  -------------------------------------------------------------------------
+def record(db, key, when=None):
+    """Record a use of item ``key``.
+
+    :param db: path to `.db` file created by :func:`create_db`
+    :type db: :class:`unicode`
+    :param key: Zotero key of item
+    :type key: :class:`unicode`
+    :param when: time of use (default: now)
+    :type when: :class:`float`
+
+    """
+    when = when or time()
+    rate = decay_rate()
+    with closing(sqlite3.connect(db)) as con:
+        with con as cur:
+            anchor, old_rate = cur.execute(
+                'SELECT time, rate FROM anchor').fetchone()
+            if old_rate != rate or rate * (when - anchor) > MAX_GROWTH:
+                anchor = rebase(cur, anchor, old_rate, max(when, anchor),
+                                rate)
+            cur.execute('INSERT OR IGNORE INTO items (key) VALUES (?)',
+                        (key,))
+            cur.execute("""UPDATE items
+                           SET score = score + ?, uses = uses + 1,
+                               last_used = MAX(IFNULL(last_used, ?), ?)
+                           WHERE key = ?""",
+                        (math.exp(rate * (when - anchor)), when, when, key))
+    config.log.debug('Recorded use of %s', key)
+
+
+## 2.1  -----------------------------------------------------------------------
+def rebase(cur, anchor, old_rate, new_anchor, rate):
+    """Store the scores at ``new_anchor`` with decay ``rate``.
+
+    Each score is taken as it was at the item's last use, and decayed
+    with the new rate from there.
+
+    :returns: ``new_anchor``
+    :rtype: :class:`float`
+
+    """
+    rows = cur.execute("""SELECT key, score, last_used FROM items
+                          WHERE score > 0""").fetchall()
+    for key, score, last_used in rows:
+        # Exponents are added first, as each part may overflow
+        score = math.exp(math.log(score) +
+                         old_rate * (anchor - last_used) -
+                         rate * (new_anchor - last_used))
+        cur.execute('UPDATE items SET score = ? WHERE key = ?',
+                    (score, key))
+    cur.execute('UPDATE anchor SET time = ?, rate = ?', (new_anchor, rate))
+    config.log.debug('Moved usage scores to %s', new_anchor)
+    return new_anchor
+
+
+# 3.  -------------------------------------------------------------------------
+def boost_params(now=None):
+    """Return the parameters of :data:`BOOST_SQL`.
+
+    :param now: time of search (default: now)
+    :type now: :class:`float`
+    :rtype: :class:`list`
+
+    """
+    return [now or time(), config.FRECENCY_WEIGHT]
+
+
+def score(db, key, now=None):
+    """Return the current score of item ``key``.
+
+    :param db: path to `.db` file created by :func:`create_db`
+    :type db: :class:`unicode`
+    :rtype: :class:`float`
+
+    """
+    with closing(sqlite3.connect(db)) as con:
+        row = con.execute("""SELECT items.score, anchor.time, anchor.rate
+                             FROM items, anchor
+                             WHERE items.key = ?""", (key,)).fetchone()
+    if row is None:
+        return 0.0
+    return row[0] * factor(row[1], row[2], now or time())
@@ -0,0 +1,404 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+"""Keep-alive HTTP client for the Zotero web API.
+
+`workflow.web` opens a new connection (and, for HTTPS, does a new TLS
+handshake) for every request. Here, connections are kept open after
+each response and reused by the next request to the same host, so a
+multi-request export only connects once. Responses are requested
+gzipped.
+
+The pool is thread-safe: each thread takes an idle connection (or
+opens a new one) and puts it back when it has read the response.
+
+:class:`ResponseStore` keeps responses, so that requests can be made
+conditional and a `304 Not Modified` answered from the stored copy.
+
+:class:`Scheduler` keeps requests within the API's rate limits.
+
+"""
+from __future__ import unicode_literals
+
+# Standard Library
+from contextlib import closing
+import httplib
+import json
+import random
+import socket
+import sqlite3
+import threading
+import time
+import urllib
+import urlparse
+import zlib
+
+# Internal Dependencies
+import config
+
+# Idle connections kept open per host
+POOL_SIZE = 4
+
+# Seconds to wait for a connection or response
+TIMEOUT = 60
+
+# Seconds before the first retry of an overloaded request (doubled for
+# each further retry), unless the server says (`Retry-After`)
+RETRY_WAIT = 1
+
+# Status codes of requests that are retried
+RETRY_STATUS = (429, 503)
+
+# Most responses a :class:`ResponseStore` keeps, and seconds it keeps
+# each one for
+MAX_RESPONSES = 1000
+MAX_RESPONSE_AGE = 30 * 86400
+
+
+class HTTPError(IOError):
+    """Raised by :meth:`Response.raise_for_status` for 4xx/5xx status."""
+
+    def __init__(self, response):
+        IOError.__init__(self, 'HTTP {} for {}'.format(response.status_code,
+                                                       response.url))
+        self.code = response.status_code
+        self.response = response
+
+
+class Response(object):
+    """Response to a request (like `workflow.web.Response`).
+
+    :ivar status_code: HTTP status code
+    :ivar headers: `dict` of headers, with lowercase names
+    :ivar content: body of response (decompressed)
+
+    """
+
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        """Raise :class:`HTTPError` if the request failed."""
+        if self.status_code >= 400:
+            raise HTTPError(self)
+
+
+# 1.  -------------------------------------------------------------------------
+class ConnectionPool(object):
+    """Open connections, by ``(scheme, host, port)``."""
+
+    def __init__(self, size=POOL_SIZE, timeout=TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+        # Number of connections opened (for tests and benchmarks)
+        self.opened = 0
+
+    def request(self, method, url, params=None, headers=None):
+        """Make an HTTP request. Return :class:`Response`.
+
+        :param method: HTTP method, e.g. ``'GET'``
+        :type method: :class:`unicode`
+        :param url: URL of resource
+        :type url: :class:`unicode`
+        :param params: query string parameters
+        :type params: :class:`dict`
+        :param headers: extra HTTP headers
+        :type headers: :class:`dict`
+        :rtype: :class:`Response`
+
+        """
+        url = build_url(url, params)
+        parts = urlparse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        send = {'Accept-Encoding': 'gzip', 'Connection': 'keep-alive'}
+        send.update(headers or {})
+        send = encode(send)
+
+        key = (parts.scheme, parts.hostname, parts.port)
+        con, reused = self._get(key)
+        try:
+            try:
+                res = self._send(con, method, path, send)
+            except (httplib.HTTPException, socket.error):
+                if not reused:
+                    raise
+                # The server has closed the idle connection: retry once
+                # with a new one
+                con.close()
+                con, reused = self._connect(key), False
+                res = self._send(con, method, path, send)
+            content = res.read()
+        except Exception:
+            con.close()
+            raise
+
+        if res.will_close:
+            con.close()
+        else:
+            self._put(key, con)
+
+        if res.getheader('content-encoding') == 'gzip':
+            content = zlib.decompress(content, 16 + zlib.MAX_WBITS)
+        headers = dict((k.lower(), v) for k, v in res.getheaders())
+        return Response(url, res.status, headers, content)
+
+    @staticmethod
+    def _send(con, method, path, headers):
+        con.request(method, path, headers=headers)
+        return con.getresponse()
+
+    def _get(self, key):
+        """Return ``(connection, reused)`` for ``key``."""
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._connect(key), False
+
+    def _put(self, key, con):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.size:
+                idle.append(con)
+                return
+        con.close()
+
+    def _connect(self, key):
+        scheme, host, port = key
+        cls = (httplib.HTTPSConnection if scheme == 'https'
+               else httplib.HTTPConnection)
+        with self._lock:
+            self.opened += 1
+        config.log.debug('Connecting to %s://%s', scheme, host)
+        return cls(host, port, timeout=self.timeout)
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            for idle in self._idle.values():
+                for con in idle:
+                    con.close()
+            self._idle.clear()
+
+
+def build_url(url, params=None):
+    """Return ``url`` with query string ``params`` added.
+
+    Parameters are sorted, so the same request always has the same URL.
+
+    """
+    if not params:
+        return url
+    query = urllib.urlencode(sorted(encode(params).items()))
+    return url + ('&' if '?' in url else '?') + query
+
+
+def encode(data):
+    """Return copy of ``dict`` ``data`` with UTF-8 encoded strings."""
+    return dict((k.encode('utf-8') if isinstance(k, unicode) else k,
+                 v.encode('utf-8') if isinstance(v, unicode) else v)
+                for k, v in data.items())
+
+
+# 2.  -------------------------------------------------------------------------
+# Shared by all requests of this process
+pool = ConnectionPool()
+
+
+def get(url, params=None, headers=None):
+    """Make a GET request with the shared connection pool.
+
+    :rtype: :class:`Response`
+
+    """
+    return pool.request('GET', url, params, headers)
+
+
+# 3.  -------------------------------------------------------------------------
+class ResponseStore(object):
+    """Responses, by URL, in an SQLite database.
+
+    Only the latest response for each URL is kept, and only the
+    ``max_rows`` most recently stored responses that are at most
+    ``max_age`` seconds old. Connections aren't shared, so a store can
+    be used from several threads.
+
+    """
+
+    # Bump when the layout of the database changes
+    VERSION = 1
+
+    def __init__(self, path, max_rows=MAX_RESPONSES,
+                 max_age=MAX_RESPONSE_AGE):
+        self.path = path
+        self.max_rows = max_rows
+        self.max_age = max_age
+        with closing(sqlite3.connect(self.path)) as con:
+            with con as cur:
+                version = cur.execute('PRAGMA user_version').fetchone()[0]
+                if version != self.VERSION:
+                    # Stored responses can always be fetched again
+                    cur.execute('DROP TABLE IF EXISTS responses')
+                cur.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                   url TEXT PRIMARY KEY NOT NULL,
+                                   headers TEXT NOT NULL,
+                                   content BLOB NOT NULL,
+                                   stored REAL NOT NULL
+                               )""")
+                cur.execute("""CREATE INDEX IF NOT EXISTS responses_stored
+                               ON responses (stored)""")
+                cur.execute('PRAGMA user_version = {:d}'.format(
+                    self.VERSION))
+
+    def get(self, url):
+        """Return stored response for ``url`` (or ``None``).
+
+        :rtype: :class:`Response`
+
+        """
+        with closing(sqlite3.connect(self.path)) as con:
+            row = con.execute('SELECT headers, content FROM responses '
+                              'WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+        return Response(url, 200, json.loads(row[0]), bytes(row[1]))
+
+    def put(self, response):
+        """Store ``response`` (replacing any for its URL).
+
+        :param response: response with status 200
+        :type response: :class:`Response`
+
+        """
+        now = time.time()
+        with closing(sqlite3.connect(self.path)) as con:
+            with con as cur:
+                cur.execute('INSERT OR REPLACE INTO responses '
+                            '(url, headers, content, stored) '
+                            'VALUES (?, ?, ?, ?)',
+                            (response.url, json.dumps(response.headers),
+                             sqlite3.Binary(response.content), now))
+                self._evict(cur, now)
+
+    def _evict(self, cur, now):
+        """Delete responses that are too old or too many."""
+        cur.execute('DELETE FROM responses WHERE stored < ?',
+                    (now - self.max_age,))
+        cur.execute("""DELETE FROM responses WHERE url IN (
+                           SELECT url FROM responses
+                           ORDER BY stored DESC LIMIT -1 OFFSET ?)""",
+                    (self.max_rows,))
+
+
+# 4.  -------------------------------------------------------------------------
+class Scheduler(object):
+    """Spaces out requests and waits when the server asks.
+
+    Requests are spaced by a token bucket: up to ``rate`` requests may
+    be sent at once, then ``rate`` per second. The token of a request
+    answered `304 Not Modified` is given back, as such responses cost
+    the API little. When a response has a `Backoff` or `Retry-After` header, no request is
+    sent (by any thread) for that many seconds. Requests answered with
+    status 429 or 503 are retried up to ``retries`` times, each after a
+    random extra wait, so threads don't all retry at the same moment.
+
+    """
+
+    def __init__(self, rate, retries):
+        self.rate = float(rate)
+        self.retries = retries
+        self._tokens = self.rate
+        self._updated = time.time()
+        # No request is sent before this time
+        self._paused = 0
+        self._lock = threading.Lock()
+
+    def send(self, func, *args, **kwargs):
+        """Return ``func(*args, **kwargs)`` when it may be called.
+
+        :param func: function that makes a request
+        :type func: callable returning :class:`Response`
+        :rtype: :class:`Response`
+
+        """
+        jitter = 0
+        for attempt in range(self.retries + 1):
+            self.wait(jitter)
+            res = func(*args, **kwargs)
+            if res.status_code == 304:
+                self.refund()
+            backoff = seconds(res.headers.get('backoff'))
+            if backoff:
+                self.pause(backoff)
+            if (res.status_code not in RETRY_STATUS or
+                    attempt == self.retries):
+                return res
+            delay = (seconds(res.headers.get('retry-after')) or
+                     RETRY_WAIT * 2 ** attempt)
+            config.log.warning('HTTP %d for %s, retrying in %0.1fs',
+                               res.status_code, res.url, delay)
+            self.pause(delay)
+            # This thread's own wait after the pause (which all threads
+            # share)
+            jitter = random.uniform(0, delay)
+        return res
+
+    def wait(self, extra=0):
+        """Wait for a token (and until any pause is over).
+
+        :param extra: seconds to wait after that
+        :type extra: :class:`float`
+
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.rate, self._tokens +
+                               (now - self._updated) * self.rate)
+            self._updated = now
+            delay = max(self._paused - now, 0)
+            if self._tokens < 1:
+                delay = max(delay, (1 - self._tokens) / self.rate)
+            # Taken now, so the next thread waits for the one after
+            self._tokens -= 1
+        delay += extra
+        if delay:
+            time.sleep(delay)
+
+    def pause(self, delay):
+        """Send no requests for ``delay`` seconds."""
+        with self._lock:
+            self._paused = max(self._paused, time.time() + delay)
+
+    def refund(self):
+        """Give back the token taken for a request."""
+        with self._lock:
+            self._tokens = min(self.rate, self._tokens + 1)
+
+
+def seconds(value):
+    """Return number of seconds in header ``value`` (or ``None``)."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        # HTTP dates aren't used by the Zotero API
+        return None
+
+
+# Shared by all requests to the Zotero API
+scheduler = Scheduler(config.API_RATE, config.API_RETRIES)
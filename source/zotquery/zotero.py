@@ -8,18 +8,20 @@
 from __future__ import unicode_literals
 
 # Standard Library
+from collections import OrderedDict
+import json
 import os
 import re
+import threading
 import os.path
-import subprocess
 
 # Internal Dependencies
 import config
-from lib import pashua, utils
+import discover
 from config import PropertyBase, stored_property
 
 # Alfred-Workflow
-from workflow import Workflow, web
+from workflow import Workflow
 
 # create global methods from `Workflow()`
 WF = Workflow()
@@ -57,6 +59,7 @@ class LocalZotero(PropertyBase):
         self.wf = wf
         # initialize base class, for access to `properties` dict
         PropertyBase.__init__(self, self.wf, secured=False)
+        self.validate()
 
     # Properties --------------------------------------------------------------
 
@@ -68,12 +71,7 @@ class LocalZotero(PropertyBase):
         :rtype: ``unicode``
 
         """
-        # Use `mdfind` to locate Zotero sqlite database
-        sqlites = self.find_name('zotero.sqlite')
-        if sqlites:
-            for item in sqlites:
-                if item.startswith('/Users'):
-                    return item
+        return discover.sqlite()
 
     @stored_property
     def internal_storage(self):
@@ -93,7 +91,7 @@ class LocalZotero(PropertyBase):
             for name in ('dataDir', 'lastDataDir'):
                 dir_pref = self.get_pref(name)
                 if dir_pref:
-                    return dir_pref
+                    return os.path.join(dir_pref, 'storage')
 
     @stored_property
     def external_storage(self):
@@ -108,6 +106,23 @@ class LocalZotero(PropertyBase):
 
     # Utility methods ---------------------------------------------------------
 
+    def validate(self):
+        """Find all paths again if Zotero's database is no longer where
+        it was stored (e.g. if Zotero's data directory has moved).
+
+        Storage directories aren't checked: they may not exist (yet).
+
+        """
+        path = self.properties.get('original_sqlite')
+        if not path or os.path.exists(path):
+            return
+        config.log.info('Zotero database has moved from %s', path)
+        for prop in self.persistent_properties:
+            self.properties[prop] = None
+        for prop in self.persistent_properties:
+            self.properties[prop] = getattr(self, prop)
+        self.wf.store_data(self.filename, self.properties, serializer='json')
+
     def get_pref(self, pref):
         """Retrieve the value for ``pref`` in Zotero's preferences.
 
@@ -117,22 +132,11 @@ class LocalZotero(PropertyBase):
         :rtype: ``unicode``
 
         """
-        dirs = self.find_name('prefs.js')
-        for path in dirs:
-            if 'Zotero' or 'Firefox' in path:
-                # Read text from file at `path`
-                prefs = utils.read_path(path)
-                pref_re = r'{}",\s"(.*?)"'.format(pref)
-                data_dir = re.search(pref_re, prefs)
-                try:
-                    return data_dir.group(1)
-                except AttributeError:
-                    pass
-        return None
+        return discover.prefs().get(pref)
 
     @staticmethod
     def find_name(name):
-        """Use `mdfind` to locate file given its ``name``.
+        """Scan the home directory for files called ``name``.
 
         :param name: full name of desired file
         :type name: ``unicode`` or ``str``
@@ -140,14 +144,7 @@ class LocalZotero(PropertyBase):
         :rtype: :class:`list`
 
         """
-        cmd = ['mdfind',
-               'kMDItemFSName={}'.format(name),
-               '-onlyin',
-               '/']
-        output = subprocess.check_output(cmd)
-        # Convert newline delimited str into clean list
-        output = [s.strip() for s in decode(output).split('\n')]
-        return filter(None, output)
+        return discover.scan(name)
 
 
 #------------------------------------------------------------------------------
@@ -169,6 +166,9 @@ class WebZotero(PropertyBase):
         PropertyBase.__init__(self, self.wf, secured=True)
         self.request = None
         self.links = None
+        self._responses = None
+        # The store is created by whichever request thread needs it first
+        self._responses_lock = threading.Lock()
 
     # API Properties ----------------------------------------------------------
 
@@ -216,39 +216,172 @@ class WebZotero(PropertyBase):
             cb.type=cancelbutton
         """.format(api=api, uid=uid)
         # Run `pashua` dialog and save results to Keychain
+        # (imported here, as only settings dialogs need it)
+        from lib import pashua
         res_dict = pashua.run(conf, encoding='utf8', pashua_path=config.PASHUA)
         if res_dict['cb'] != '1':
-            self.wf.save_password('api_key', res_dict['api'])
-            self.wf.save_password('user_id', res_dict['id'])
+            self.save_password('api_key', res_dict['api'])
+            self.save_password('user_id', res_dict['id'])
+            # Replace the old values stored with the other properties
+            # (unless they are being generated, see `get_properties`)
+            properties = getattr(self, 'properties', None)
+            if isinstance(properties, dict):
+                properties.update(api_key=res_dict['api'],
+                                  user_id=res_dict['id'])
+                self.save_password(self.filename, json.dumps(properties))
+
+    @property
+    def responses(self):
+        """:class:`webclient.ResponseStore` of earlier API responses
+        (or ``None`` if `config.API_RESPONSES` is turned off).
+
+        """
+        with self._responses_lock:
+            if self._responses is None and config.API_RESPONSES:
+                import webclient
+                self._responses = webclient.ResponseStore(
+                    self.wf.cachefile(config.API_RESPONSES))
+        return self._responses
 
     # Basic methods -----------------------------------------------------------
 
-    def _retrieve_data(self, request=None, **kwargs):
-        """Retrieve Zotero items via the API.
+    def _request(self, request, **kwargs):
+        """Make API request. Return the response.
 
-        Combine endpoint and request to access the specific resource.
+        Unlike :meth:`_retrieve_data`, this changes no attributes, so
+        it can be called from several threads.
 
-        Returns an JSON object
+        If there is a stored response for the same URL, the request is
+        conditional on the resource having changed since (i.e. on its
+        `Last-Modified-Version`). If it hasn't, the API answers `304
+        Not Modified` and the stored response is returned instead.
+
+        :param request: endpoint (e.g. ``/users/1/items``) or full URL
+            (e.g. of a `next` link)
+        :type request: :class:`unicode`
+        :rtype: :class:`webclient.Response`
 
         """
-        # generate URL
-        full_url = '{}{}'.format(self.base, request)
+        # generate URL (links returned by the API are complete)
+        if request.startswith('http'):
+            full_url = request
+        else:
+            full_url = '{}{}'.format(self.base, request)
+            # ensure return format is JSON
+            kwargs.update({'format': 'json'})
         # prepare HTTP headers
         headers = {'User-Agent': "ZotQuery/{}".format(config.__version__),
                    'Authorization': "Bearer {}".format(self.api_key),
                    'Zotero-API-Version': 3}
-                   #'If-Modified-Since-Version': 645}
-        # ensure return format is JSON
-        kwargs.update({'format': 'json'})
-        # make HTTP request
-        self.request = web.get(url=full_url,
-                               headers=headers,
-                               params=kwargs)
+        # make HTTP request over a kept-alive connection (the HTTP
+        # client is only imported for actions that use the web API)
+        import webclient
+        full_url = webclient.build_url(full_url, kwargs)
+        store = self.responses
+        stored = store.get(full_url) if store else None
+        if stored and 'last-modified-version' in stored.headers:
+            headers['If-Modified-Since-Version'] = \
+                stored.headers['last-modified-version']
+        # wait if the API has asked, and retry if it is overloaded
+        # (`304`s cost the API little, so don't count against its limit)
+        res = webclient.scheduler.send(webclient.get, full_url,
+                                       headers=headers)
+        if res.status_code == 304 and stored:
+            config.log.debug('Not modified: %s', full_url)
+            return stored
+        if (store and res.status_code == 200 and
+                'last-modified-version' in res.headers):
+            store.put(res)
+        return res
+
+    def _retrieve_data(self, request=None, **kwargs):
+        """Retrieve Zotero items via the API.
+
+        Combine endpoint and request to access the specific resource.
+
+        Returns an JSON object
+
+        """
+        self.request = self._request(request, **kwargs)
         # get any and all relative links from response
         self.links = self._extract_links()
         self.request.raise_for_status()
         return self.request.json()
 
+    def _retrieve_all(self, request=None, **kwargs):
+        """Retrieve all pages of a multi-page result via the API.
+
+        The first page says how many results there are in total
+        (`Total-Results`), so the other pages are then fetched at the
+        same time (by up to `config.API_WORKERS` threads).
+
+        Returns a JSON list
+
+        """
+        kwargs.pop('start', None)
+        kwargs['limit'] = config.API_PAGE_SIZE
+        results = self._retrieve_data(request, **kwargs)
+        try:
+            total = int(self.request.headers['total-results'])
+        except (KeyError, ValueError):
+            # Without a total, pages can only be followed one by one
+            while self.links and self.links.get('next'):
+                results.extend(self.follow())
+            return results
+        if not results:
+            return results
+        # The API may return fewer results per page than asked for
+        starts = range(len(results), total, len(results))
+        queries = [dict(kwargs, start=start) for start in starts]
+        for page in self._retrieve_many(request, queries):
+            results.extend(page)
+        return results
+
+    def _retrieve_items(self, item_keys, **kwargs):
+        """Retrieve the items with keys ``item_keys`` via the API.
+
+        The API takes up to `config.API_KEYS_PER_REQUEST` keys per
+        request, so keys are requested in chunks, at the same time.
+
+        Returns a JSON list of the items, in the order of their (first)
+        key in ``item_keys``
+
+        """
+        keys = list(OrderedDict.fromkeys(item_keys))
+        size = config.API_KEYS_PER_REQUEST
+        chunks = [keys[i:i + size] for i in range(0, len(keys), size)]
+        queries = [dict(kwargs, itemKey=','.join(chunk), limit=len(chunk))
+                   for chunk in chunks]
+        found = {}
+        for page in self._retrieve_many(self._prep_url('/{t}/{u}/items'),
+                                        queries):
+            for item in page:
+                found[item['key']] = item
+        return [found[key] for key in keys if key in found]
+
+    def _retrieve_many(self, request, queries):
+        """Make a request for each ``dict`` of parameters in ``queries``,
+        up to `config.API_WORKERS` at the same time.
+
+        Returns a list of the JSON results, in the order of ``queries``
+
+        """
+        def fetch(params):
+            res = self._request(request, **params)
+            res.raise_for_status()
+            return res.json()
+
+        if len(queries) < 2:
+            return [fetch(params) for params in queries]
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(config.API_WORKERS, len(queries)))
+        try:
+            # `map` returns the results in order
+            return pool.map(fetch, queries)
+        finally:
+            pool.close()
+            pool.join()
+
     def _prep_url(self, url, var=None):
         """Properly format Zotero API URL."""
         if var is None:
@@ -275,16 +408,28 @@ class WebZotero(PropertyBase):
     # Decorators  -------------------------------------------------------------
 
     def general_query(func):
-        """Decorator for generic API calls."""
-        def func_wrapper(self, **kwargs):
+        """Decorator for generic API calls.
+
+        With ``paginate=True``, all pages of results are retrieved.
+
+        """
+        def func_wrapper(self, paginate=False, **kwargs):
             url = self._prep_url(func(self))
+            if paginate:
+                return self._retrieve_all(url, **kwargs)
             return self._retrieve_data(url, **kwargs)
         return func_wrapper
 
     def specific_query(func):
-        """Decorator for specific API calls."""
-        def func_wrapper(self, item_id, **kwargs):
+        """Decorator for specific API calls.
+
+        With ``paginate=True``, all pages of results are retrieved.
+
+        """
+        def func_wrapper(self, item_id, paginate=False, **kwargs):
             url = self._prep_url(func(self, item_id), item_id)
+            if paginate:
+                return self._retrieve_all(url, **kwargs)
             return self._retrieve_data(url, **kwargs)
         return func_wrapper
 
@@ -396,12 +541,10 @@ class WebZotero(PropertyBase):
         """
         return "/{t}/{u}/collections/{x}/items"
 
-    #TODO: broken
     def follow(self):
         """Return the result of the call to the URL in the 'Next' link."""
-        if self.links:
-            url = self.links.get('next')
-            return self._retrieve_data(url)
+        if self.links and self.links.get('next'):
+            return self._retrieve_data(self.links['next'])
         else:
             return None
 
@@ -419,7 +562,7 @@ class WebZotero(PropertyBase):
         info = self.items(include='bib',
                           tag=tag_name,
                           itemType='-attachment || note',
-                          limit=100,
+                          paginate=True,
                           **kwargs)
         return [x['bib'] for x in info]
 
@@ -427,16 +570,14 @@ class WebZotero(PropertyBase):
         info = self.collection_items(collection,
                                      include='bib',
                                      itemType='-attachment || note',
-                                     limit=100,
+                                     paginate=True,
                                      **kwargs)
         return [x['bib'] for x in info]
 
     def items_references(self, item_keys, **kwargs):
-        keys = ','.join(item_keys)
-        info = self.items(include='bib',
-                          itemKeys=keys,
-                          limit=100,
-                          **kwargs)
+        info = self._retrieve_items(item_keys,
+                                    include='bib',
+                                    **kwargs)
         return [x['bib'] for x in info]
 
     ## ------------------------------------------------------------------------
@@ -450,11 +591,9 @@ class WebZotero(PropertyBase):
         return info['citation']
 
     def items_citations(self, item_keys, **kwargs):
-        keys = ','.join(item_keys)
-        info = self.items(include='citation',
-                          itemKeys=keys,
-                          limit=100,
-                          **kwargs)
+        info = self._retrieve_items(item_keys,
+                                    include='citation',
+                                    **kwargs)
         return [x['citation'] for x in info]
 
     ## ------------------------------------------------------------------------
@@ -462,10 +601,9 @@ class WebZotero(PropertyBase):
     ## ------------------------------------------------------------------------
 
     def items_bibliography(self, item_keys, **kwargs):
-        keys = ','.join(item_keys)
-        info = self.items(include='citation,bib',
-                          itemKey=keys,
-                          **kwargs)
+        info = self._retrieve_items(item_keys,
+                                    include='citation,bib',
+                                    **kwargs)
         citations = [x['citation'] for x in info]
         references = [x['bib'] for x in info]
         return {'cites': citations, 'refs': references}